@@ -0,0 +1,432 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import engine
+from models import AlertState
+
+logger = logging.getLogger(__name__)
+
+ALERT_WEBHOOK_URLS = [u.strip() for u in os.getenv("ALERT_WEBHOOK_URLS", "").split(",") if u.strip()]
+ALERT_RULES = os.getenv("ALERT_RULES", "")  # JSON list of rule definitions
+ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE", "")
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "900"))
+ALERT_MAX_PER_MINUTE = int(os.getenv("ALERT_MAX_PER_MINUTE", "20"))
+ALERT_STATE_INTERVAL = float(os.getenv("ALERT_STATE_INTERVAL", "5"))  # Seconds between saves of rule state
+
+
+class Rule(ABC):
+    """Base class for alert rules.
+
+    Rules keep only constant-size state so each reading is evaluated in O(1).
+    `check` returns None when the rule has nothing to say about the reading,
+    otherwise (triggered, value, message). Hysteresis is applied by the rule
+    itself, using `active` to know which side of the band it is on.
+    """
+
+    type = "base"
+
+    def __init__(self, name: str, field: Optional[str] = None, severity: str = "warning"):
+        self.name = name
+        self.field = field
+        self.severity = severity
+
+    @abstractmethod
+    def check(self, value, ts: datetime, active: bool) -> Optional[tuple[bool, Optional[float], str]]:
+        """Evaluate the rule against one reading's value."""
+
+    def check_idle(self, now: datetime, active: bool) -> Optional[tuple[bool, Optional[float], str]]:
+        """Re-check the rule without a new reading (used by the periodic tick)."""
+        return None
+
+
+class ThresholdRule(Rule):
+    """Fire when a value goes below/above a limit, clear once back past the hysteresis band."""
+
+    type = "threshold"
+
+    def __init__(self, name, field, below=None, above=None, hysteresis=0.0, **kwargs):
+        super().__init__(name, field, **kwargs)
+        if below is None and above is None:
+            raise ValueError(f"Rule {name}: threshold needs 'below' or 'above'")
+        self.below = below
+        self.above = above
+        self.hysteresis = hysteresis
+
+    def check(self, value, ts, active):
+        if value is None:
+            return None
+        margin = self.hysteresis if active else 0.0
+        if self.below is not None and value < self.below + margin:
+            return True, value, f"{self.field}={value} below {self.below}"
+        if self.above is not None and value > self.above - margin:
+            return True, value, f"{self.field}={value} above {self.above}"
+        return False, value, f"{self.field}={value} back within limits"
+
+
+class RateOfChangeRule(Rule):
+    """Fire when a value changes faster than a limit (units per minute)."""
+
+    type = "rate_of_change"
+
+    def __init__(self, name, field, max_drop=None, max_rise=None, **kwargs):
+        super().__init__(name, field, **kwargs)
+        if max_drop is None and max_rise is None:
+            raise ValueError(f"Rule {name}: rate_of_change needs 'max_drop' or 'max_rise'")
+        self.max_drop = max_drop
+        self.max_rise = max_rise
+        self._prev: Optional[tuple[datetime, float]] = None
+
+    def check(self, value, ts, active):
+        if value is None:
+            return None
+        prev, self._prev = self._prev, (ts, value)
+        if prev is None:
+            return None
+        minutes = (ts - prev[0]).total_seconds() / 60
+        if minutes <= 0:
+            return None
+        rate = (value - prev[1]) / minutes
+        if self.max_drop is not None and rate < -self.max_drop:
+            return True, round(rate, 2), f"{self.field} dropping {abs(rate):.1f}/min"
+        if self.max_rise is not None and rate > self.max_rise:
+            return True, round(rate, 2), f"{self.field} rising {rate:.1f}/min"
+        return False, round(rate, 2), f"{self.field} rate of change back to normal"
+
+
+class ZScoreRule(Rule):
+    """Fire when a value is more than `threshold` standard deviations from its rolling mean.
+
+    Running sums over a fixed-size window keep each update O(1).
+    """
+
+    type = "zscore"
+
+    def __init__(self, name, field, window=60, threshold=4.0, min_samples=10, hysteresis=0.5, **kwargs):
+        super().__init__(name, field, **kwargs)
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.hysteresis = hysteresis
+        self._window: deque[float] = deque(maxlen=window)
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def _push(self, value: float):
+        if len(self._window) == self._window.maxlen:
+            old = self._window[0]
+            self._sum -= old
+            self._sum_sq -= old * old
+        self._window.append(value)
+        self._sum += value
+        self._sum_sq += value * value
+
+    def check(self, value, ts, active):
+        if value is None:
+            return None
+        n = len(self._window)
+        result = None
+        if n >= self.min_samples:
+            mean = self._sum / n
+            std = math.sqrt(max(self._sum_sq / n - mean * mean, 0.0))
+            if std > 0:
+                z = (value - mean) / std
+                limit = self.threshold - (self.hysteresis if active else 0.0)
+                if abs(z) > limit:
+                    result = True, round(z, 2), f"{self.field}={value} is {z:+.1f} sigma from mean {mean:.2f}"
+                else:
+                    result = False, round(z, 2), f"{self.field} back within normal range"
+        self._push(value)
+        return result
+
+
+class StaleRule(Rule):
+    """Fire when no reading (or no value for `field`) has been seen for N minutes."""
+
+    type = "stale"
+
+    def __init__(self, name, field=None, minutes=10, **kwargs):
+        super().__init__(name, field, **kwargs)
+        self.minutes = minutes
+        self._last_seen: Optional[datetime] = None
+
+    def check(self, value, ts, active):
+        if self.field is None or value is not None:
+            self._last_seen = ts
+            return False, 0.0, f"{self.field or 'readings'} received again"
+        return self.check_idle(ts, active)
+
+    def check_idle(self, now, active):
+        if self._last_seen is None:
+            # Start counting from the first time we looked
+            self._last_seen = now
+            return None
+        age = (now - self._last_seen).total_seconds() / 60
+        if age >= self.minutes:
+            return True, round(age, 1), f"No {self.field or 'readings'} for {age:.0f} minutes"
+        return None
+
+
+RULE_CLASSES = {cls.type: cls for cls in (ThresholdRule, RateOfChangeRule, ZScoreRule, StaleRule)}
+
+
+def build_rule(spec: dict) -> Rule:
+    """Build a rule from a declarative definition, e.g. {"type": "threshold", ...}."""
+    spec = dict(spec)
+    rule_type = spec.pop("type", None)
+    if rule_type not in RULE_CLASSES:
+        raise ValueError(f"Unknown alert rule type: {rule_type}")
+    if "name" not in spec:
+        raise ValueError(f"Alert rule of type {rule_type} needs a 'name'")
+    return RULE_CLASSES[rule_type](**spec)
+
+
+def default_rules(min_soc: float, ingesting: bool = True) -> list[dict]:
+    """Rules used when none are configured.
+
+    Staleness rules are left out without an ingest source: nothing would
+    ever arrive, so they would only fire.
+    """
+    rules = [
+        {"name": "low_soc", "type": "threshold", "field": "battery_soc",
+         "below": min_soc, "hysteresis": 2, "severity": "critical"},
+        {"name": "pv_collapse", "type": "rate_of_change", "field": "solar_power", "max_drop": 150},
+    ]
+    if ingesting:
+        rules += [
+            {"name": "temperature_sensor_stale", "type": "stale", "field": "temperature", "minutes": 15},
+            {"name": "no_data", "type": "stale", "minutes": 10, "severity": "critical"},
+        ]
+    return rules
+
+
+def load_rules(min_soc: float, ingesting: bool = True) -> list[Rule]:
+    """Load rule definitions from ALERT_RULES / ALERT_RULES_FILE, falling back to defaults.
+
+    Invalid configuration is logged and the defaults are used, as when
+    nothing is configured, so a typo doesn't stop the backend starting.
+    """
+    try:
+        specs = None
+        if ALERT_RULES:
+            specs = json.loads(ALERT_RULES)
+        elif ALERT_RULES_FILE:
+            with open(ALERT_RULES_FILE) as f:
+                specs = json.load(f)
+        if specs is not None:
+            return [build_rule(spec) for spec in specs]
+    except (OSError, ValueError, TypeError) as e:  # JSONDecodeError is a ValueError
+        logger.error(f"Invalid alert rules ({e}); using the default rules")
+    return [build_rule(spec) for spec in default_rules(min_soc, ingesting)]
+
+
+class AlertEngine:
+    """Evaluates rules against each reading and emits events on state changes.
+
+    Only transitions (firing/resolved) produce events, so a condition that
+    stays true is reported once. A per-rule cooldown stops a flapping rule
+    from notifying more than once per ALERT_COOLDOWN_SECONDS; if a firing
+    event was suppressed its matching resolve is suppressed too.
+    """
+
+    def __init__(self, rules: list[Rule], dispatcher: Optional["WebhookDispatcher"] = None,
+                 cooldown: float = ALERT_COOLDOWN_SECONDS):
+        self.rules = rules
+        self.dispatcher = dispatcher
+        self.cooldown = cooldown
+        self._state = {
+            rule.name: {"active": False, "since": None, "value": None, "message": None,
+                        "notified": False, "last_notified": None}
+            for rule in rules
+        }
+        self.suppressed = 0
+
+    def evaluate(self, reading: dict, ts: Optional[datetime] = None) -> list[dict]:
+        """Evaluate every rule against a parsed reading."""
+        ts = ts or datetime.utcnow()
+        events = []
+        for rule in self.rules:
+            value = reading.get(rule.field) if rule.field else None
+            result = rule.check(value, ts, self._state[rule.name]["active"])
+            event = self._apply(rule, result, ts)
+            if event:
+                events.append(event)
+        return events
+
+    def check_stale(self, now: Optional[datetime] = None) -> list[dict]:
+        """Re-evaluate time-based rules when no reading has arrived."""
+        now = now or datetime.utcnow()
+        events = []
+        for rule in self.rules:
+            result = rule.check_idle(now, self._state[rule.name]["active"])
+            event = self._apply(rule, result, now)
+            if event:
+                events.append(event)
+        return events
+
+    def _apply(self, rule: Rule, result, ts: datetime) -> Optional[dict]:
+        if result is None:
+            return None
+        triggered, value, message = result
+        state = self._state[rule.name]
+        state["value"] = value
+        if triggered == state["active"]:
+            return None
+
+        state["active"] = triggered
+        state["since"] = ts if triggered else None
+        state["message"] = message if triggered else None
+        event = {
+            "rule": rule.name,
+            "type": rule.type,
+            "field": rule.field,
+            "severity": rule.severity,
+            "state": "firing" if triggered else "resolved",
+            "value": value,
+            "message": message,
+            "timestamp": ts.isoformat(),
+        }
+
+        if triggered:
+            last = state["last_notified"]
+            if last is not None and (ts - last).total_seconds() < self.cooldown:
+                state["notified"] = False
+                self.suppressed += 1
+                return None
+            state["notified"] = True
+            state["last_notified"] = ts
+        elif not state["notified"]:
+            return None
+        else:
+            state["notified"] = False
+
+        logger.warning(f"Alert {event['state']}: {rule.name} - {message}")
+        if self.dispatcher:
+            self.dispatcher.submit(event)
+        return event
+
+    def states(self) -> dict[str, dict]:
+        """Persistable state per rule (see save_states)."""
+        return {
+            name: {key: state[key] for key in ("active", "since", "value", "message")}
+            for name, state in self._state.items()
+        }
+
+    def restore(self, states: dict[str, dict]):
+        """Carry on from states saved by a previous leader, so active alerts don't fire again."""
+        for name, saved in states.items():
+            if name in self._state:
+                self._state[name].update(saved, notified=saved["active"])
+
+    def status(self, states: Optional[dict[str, dict]] = None) -> list[dict]:
+        """Current state of every rule, from this engine or from `states` (load_states)."""
+        states = self._state if states is None else states
+        idle = {"active": False, "since": None, "value": None, "message": None}
+        result = []
+        for rule in self.rules:
+            state = states.get(rule.name, idle)
+            result.append({
+                "rule": rule.name,
+                "type": rule.type,
+                "field": rule.field,
+                "severity": rule.severity,
+                "active": state["active"],
+                "since": state["since"].isoformat() if state["since"] else None,
+                "value": state["value"],
+                "message": state["message"],
+            })
+        return result
+
+
+def save_states(states: dict[str, dict]):
+    """Store the leader's rule states, so every worker can serve them."""
+    if not states:
+        return
+    now = datetime.utcnow()
+    stmt = insert(AlertState)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AlertState.rule],
+        set_={name: stmt.excluded[name] for name in ("active", "since", "value", "message", "updated_at")},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, [{"rule": name, **state, "updated_at": now} for name, state in states.items()])
+
+
+def load_states() -> dict[str, dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(select(AlertState.rule, AlertState.active, AlertState.since,
+                                   AlertState.value, AlertState.message)).all()
+    return {rule: {"active": active, "since": since, "value": value, "message": message}
+            for rule, active, since, value, message in rows}
+
+
+class WebhookDispatcher:
+    """Non-blocking webhook delivery.
+
+    `submit` never waits: events go on a bounded queue that a background
+    worker drains. Identical events still waiting in the queue are dropped,
+    and delivery is capped at `max_per_minute` events.
+    """
+
+    def __init__(self, urls: list[str], max_queue: int = 100, max_per_minute: int = ALERT_MAX_PER_MINUTE):
+        self.urls = urls
+        self.max_per_minute = max_per_minute
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._pending: set[tuple] = set()
+        self._sent_times: deque[float] = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, event: dict) -> bool:
+        if not self.urls:
+            return False
+        key = (event["rule"], event["state"])
+        if key in self._pending:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning(f"Alert queue full, dropping {event['rule']}")
+            self.dropped += 1
+            return False
+        self._pending.add(key)
+        return True
+
+    def _rate_limited(self) -> bool:
+        now = time.monotonic()
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+        if len(self._sent_times) >= self.max_per_minute:
+            return True
+        self._sent_times.append(now)
+        return False
+
+    async def run(self, client: httpx.AsyncClient):
+        """Deliver queued events until cancelled."""
+        while True:
+            event = await self._queue.get()
+            self._pending.discard((event["rule"], event["state"]))
+            if self._rate_limited():
+                logger.warning(f"Alert rate limit reached, dropping {event['rule']}")
+                self.dropped += 1
+                continue
+            for url in self.urls:
+                try:
+                    resp = await client.post(url, json=event)
+                    resp.raise_for_status()
+                    self.sent += 1
+                except httpx.HTTPError as e:
+                    self.failed += 1
+                    logger.error(f"Failed to deliver alert to {url}: {e}")
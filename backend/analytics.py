@@ -0,0 +1,238 @@
+"""Long-range aggregations over the database and the archive.
+
+Columns are loaded into numpy arrays (only the requested fields, only the
+requested range) and aggregated with sort-based group operations. On a
+million readings that takes about 0.6s from the archive; reading them out
+of SQLite costs more (about 1.5s), but SQLite only holds the retention
+window. Queries are limited to a fixed set of fields, groupings and
+aggregations.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+
+import archive
+import resample
+from database import engine
+from models import EnergyReading
+from vrm_client import READING_FIELDS
+
+NUMERIC_FIELDS = [f for f in READING_FIELDS if f not in archive.DICT_FIELDS]
+GROUP_KEYS = ("hour_of_day", "day", "week", "month")
+BASIC_AGGREGATIONS = ("mean", "min", "max", "sum", "count")
+_PERCENTILE = re.compile(r"^p([1-9][0-9]?)$")
+
+ANALYTICS_CONCURRENCY = int(os.getenv("ANALYTICS_CONCURRENCY", "1"))  # Queries running at once
+
+_MICROS = 1_000_000
+_KEY_BASE = 100_000
+
+
+class QueryError(ValueError):
+    """A query that isn't in the supported set."""
+
+
+@dataclass
+class Query:
+    fields: list[str]
+    start: datetime
+    end: datetime
+    group_by: list[str] = field(default_factory=lambda: ["day"])
+    aggregations: list[str] = field(default_factory=lambda: ["mean"])
+    timezone: str = "Europe/London"
+    # Only include readings whose local hour is in [hour_from, hour_to);
+    # wraps past midnight when hour_from > hour_to (e.g. 22 -> 6)
+    hour_from: Optional[int] = None
+    hour_to: Optional[int] = None
+    # Resample onto a uniform grid first (microseconds), so every interval
+    # weighs the same however many readings fell into it
+    resample_step: Optional[int] = None
+    max_gap: int = 600_000_000
+    policies: dict = field(default_factory=lambda: dict(resample.DEFAULT_POLICIES))
+
+    def validate(self):
+        unknown = [f for f in self.fields if f not in NUMERIC_FIELDS]
+        if not self.fields or unknown:
+            raise QueryError(f"fields must be some of: {', '.join(NUMERIC_FIELDS)}")
+        if not self.group_by or len(self.group_by) > 2 or any(g not in GROUP_KEYS for g in self.group_by):
+            raise QueryError(f"group_by must be one or two of: {', '.join(GROUP_KEYS)}")
+        for agg in self.aggregations:
+            if agg not in BASIC_AGGREGATIONS and not _PERCENTILE.match(agg):
+                raise QueryError(f"Unknown aggregation {agg!r}; use {', '.join(BASIC_AGGREGATIONS)} or p1..p99")
+        if self.end <= self.start:
+            raise QueryError("end must be after start")
+        if (self.hour_from is None) != (self.hour_to is None):
+            raise QueryError("hour_from and hour_to must be given together")
+        try:
+            ZoneInfo(self.timezone)
+        except (KeyError, ValueError):
+            raise QueryError(f"Unknown timezone {self.timezone!r}") from None
+
+
+def load_columns(start: datetime, end: datetime, fields: list[str]) -> dict[str, np.ndarray]:
+    """Readings in [start, end) from the archive and the database.
+
+    Returns "timestamp" as int64 microseconds since the epoch (UTC) and each
+    field as float64 with NaN for missing values (battery_state as an object
+    array with None), sorted by time.
+    """
+    with engine.connect() as conn:
+        hot_start = conn.execute(select(func.min(EnergyReading.timestamp))).scalar()
+        hot_start = max(start, hot_start) if hot_start else end
+
+        chunks = []
+        for chunk in archive.read_columns(start, min(end, hot_start), fields):
+            chunks.append({
+                "timestamp": np.frombuffer(chunk["timestamp"], dtype=np.int64),
+                **{f: _archive_array(chunk[f]) for f in fields},
+            })
+
+        if hot_start < end:
+            # Millisecond precision is plenty here, and much cheaper than
+            # parsing every timestamp into a datetime
+            micros = cast(
+                func.round((func.julianday(EnergyReading.timestamp) - 2440587.5) * 86_400_000.0), Integer
+            ) * 1000
+            result = conn.execute(
+                select(micros, *(getattr(EnergyReading, f) for f in fields)).where(
+                    EnergyReading.timestamp >= hot_start,
+                    EnergyReading.timestamp < end,
+                ).order_by(EnergyReading.timestamp)
+            )
+            # Plain DBAPI tuples convert to numpy ~50x faster than Row objects
+            rows = result.cursor.fetchall()
+            if rows:
+                dtype = object if archive.DICT_FIELDS.intersection(fields) else np.float64
+                table = np.array(rows, dtype=dtype).reshape(len(rows), len(fields) + 1)
+                chunks.append({
+                    "timestamp": table[:, 0].astype(np.int64),
+                    **{
+                        f: table[:, i + 1] if f in archive.DICT_FIELDS else table[:, i + 1].astype(np.float64)
+                        for i, f in enumerate(fields)
+                    },
+                })
+
+    if not chunks:
+        return {
+            "timestamp": np.empty(0, dtype=np.int64),
+            **{f: np.empty(0, dtype=object if f in archive.DICT_FIELDS else np.float64) for f in fields},
+        }
+    return {name: np.concatenate([c[name] for c in chunks]) for name in ["timestamp", *fields]}
+
+
+def _archive_array(values) -> np.ndarray:
+    if isinstance(values, list):
+        return np.array(values, dtype=object)
+    return np.frombuffer(values, dtype=np.float64)
+
+
+def local_seconds(micros: np.ndarray, timezone: str) -> np.ndarray:
+    """Convert UTC microseconds to local wall-clock seconds since the epoch.
+
+    The UTC offset is looked up once per distinct UTC hour (DST changes
+    happen on the hour) rather than once per reading.
+    """
+    seconds = micros // _MICROS
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    tz = ZoneInfo(timezone)
+    offsets = np.array([
+        datetime.fromtimestamp(int(h) * 3600, tz).utcoffset().total_seconds() for h in hours
+    ], dtype=np.int64)
+    return seconds + offsets[inverse]
+
+
+def group_keys(local: np.ndarray, key: str) -> tuple[np.ndarray, Callable]:
+    """Integer group key per reading plus a function turning a key into its label."""
+    days = local // 86400
+    if key == "hour_of_day":
+        return (local // 3600) % 24, int
+    if key == "day":
+        return days, lambda d: str(np.datetime64(int(d), "D"))
+    if key == "week":
+        # 1970-01-01 was a Thursday; label weeks by their Monday
+        return days - (days + 3) % 7, lambda d: str(np.datetime64(int(d), "D"))
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return months, lambda m: str(np.datetime64(int(m), "M"))
+
+
+def _aggregate(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, agg: str) -> np.ndarray:
+    """Aggregate `values` (sorted by group, then value) over groups given by start offsets."""
+    if agg == "count":
+        return counts
+    if agg == "sum":
+        return np.add.reduceat(values, starts)
+    if agg == "mean":
+        return np.add.reduceat(values, starts) / counts
+    if agg == "min":
+        return values[starts]
+    if agg == "max":
+        return values[starts + counts - 1]
+    # Percentile with linear interpolation, as numpy.percentile's default
+    q = int(_PERCENTILE.match(agg).group(1)) / 100
+    position = starts + (counts - 1) * q
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def run_query(query: Query) -> dict:
+    """Run a validated query; returns groups sorted by key with one entry per field."""
+    query.validate()
+    if query.resample_step:
+        grid = resample.make_grid(archive.to_micros(query.start), archive.to_micros(query.end), query.resample_step)
+        # Load a little before the range so the first grid points can interpolate
+        data = load_columns(query.start - timedelta(microseconds=query.max_gap), query.end, query.fields)
+        data = resample.resample(data, grid, query.policies, query.max_gap, query.resample_step)
+    else:
+        data = load_columns(query.start, query.end, query.fields)
+    local = local_seconds(data["timestamp"], query.timezone)
+
+    if query.hour_from is not None:
+        hour = (local // 3600) % 24
+        if query.hour_from <= query.hour_to:
+            keep = (hour >= query.hour_from) & (hour < query.hour_to)
+        else:
+            keep = (hour >= query.hour_from) | (hour < query.hour_to)
+        local = local[keep]
+        data = {name: values[keep] for name, values in data.items()}
+
+    keys, labels = [], []
+    for key in query.group_by:
+        values, label = group_keys(local, key)
+        keys.append(values)
+        labels.append(label)
+    # Combine up to two keys into one sortable integer (every key is < _KEY_BASE)
+    combined = keys[0] if len(keys) == 1 else keys[0] * _KEY_BASE + keys[1]
+
+    groups: dict[int, dict] = {}
+    for name in query.fields:
+        values = data[name]
+        valid = ~np.isnan(values)
+        group, values = combined[valid], values[valid]
+        order = np.lexsort((values, group))
+        group, values = group[order], values[order]
+        unique, starts, counts = np.unique(group, return_index=True, return_counts=True)
+        results = {agg: _aggregate(values, starts, counts, agg) for agg in query.aggregations}
+        for i, key in enumerate(unique.tolist()):
+            entry = groups.setdefault(key, {})
+            entry[name] = {agg: _round(results[agg][i], agg) for agg in query.aggregations}
+
+    rows = []
+    for key in sorted(groups):
+        parts = [key] if len(keys) == 1 else divmod(key, _KEY_BASE)
+        rows.append({
+            **{g: labels[i](parts[i]) for i, g in enumerate(query.group_by)},
+            **groups[key],
+        })
+    return {"rows_scanned": len(data["timestamp"]), "groups": rows}
+
+
+def _round(value, agg: str):
+    return int(value) if agg == "count" else round(float(value), 3)
@@ -0,0 +1,333 @@
+"""Cold-tier archive of expired readings.
+
+Before retention deletes readings from SQLite, each UTC day is written to a
+compressed columnar file under ARCHIVE_DIR and listed in manifest.json.
+
+File layout (readings-YYYY-MM-DD.vca):
+
+    b"VCA1" | header length (uint32 LE) | JSON header | column blocks
+
+The header lists each column's encoding, offset and length, so a reader
+only seeks to and decompresses the columns it needs. Timestamps are
+delta-encoded int64 microseconds, floats are byte-shuffled float64 with NaN
+for missing values, and battery_state is dictionary-encoded. Every block
+is zlib-compressed.
+
+Archiving is incremental and restartable: a day's file is written
+atomically, then the manifest, and only then are the rows deleted. A run
+interrupted before the delete merges the same rows again next time.
+"""
+
+import array
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from typing import Iterator, Optional
+
+from sqlalchemy import func, select
+
+import diagnostics
+from database import SessionLocal
+from models import EnergyReading
+from vrm_client import READING_FIELDS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")  # Empty disables archiving
+ARCHIVE_COMPRESSION_LEVEL = 9
+
+MAGIC = b"VCA1"
+COLUMNS = ["timestamp", *READING_FIELDS]
+DICT_FIELDS = {"battery_state"}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(ts: datetime) -> int:
+    """Naive UTC datetime to microseconds since the epoch."""
+    return (ts - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+
+def _to_little_endian(values: array.array) -> bytes:
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, raw: bytes) -> array.array:
+    values = array.array(typecode, raw)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _shuffle(raw: bytes, width: int) -> bytes:
+    """Group byte i of every value together; exponents and high bytes compress far better."""
+    return b"".join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(raw: bytes, width: int) -> bytes:
+    count = len(raw) // width
+    out = bytearray(len(raw))
+    for i in range(width):
+        out[i::width] = raw[i * count:(i + 1) * count]
+    return bytes(out)
+
+
+def _encode(name: str, values: list) -> tuple[dict, bytes]:
+    if name == "timestamp":
+        micros = [to_micros(ts) for ts in values]
+        deltas = array.array("q", [micros[0]] + [b - a for a, b in zip(micros, micros[1:], strict=False)])
+        meta, raw = {"encoding": "delta_i8"}, _shuffle(_to_little_endian(deltas), 8)
+    elif name in DICT_FIELDS:
+        dictionary = sorted({v for v in values if v is not None})
+        index = {v: i for i, v in enumerate(dictionary)}
+        codes = array.array("b", [index[v] if v is not None else -1 for v in values])
+        meta, raw = {"encoding": "dict_i1", "dictionary": dictionary}, codes.tobytes()
+    else:
+        floats = array.array("d", [v if v is not None else float("nan") for v in values])
+        meta, raw = {"encoding": "f8"}, _shuffle(_to_little_endian(floats), 8)
+    return meta, zlib.compress(raw, ARCHIVE_COMPRESSION_LEVEL)
+
+
+def _decode(meta: dict, block: bytes):
+    raw = zlib.decompress(block)
+    if meta["encoding"] == "delta_i8":
+        return array.array("q", accumulate(_from_little_endian("q", _unshuffle(raw, 8))))
+    if meta["encoding"] == "dict_i1":
+        dictionary = meta["dictionary"]
+        return [dictionary[c] if c >= 0 else None for c in array.array("b", raw)]
+    return _from_little_endian("d", _unshuffle(raw, 8))
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_day_file(path: str, columns: dict[str, list]) -> int:
+    """Write one day of readings (column name -> values, sorted by timestamp); returns file size."""
+    blocks, meta = [], {}
+    offset = 0
+    for name in COLUMNS:
+        col_meta, block = _encode(name, columns[name])
+        meta[name] = {**col_meta, "offset": offset, "length": len(block)}
+        blocks.append(block)
+        offset += len(block)
+    header = json.dumps({"rows": len(columns["timestamp"]), "codec": "zlib", "columns": meta}).encode()
+    data = MAGIC + struct.pack("<I", len(header)) + header + b"".join(blocks)
+    _atomic_write(path, data)
+    return len(data)
+
+
+def read_day_file(path: str, columns: list[str], start: Optional[datetime] = None,
+                  end: Optional[datetime] = None) -> dict:
+    """Read `columns` for readings in [start, end) from one day file.
+
+    Returns column name -> values: "timestamp" as int64 microseconds and
+    floats as float64 (NaN for missing) in array.array, battery_state as a
+    list. Only the timestamp column and the requested columns are read.
+    """
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"{path} is not an archive file")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+        base = 8 + header_len
+
+        def load(name: str):
+            meta = header["columns"][name]
+            f.seek(base + meta["offset"])
+            return _decode(meta, f.read(meta["length"]))
+
+        micros = load("timestamp")
+        lo = bisect_left(micros, to_micros(start)) if start else 0
+        hi = bisect_left(micros, to_micros(end)) if end else len(micros)
+        result = {"timestamp": micros[lo:hi]}
+        for name in columns:
+            if name != "timestamp" and lo < hi:
+                result[name] = load(name)[lo:hi]
+            elif name != "timestamp":
+                result[name] = [] if name in DICT_FIELDS else array.array("d")
+        return result
+
+
+class Manifest:
+    """Index of archived days: file name, row count and time range per day."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+        self._days: dict[str, dict] = {}
+        self._stamp = None
+
+    @property
+    def days(self) -> dict[str, dict]:
+        """Entries by ISO date, reloaded when another process rewrote the manifest."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._days, self._stamp = {}, None
+            return self._days
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            with open(self.path) as f:
+                self._days = json.load(f)["days"]
+            self._stamp = stamp
+        return self._days
+
+    def update(self, day: date, entry: dict):
+        days = dict(self.days)
+        days[day.isoformat()] = entry
+        os.makedirs(self.directory, exist_ok=True)
+        _atomic_write(self.path, json.dumps({"version": 1, "days": days}, indent=1, sort_keys=True).encode())
+        self._days, self._stamp = days, None
+
+    def overlapping(self, start: datetime, end: datetime) -> list[tuple[str, dict]]:
+        """Entries whose time range overlaps [start, end), oldest first."""
+        start_us, end_us = to_micros(start), to_micros(end)
+        return [
+            (day, entry) for day, entry in sorted(self.days.items())
+            if entry["min_ts"] < end_us and entry["max_ts"] >= start_us
+        ]
+
+
+_manifest: Optional[Manifest] = None
+
+
+def get_manifest() -> Manifest:
+    global _manifest
+    if _manifest is None or _manifest.directory != ARCHIVE_DIR:
+        _manifest = Manifest(ARCHIVE_DIR)
+    return _manifest
+
+
+def _file_name(day: date) -> str:
+    return f"readings-{day.isoformat()}.vca"
+
+
+def _archive_day(db, manifest: Manifest, day_start: datetime, day_end: datetime) -> int:
+    rows = db.query(
+        EnergyReading.id, EnergyReading.timestamp, *(getattr(EnergyReading, f) for f in READING_FIELDS)
+    ).filter(
+        EnergyReading.timestamp >= day_start,
+        EnergyReading.timestamp < day_end,
+    ).order_by(EnergyReading.timestamp).all()
+    if not rows:
+        return 0
+
+    # Merge with what is already archived for the day (earlier partial day,
+    # or an interrupted run); stored rows win on equal timestamps.
+    by_ts = {}
+    day = day_start.date()
+    entry = manifest.days.get(day.isoformat())
+    if entry:
+        existing = read_day_file(os.path.join(manifest.directory, entry["file"]), COLUMNS)
+        for i, us in enumerate(existing["timestamp"]):
+            by_ts[from_micros(us)] = [existing[name][i] for name in READING_FIELDS]
+    for row in rows:
+        by_ts[row.timestamp] = [getattr(row, f) for f in READING_FIELDS]
+
+    timestamps = sorted(by_ts)
+    columns = {"timestamp": timestamps}
+    for i, name in enumerate(READING_FIELDS):
+        columns[name] = [_none_if_nan(by_ts[ts][i]) for ts in timestamps]
+
+    name = _file_name(day)
+    size = write_day_file(os.path.join(manifest.directory, name), columns)
+    manifest.update(day, {
+        "file": name,
+        "rows": len(timestamps),
+        "min_ts": to_micros(timestamps[0]),
+        "max_ts": to_micros(timestamps[-1]),
+        "bytes": size,
+    })
+
+    max_id = max(row.id for row in rows)
+    archived = (
+        EnergyReading.timestamp >= day_start,
+        EnergyReading.timestamp < day_end,
+        EnergyReading.id <= max_id,
+    )
+    diagnostics.delete_values(db, select(EnergyReading.id).where(*archived))
+    db.query(EnergyReading).filter(*archived).delete(synchronize_session=False)
+    db.commit()
+    return len(rows)
+
+
+def _none_if_nan(value):
+    return None if isinstance(value, float) and value != value else value
+
+
+def archive_expired(cutoff: datetime) -> int:
+    """Move readings older than `cutoff` into day files, one day at a time.
+
+    Returns the number of rows moved out of the database.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    manifest = get_manifest()
+    db = SessionLocal()
+    try:
+        first = db.query(func.min(EnergyReading.timestamp)).filter(EnergyReading.timestamp < cutoff).scalar()
+        if first is None:
+            return 0
+        moved = 0
+        day_start = datetime.combine(first.date(), datetime.min.time())
+        while day_start < cutoff:
+            day_end = min(day_start + timedelta(days=1), cutoff)
+            moved += _archive_day(db, manifest, day_start, day_end)
+            day_start += timedelta(days=1)
+        if moved:
+            logger.info(f"Archived {moved} readings older than {cutoff:%Y-%m-%d %H:%M} to {ARCHIVE_DIR}")
+        return moved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def count_rows(start: datetime, end: datetime) -> int:
+    """Archived rows in days overlapping [start, end) (whole days, so an upper bound)."""
+    if not ARCHIVE_DIR:
+        return 0
+    return sum(entry["rows"] for _, entry in get_manifest().overlapping(start, end))
+
+
+def read_columns(start: datetime, end: datetime, columns: list[str]) -> Iterator[dict]:
+    """Yield one column dict (see read_day_file) per archived day overlapping [start, end)."""
+    if not ARCHIVE_DIR:
+        return
+    manifest = get_manifest()
+    for _, entry in manifest.overlapping(start, end):
+        chunk = read_day_file(os.path.join(manifest.directory, entry["file"]), columns, start, end)
+        if chunk["timestamp"]:
+            yield chunk
+
+
+def iter_rows(start: datetime, end: datetime, columns: list[str], step: int = 1) -> Iterator[dict]:
+    """Yield archived readings in [start, end) as dicts, keeping every `step`-th row."""
+    skip = 0
+    for chunk in read_columns(start, end, columns):
+        count = len(chunk["timestamp"])
+        for i in range(skip, count, step):
+            row = {"timestamp": from_micros(chunk["timestamp"][i])}
+            for name in columns:
+                if name != "timestamp":
+                    row[name] = _none_if_nan(chunk[name][i])
+            yield row
+        skip = (skip - count) % step
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, func, insert
+
+from database import SessionLocal
+from models import BackfillRange, EnergyReading
+from vrm_client import CODE_MAPPING, VRMClient
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_GAP_MINUTES = float(os.getenv("BACKFILL_GAP_MINUTES", "10"))
+BACKFILL_PAGE_HOURS = float(os.getenv("BACKFILL_PAGE_HOURS", "24"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "2"))
+BACKFILL_LOOKBACK_DAYS = 7  # Matches retention
+
+# VRM aggregates stats with some delay, so very recent pages are not marked
+# as filled and get fetched again on the next run.
+BACKFILL_SETTLE_MINUTES = 30
+
+STATS_CODES = [code for code, field in CODE_MAPPING.items() if field != "battery_state"]
+
+
+def find_gaps(db, since: datetime, until: datetime, min_gap: timedelta) -> list[tuple[datetime, datetime]]:
+    """Find holes longer than `min_gap` in energy_readings between `since` and `until`.
+
+    Each gap is (last reading before it, first reading after it), using
+    `since`/`until` where there is no reading on that side.
+    """
+    prev_ts = func.lag(EnergyReading.timestamp, type_=DateTime).over(order_by=EnergyReading.timestamp)
+    sub = db.query(
+        EnergyReading.timestamp.label("ts"),
+        prev_ts.label("prev_ts"),
+    ).filter(
+        EnergyReading.timestamp >= since,
+        EnergyReading.timestamp <= until,
+    ).subquery()
+    inner = db.query(sub.c.prev_ts, sub.c.ts).filter(
+        (func.julianday(sub.c.ts) - func.julianday(sub.c.prev_ts)) * 86400 > min_gap.total_seconds()
+    ).order_by(sub.c.ts).all()
+
+    bounds = db.query(
+        func.min(EnergyReading.timestamp), func.max(EnergyReading.timestamp)
+    ).filter(
+        EnergyReading.timestamp >= since,
+        EnergyReading.timestamp <= until,
+    ).first()
+    first, last = bounds
+    if first is None:
+        return [(since, until)]
+
+    gaps = []
+    if first - since > min_gap:
+        gaps.append((since, first))
+    gaps.extend((r.prev_ts, r.ts) for r in inner)
+    if until - last > min_gap:
+        gaps.append((last, until))
+    return gaps
+
+
+def _subtract(gap: tuple[datetime, datetime], filled: list[tuple[datetime, datetime]]):
+    """Remove already-filled ranges (sorted by start) from a gap."""
+    remaining = []
+    start, end = gap
+    for f_start, f_end in filled:
+        if f_end <= start or f_start >= end:
+            continue
+        if f_start > start:
+            remaining.append((start, f_start))
+        start = max(start, f_end)
+        if start >= end:
+            break
+    if start < end:
+        remaining.append((start, end))
+    return remaining
+
+
+def pending_ranges(now: Optional[datetime] = None) -> list[tuple[datetime, datetime]]:
+    """Gaps in the retention window that have not been filled yet, split into pages."""
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=BACKFILL_LOOKBACK_DAYS)
+    min_gap = timedelta(minutes=BACKFILL_GAP_MINUTES)
+    page = timedelta(hours=BACKFILL_PAGE_HOURS)
+
+    db = SessionLocal()
+    try:
+        gaps = find_gaps(db, since, now, min_gap)
+        filled = [
+            (r.start, r.end)
+            for r in db.query(BackfillRange.start, BackfillRange.end).filter(
+                BackfillRange.end >= since
+            ).order_by(BackfillRange.start)
+        ]
+    finally:
+        db.close()
+
+    # Backfilled readings split a gap into a chain of short gaps; join gaps
+    # separated by less than min_gap so one page covers the whole chain.
+    merged: list[tuple[datetime, datetime]] = []
+    for start, end in gaps:
+        if merged and start - merged[-1][1] <= min_gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    # Pages never straddle the settle cutoff, so a long gap reaching up to
+    # `now` leaves only its last few minutes to be fetched again.
+    settle_cutoff = now - timedelta(minutes=BACKFILL_SETTLE_MINUTES)
+    pages = []
+    for gap in merged:
+        for start, end in _subtract(gap, filled):
+            while start < end:
+                page_end = min(start + page, end)
+                if start < settle_cutoff < page_end:
+                    page_end = settle_cutoff
+                pages.append((start, page_end))
+                start = page_end
+    return pages
+
+
+def store_backfill(start: datetime, end: datetime, readings: list[tuple[datetime, dict]],
+                   settled: bool) -> int:
+    """Insert readings strictly inside (start, end), skipping timestamps already stored.
+
+    Safe to repeat: rows that already exist are not inserted again. Settled
+    ranges are recorded so they are not fetched again.
+    """
+    db = SessionLocal()
+    try:
+        existing = {
+            r.timestamp
+            for r in db.query(EnergyReading.timestamp).filter(
+                EnergyReading.timestamp > start,
+                EnergyReading.timestamp < end,
+            )
+        }
+        rows = [
+            {"timestamp": ts, **parsed}
+            for ts, parsed in readings
+            if start < ts < end and ts not in existing
+        ]
+        if rows:
+            db.execute(insert(EnergyReading), rows)
+        if settled:
+            db.add(BackfillRange(start=start, end=end, rows=len(rows)))
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def backfill(client: VRMClient, now: Optional[datetime] = None) -> int:
+    """Fill gaps in stored readings from VRM historical stats.
+
+    Pages are fetched with at most BACKFILL_CONCURRENCY requests in flight,
+    and all database work runs in a worker thread so the event loop (live
+    poller and API) is never blocked. Returns the number of rows inserted.
+    """
+    now = now or datetime.utcnow()
+    pages = await asyncio.to_thread(pending_ranges, now)
+    if not pages:
+        return 0
+
+    logger.info(f"Backfilling {len(pages)} page(s) of missing readings from VRM")
+    semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    settle_cutoff = now - timedelta(minutes=BACKFILL_SETTLE_MINUTES)
+
+    async def fill(start: datetime, end: datetime) -> int:
+        async with semaphore:
+            data = await client.get_stats(start, end, STATS_CODES)
+        if data is None:
+            return 0
+        readings = client.parse_stats_data(data)
+        return await asyncio.to_thread(store_backfill, start, end, readings, end <= settle_cutoff)
+
+    results = await asyncio.gather(*(fill(start, end) for start, end in pages), return_exceptions=True)
+    inserted = 0
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Backfill page failed: {result}")
+        else:
+            inserted += result
+    if inserted:
+        logger.info(f"Backfilled {inserted} readings")
+    return inserted
@@ -0,0 +1,376 @@
+"""Battery health: how hard the battery is being worked, per local day.
+
+- Ah and Wh throughput, charge and discharge separately, from
+  battery_current and battery_power (positive is charging)
+- equivalent full cycles: discharged Ah / capacity
+- depth-of-discharge distribution: SOC cycles found by rainflow counting
+  (ASTM E1049 three-point method), as cycle counts per 10% DoD bin. A
+  cycle counts on the day it closes; the unclosed reversals (the residual)
+  carry over to the next day, so the nightly discharge that crosses
+  midnight is one cycle, not two halves
+- time spent below the minimum SOC
+
+A reading's values hold until the next reading; intervals longer than
+HEALTH_MAX_GAP (outages) count for nothing. `compute_days` works on whole
+arrays over any range, archive included; only the rainflow stack walk is a
+loop, over SOC reversals rather than readings. DailyTracker keeps today's
+figures up to date reading by reading from the ingest path. Days are
+stored in battery_health_days, so charting a year is a table read.
+"""
+
+import json
+import os
+from collections import deque
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+import analytics
+import archive
+import resample
+from database import engine
+from models import BatteryHealthDay
+
+HEALTH_TIMEZONE = "Europe/London"
+# Backfilled VRM stats are 15 minutes apart, so allow a little more than that
+HEALTH_MAX_GAP = os.getenv("HEALTH_MAX_GAP", "20m")
+HEALTH_FLUSH_INTERVAL = float(os.getenv("HEALTH_FLUSH_INTERVAL", "60"))  # Seconds between saves of today
+HEALTH_FIELDS = ["battery_soc", "battery_current", "battery_power"]
+DOD_BINS = list(range(0, 101, 10))
+SUM_FIELDS = ("charge_ah", "discharge_ah", "charge_wh", "discharge_wh", "seconds_below_min_soc")
+
+_MICROS = 1_000_000
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def reversals(soc: np.ndarray) -> np.ndarray:
+    """Turning points of a SOC series; missing and repeated values are dropped, the ends kept."""
+    soc = soc[~np.isnan(soc)]
+    soc = soc[np.concatenate(([True], np.diff(soc) != 0))] if len(soc) else soc
+    if len(soc) < 3:
+        return soc
+    slope = np.diff(soc)
+    return soc[np.concatenate(([True], slope[1:] * slope[:-1] < 0, [True]))]
+
+
+def push(stack: list[float], x: float, ranges: list[float], counts: list[float]):
+    """Add one SOC value to a rainflow residual, appending the cycles it closes to ranges/counts.
+
+    Values that carry on in the same direction replace the last point, so
+    the stack only ever holds reversals and values can be pushed one by one.
+    """
+    if stack and x == stack[-1]:
+        return
+    if len(stack) >= 2 and (stack[-1] - stack[-2]) * (x - stack[-1]) > 0:
+        stack[-1] = x  # Still going the same way
+    else:
+        stack.append(x)
+    while len(stack) >= 3:
+        latest = abs(stack[-1] - stack[-2])
+        previous = abs(stack[-2] - stack[-3])
+        if latest < previous:
+            break
+        ranges.append(previous)
+        if len(stack) == 3:
+            # The range contains the starting point: half a cycle, and move the start on
+            counts.append(0.5)
+            del stack[0]
+        else:
+            counts.append(1.0)
+            del stack[-3:-1]
+
+
+def half_cycles(stack: list[float]) -> tuple[list[float], list[float]]:
+    """The residual's swings, which never closed, as half cycles."""
+    ranges = [abs(b - a) for a, b in zip(stack, stack[1:], strict=False)]
+    return ranges, [0.5] * len(ranges)
+
+
+def rainflow(points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Cycle ranges and counts (1.0 full, 0.5 half) from a series of reversals."""
+    ranges, counts, stack = [], [], []
+    for x in points.tolist():
+        push(stack, x, ranges, counts)
+    open_ranges, open_counts = half_cycles(stack)
+    return (np.array(ranges + open_ranges, dtype=np.float64),
+            np.array(counts + open_counts, dtype=np.float64))
+
+
+def dod_histogram(ranges: list[float], counts: list[float]) -> list[float]:
+    """Cycle counts per depth-of-discharge bin (DOD_BINS, % SOC)."""
+    histogram, _ = np.histogram(np.minimum(ranges, 100), bins=DOD_BINS, weights=counts)
+    return histogram.tolist()
+
+
+def _day_result(samples: int, totals: dict, ranges: list[float], counts: list[float],
+                residual: list[float], capacity_ah: float) -> dict:
+    return {
+        "samples": samples,
+        **{name: round(totals[name], 4) for name in SUM_FIELDS},
+        "equivalent_cycles": round(totals["discharge_ah"] / capacity_ah, 4),
+        "dod_histogram": dod_histogram(ranges, counts),
+        "residual": list(residual),
+    }
+
+
+def compute_days(data: dict[str, np.ndarray], capacity_ah: float, min_soc: float,
+                 max_gap_us: Optional[int] = None, tz: str = HEALTH_TIMEZONE,
+                 residual: Optional[list[float]] = None) -> dict[date, dict]:
+    """Health figures per local day from column arrays (as returned by analytics.load_columns).
+
+    The last reading's interval is unknown, so it counts for nothing: load
+    a little past the end of the range for complete days. `residual` is
+    the rainflow residual left by the day before the range.
+    """
+    ts = data["timestamp"]
+    if not len(ts):
+        return {}
+    max_gap_us = max_gap_us or resample.parse_duration(HEALTH_MAX_GAP)
+    dt = np.diff(ts, append=ts[-1]).astype(np.float64)
+    dt[dt > max_gap_us] = 0
+    dt /= _MICROS
+
+    soc, current, power = data["battery_soc"], data["battery_current"], data["battery_power"]
+    per_reading = {
+        "charge_ah": np.where(current > 0, current, 0) * dt / 3600,
+        "discharge_ah": np.where(current < 0, -current, 0) * dt / 3600,
+        "charge_wh": np.where(power > 0, power, 0) * dt / 3600,
+        "discharge_wh": np.where(power < 0, -power, 0) * dt / 3600,
+        "seconds_below_min_soc": np.where(soc < min_soc, dt, 0),
+    }
+
+    days = analytics.local_seconds(ts, tz) // 86400
+    starts = np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+    counts = np.diff(starts, append=len(ts))
+    sums = {name: np.add.reduceat(values, starts) for name, values in per_reading.items()}
+
+    result = {}
+    stack = list(residual or [])
+    for i, (day, start, count) in enumerate(zip(days[starts].tolist(), starts.tolist(), counts.tolist(), strict=True)):
+        totals = {name: float(values[i]) for name, values in sums.items()}
+        ranges, cycle_counts = [], []
+        for x in reversals(soc[start:start + count]).tolist():
+            push(stack, x, ranges, cycle_counts)
+        result[date.fromordinal(_EPOCH_ORDINAL + day)] = _day_result(
+            count, totals, ranges, cycle_counts, stack, capacity_ah
+        )
+    return result
+
+
+def day_start(day: date, tz: str = HEALTH_TIMEZONE) -> datetime:
+    """Start of a local day as a naive UTC datetime."""
+    local = datetime.combine(day, time(), ZoneInfo(tz))
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def local_today(tz: str = HEALTH_TIMEZONE) -> date:
+    return datetime.now(ZoneInfo(tz)).date()
+
+
+def save_days(days: dict[date, dict]):
+    if not days:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {
+            "day": day,
+            **{name: value for name, value in result.items() if name != "residual"},
+            "dod_histogram": json.dumps(result["dod_histogram"]),
+            "rainflow_residual": json.dumps(result["residual"]),
+            "updated_at": now,
+        }
+        for day, result in days.items()
+    ]
+    stmt = insert(BatteryHealthDay)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BatteryHealthDay.day],
+        set_={name: stmt.excluded[name] for name in rows[0] if name != "day"},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def load_days(first: date, last: date) -> dict[date, dict]:
+    """Stored days in [first, last]."""
+    with engine.connect() as conn:
+        rows = conn.execute(select(BatteryHealthDay).where(
+            BatteryHealthDay.day >= first,
+            BatteryHealthDay.day <= last,
+        ).order_by(BatteryHealthDay.day)).all()
+    return {
+        row.day: {
+            "samples": row.samples,
+            **{name: getattr(row, name) for name in SUM_FIELDS},
+            "equivalent_cycles": row.equivalent_cycles,
+            "dod_histogram": json.loads(row.dod_histogram),
+            "residual": json.loads(row.rainflow_residual),
+        }
+        for row in rows
+    }
+
+
+def residual_before(day: date) -> list[float]:
+    """Rainflow residual at the end of the last stored day before `day`."""
+    with engine.connect() as conn:
+        residual = conn.execute(
+            select(BatteryHealthDay.rainflow_residual)
+            .where(BatteryHealthDay.day < day)
+            .order_by(BatteryHealthDay.day.desc())
+            .limit(1)
+        ).scalar()
+    return json.loads(residual) if residual else []
+
+
+def refresh_days(first: date, last: date, capacity_ah: float, min_soc: float) -> dict[date, dict]:
+    """Recompute and store days in [first, last] from the database and the archive.
+
+    Days after the first one with data that have no readings are stored
+    as empty, so they aren't recomputed on every request. Rainflow starts
+    from the residual stored for the last day before `first`.
+    """
+    max_gap_us = resample.parse_duration(HEALTH_MAX_GAP)
+    end = day_start(last + timedelta(days=1))
+    data = analytics.load_columns(day_start(first), end + timedelta(microseconds=max_gap_us), HEALTH_FIELDS)
+    residual = residual_before(first)
+    days = {
+        day: result for day, result in compute_days(data, capacity_ah, min_soc, max_gap_us, residual=residual).items()
+        if first <= day <= last
+    }
+    if days:
+        day = min(days)
+        while day <= last:
+            if day not in days:
+                days[day] = _day_result(0, dict.fromkeys(SUM_FIELDS, 0.0), [], [], residual, capacity_ah)
+            residual = days[day]["residual"]
+            day += timedelta(days=1)
+        days = dict(sorted(days.items()))
+    save_days(days)
+    return days
+
+
+def history(first: date, last: date, capacity_ah: float, min_soc: float) -> dict[date, dict]:
+    """Days in [first, last]: stored ones, plus past days computed (and stored) on first request.
+
+    Today's row is kept up to date by the leader's DailyTracker.
+    """
+    days = load_days(first, last)
+    today = local_today()
+    missing = []
+    day = first
+    while day <= min(last, today - timedelta(days=1)):
+        if day not in days:
+            missing.append(day)
+        day += timedelta(days=1)
+    if missing:
+        days.update(refresh_days(missing[0], missing[-1], capacity_ah, min_soc))
+    return dict(sorted(days.items()))
+
+
+def _value(value) -> Optional[float]:
+    return None if value is None or value != value else value
+
+
+class DailyTracker:
+    """Today's health figures, updated reading by reading.
+
+    `observe` only queues the reading, so the ingest path can call it
+    freely; `process` folds queued readings in and `flush` also stores
+    the results (both run in a worker thread). Readings are only queued
+    between `start` and `stop` (while this worker is leader). Completed
+    days are stored when the first reading of the next day arrives; the
+    rainflow residual carries on into the new day. Readings stored
+    out of order (backfill) need a `resume`: `invalidate` asks for one.
+    """
+
+    def __init__(self, capacity_ah: float, min_soc: float, max_gap_us: Optional[int] = None,
+                 tz: str = HEALTH_TIMEZONE):
+        self.capacity_ah = capacity_ah
+        self.min_soc = min_soc
+        self.max_gap_us = max_gap_us or resample.parse_duration(HEALTH_MAX_GAP)
+        self.tz = ZoneInfo(tz)
+        self._inbox: deque[dict] = deque(maxlen=100_000)
+        self.active = False
+        self.stale = False
+        self.finished: dict[date, dict] = {}
+        self._stack: list[float] = []
+        self._reset(None)
+        self._last: Optional[tuple] = None
+
+    def _reset(self, day: Optional[date]):
+        self.day = day
+        self._samples = 0
+        self._totals = dict.fromkeys(SUM_FIELDS, 0.0)
+        self._ranges: list[float] = []
+        self._counts: list[float] = []
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        self._inbox.clear()
+
+    def invalidate(self):
+        self.stale = True
+
+    def observe(self, reading: dict):
+        if self.active:
+            self._inbox.append(reading)
+
+    def _fold(self, reading: dict):
+        us = archive.to_micros(reading["timestamp"])
+        if self._last is not None:
+            last_us, soc, current, power = self._last
+            if us <= last_us:
+                return
+            if us - last_us <= self.max_gap_us:
+                hours = (us - last_us) / _MICROS / 3600
+                if current is not None:
+                    self._totals["charge_ah" if current > 0 else "discharge_ah"] += abs(current) * hours
+                if power is not None:
+                    self._totals["charge_wh" if power > 0 else "discharge_wh"] += abs(power) * hours
+                if soc is not None and soc < self.min_soc:
+                    self._totals["seconds_below_min_soc"] += hours * 3600
+
+        day = reading["timestamp"].replace(tzinfo=timezone.utc).astimezone(self.tz).date()
+        if day != self.day:
+            if self.day is not None:
+                self.finished[self.day] = self.snapshot()
+            self._reset(day)
+        soc = _value(reading.get("battery_soc"))
+        self._samples += 1
+        if soc is not None:
+            push(self._stack, soc, self._ranges, self._counts)
+        self._last = (us, soc, _value(reading.get("battery_current")), _value(reading.get("battery_power")))
+
+    def snapshot(self) -> dict:
+        return _day_result(self._samples, self._totals, self._ranges, self._counts, self._stack, self.capacity_ah)
+
+    def process(self):
+        while self._inbox:
+            self._fold(self._inbox.popleft())
+
+    def resume(self):
+        """Rebuild today's figures from stored readings (on becoming leader, or after a backfill)."""
+        self.stale = False
+        self._reset(None)
+        self._last = None
+        self.finished.clear()
+        today = local_today()
+        self._stack = residual_before(today)
+        data = analytics.load_columns(day_start(today), datetime.utcnow() + timedelta(minutes=1), HEALTH_FIELDS)
+        for i, us in enumerate(data["timestamp"].tolist()):
+            self._fold({"timestamp": archive.from_micros(us), **{f: float(data[f][i]) for f in HEALTH_FIELDS}})
+        self.process()
+
+    def flush(self):
+        self.process()
+        days = dict(self.finished)
+        if self.day is not None:
+            days[self.day] = self.snapshot()
+        save_days(days)
+        self.finished.clear()
@@ -0,0 +1,150 @@
+"""Storage per poll for diagnostic attributes: narrow rows vs one column per code.
+
+Stores `--polls` polls of the recorded diagnostics, padded with extra
+attributes as sent by installations with many devices, both ways in a
+scratch database:
+
+- narrow: the diagnostic_attributes dictionary plus one
+  (attribute_id, reading_id, value) row per attribute (what the app does)
+- wide: one table with a column per (code, instance), one row per poll
+
+and reports bytes per poll (from SQLite's dbstat), insert time per poll
+and the time to read one attribute's series over all polls.
+
+    python -m benchmarks.attributes --polls 2000 --extras 0,50,500
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.run import BENCH_DB
+
+
+def _table_bytes(conn, names: list[str]) -> int:
+    placeholders = ",".join("?" * len(names))
+    query = f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({placeholders})"
+    return conn.exec_driver_sql(query, tuple(names)).scalar()
+
+
+def _median_ms(samples: list[float]) -> float:
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def run(polls: int, extras: list[int]) -> dict:
+    os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DB}"
+    from sqlalchemy import Column, Float, Integer, MetaData, String, Table, insert, select
+
+    import diagnostics
+    from database import engine, init_db
+    from fake_vrm import _load, _pad_diagnostics
+    from models import Base, EnergyReading
+    from spool import insert_readings
+    from vrm_client import VRMClient
+
+    vrm = VRMClient.__new__(VRMClient)
+    rng = random.Random(0)
+    results = {}
+    for extra in extras:
+        Base.metadata.drop_all(engine)
+        init_db()  # WAL, as in production
+        payload = _pad_diagnostics(_load("vrm_diagnostics.json"), extra)
+        parsed = vrm.parse_diagnostic_data(payload)
+        template = vrm.parse_attributes(payload)
+
+        metadata = MetaData()
+        columns = {(a.code, a.instance): f"c{i}" for i, a in enumerate(template)}
+        wide = Table("diagnostics_wide", metadata, Column("reading_id", Integer, primary_key=True), *(
+            Column(columns[(a.code, a.instance)], String if isinstance(a.value, str) else Float)
+            for a in template
+        ))
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+
+        start = datetime(2026, 1, 1)
+        narrow_s, wide_s = [], []
+        for i in range(polls):
+            attributes = [
+                a if isinstance(a.value, str) else a._replace(value=round(a.value * rng.uniform(0.9, 1.1), 2))
+                for a in template
+            ]
+            reading = {"timestamp": start + timedelta(minutes=i), **parsed, "attributes": attributes}
+
+            started = time.perf_counter()
+            insert_readings([reading])
+            narrow_s.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            with engine.begin() as conn:
+                conn.execute(insert(wide), {
+                    "reading_id": i + 1, **{columns[(a.code, a.instance)]: a.value for a in attributes}
+                })
+            wide_s.append(time.perf_counter() - started)
+
+        code, instance = template[-1].code, template[-1].instance
+        end = start + timedelta(minutes=polls)
+        started = time.perf_counter()
+        points = len(diagnostics.series(code, instance, start, end)["points"])
+        narrow_query = time.perf_counter() - started
+
+        column = wide.c[columns[(code, instance)]]
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(
+                select(EnergyReading.timestamp, column)
+                .join(EnergyReading, EnergyReading.id == wide.c.reading_id)
+                .where(EnergyReading.timestamp >= start, EnergyReading.timestamp < end)
+                .order_by(EnergyReading.timestamp)
+            ).all()
+        wide_query = time.perf_counter() - started
+
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+            narrow_bytes = _table_bytes(conn, [
+                "diagnostic_values", "ix_diagnostic_values_reading_id",
+                "diagnostic_attributes", "sqlite_autoindex_diagnostic_attributes_1",
+            ])
+            wide_bytes = _table_bytes(conn, ["diagnostics_wide"])
+            reading_bytes = _table_bytes(conn, ["energy_readings", "ix_energy_readings_timestamp"])
+
+        results[f"{len(template)}_attributes"] = {
+            "narrow": {
+                "bytes_per_poll": round(narrow_bytes / polls),
+                "insert_ms": _median_ms(narrow_s),
+                "series_ms": round(narrow_query * 1000, 3),
+            },
+            "wide": {
+                "bytes_per_poll": round(wide_bytes / polls),
+                "insert_ms": _median_ms(wide_s),
+                "series_ms": round(wide_query * 1000, 3),
+            },
+            "reading_bytes_per_poll": round(reading_bytes / polls),
+            "series_points": points,
+        }
+    return {"polls": polls, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=2000, help="Polls to store")
+    parser.add_argument("--extras", default="0,50,500", help="Comma-separated extra attributes per poll")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    report = run(args.polls, [int(x) for x in args.extras.split(",")])
+    print(f"{'attributes':<16} {'layout':<8} {'bytes/poll':>11} {'insert ms':>10} {'series ms':>10}")
+    for name, result in report["results"].items():
+        for layout in ("narrow", "wide"):
+            r = result[layout]
+            print(f"{name:<16} {layout:<8} {r['bytes_per_poll']:>11} {r['insert_ms']:>10.3f} {r['series_ms']:>10.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
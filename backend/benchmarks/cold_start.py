@@ -0,0 +1,106 @@
+"""Measure cold-start time of the API.
+
+Starts uvicorn in a subprocess and records how long it takes until
+/api/health (liveness) and /api/ready (readiness) answer 200. VRM is pointed
+at a local socket that accepts connections but never responds, so a startup
+path that waits on VRM shows up as a slow start.
+
+    python -m benchmarks.cold_start --runs 5 --output cold_start.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, started: float, timeout: float) -> float:
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def measure(db_path: str, vrm_base: str, timeout: float = 60.0) -> dict:
+    port = _free_port()
+    tmp = os.path.dirname(db_path)
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "VRM_TOKEN": "benchmark",
+        "VRM_INSTALLATION_ID": "123456",
+        "VRM_API_BASE": vrm_base,
+        # Keep retention and the writer away from the real archive and spool
+        "ARCHIVE_DIR": os.path.join(tmp, "archive"),
+        "SPOOL_PATH": os.path.join(tmp, "spool.bin"),
+    }
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = _wait_for(f"http://127.0.0.1:{port}/api/health", started, timeout)
+        ready = _wait_for(f"http://127.0.0.1:{port}/api/ready", started, timeout)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {"live_s": round(live, 3), "ready_s": round(ready, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # Accepts connections, never answers: a VRM that hangs
+    blackhole = socket.socket()
+    blackhole.bind(("127.0.0.1", 0))
+    blackhole.listen(64)
+    vrm_base = f"http://127.0.0.1:{blackhole.getsockname()[1]}/v2"
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.runs):
+            result = measure(os.path.join(tmp, "cold_start.db"), vrm_base)
+            print(f"run {i + 1}: live {result['live_s']}s, ready {result['ready_s']}s")
+            runs.append(result)
+    blackhole.close()
+
+    summary = {
+        "benchmark": "cold_start",
+        "runs": runs,
+        "live_median_s": statistics.median(r["live_s"] for r in runs),
+        "ready_median_s": statistics.median(r["ready_s"] for r in runs),
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Bytes on the wire and CPU per request, per encoding, with and without the snapshot cache.
+
+Seeds a scratch database with synthetic readings, then requests each
+endpoint repeatedly in-process with Accept-Encoding identity, gzip and br.
+"cold" clears the response cache before every request (serialize and
+compress each time, as without the cache); "warm" serves the cached
+snapshot. CPU is process time, so it includes the test client's own
+overhead, which is the same for every variant.
+
+    python -m benchmarks.compression --rows 10000 --repeat 50
+"""
+
+import argparse
+import json
+import os
+import time
+
+from benchmarks.run import BENCH_DB
+
+ENDPOINTS = {
+    "current": "/api/current",
+    "history_24h": "/api/history?hours=24",
+    "history_168h": "/api/history?hours=168",
+}
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def run(rows: int, repeat: int) -> dict:
+    os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DB}"
+    import logging
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from benchmarks.generator import seed_database
+    from database import engine
+
+    logging.getLogger().setLevel(logging.WARNING)
+    seed_database(engine, rows)
+    client = TestClient(main.app)
+
+    def request(url: str, encoding: str) -> int:
+        with client.stream("GET", url, headers={"Accept-Encoding": encoding}) as response:
+            response.raise_for_status()
+            return sum(len(chunk) for chunk in response.iter_raw())
+
+    results = {}
+    for name, url in ENDPOINTS.items():
+        for encoding in ENCODINGS:
+            for cache in ("cold", "warm"):
+                main.response_cache.clear()
+                size = request(url, encoding)
+                cpu_started, wall_started = time.process_time(), time.perf_counter()
+                for _ in range(repeat):
+                    if cache == "cold":
+                        main.response_cache.clear()
+                    request(url, encoding)
+                results[f"{name}/{encoding}/{cache}"] = {
+                    "bytes": size,
+                    "cpu_ms": round((time.process_time() - cpu_started) / repeat * 1000, 3),
+                    "wall_ms": round((time.perf_counter() - wall_started) / repeat * 1000, 3),
+                }
+    return {"rows": rows, "repeat": repeat, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000, help="Readings to seed")
+    parser.add_argument("--repeat", type=int, default=50, help="Requests per variant")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.repeat)
+    print(f"{'variant':<32} {'bytes':>10} {'cpu ms':>8} {'wall ms':>8}")
+    for name, result in report["results"].items():
+        print(f"{name:<32} {result['bytes']:>10} {result['cpu_ms']:>8.2f} {result['wall_ms']:>8.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
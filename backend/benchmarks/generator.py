@@ -0,0 +1,117 @@
+"""Synthetic EnergyReading datasets for benchmarks.
+
+Readings follow a day/night solar curve with cloud cover, a noisy load with
+an evening peak, a battery whose SOC integrates the difference, and random
+outages that leave gaps. Output is deterministic for a given seed.
+
+    python -m benchmarks.generator --rows 1000000 --db data/bench.db
+"""
+
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.pool import NullPool
+
+from models import Base, EnergyReading
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+
+def generate(
+    rows: int,
+    end: Optional[datetime] = None,
+    interval: float = 60.0,
+    gap_probability: float = 0.002,
+    seed: int = 42,
+    capacity_wh: float = 1800.0,
+) -> Iterator[dict]:
+    """Yield `rows` readings ending at `end`, oldest first."""
+    rng = random.Random(seed)
+    end = end or datetime.utcnow()
+    # Gaps make the real span longer than rows * interval; estimate it up front
+    mean_gap_steps = 30
+    span = rows * interval * (1 + gap_probability * mean_gap_steps)
+    ts = end - timedelta(seconds=span)
+
+    soc = 80.0
+    cloud = 0.8
+    yield_today = 0.0
+    day = ts.date()
+    for _ in range(rows):
+        if rng.random() < gap_probability:
+            ts += timedelta(seconds=interval * rng.randint(2, 2 * mean_gap_steps))
+        ts += timedelta(seconds=interval)
+        if ts.date() != day:
+            day, yield_today = ts.date(), 0.0
+
+        hour = ts.hour + ts.minute / 60
+        day_of_year = ts.timetuple().tm_yday
+        # Longer days in summer: 8h in December to 16h in June
+        day_length = 12 + 4 * math.sin(2 * math.pi * (day_of_year - 80) / 365)
+        sunrise = 12 - day_length / 2
+        sun = max(0.0, math.sin(math.pi * (hour - sunrise) / day_length)) if sunrise < hour < 24 - sunrise else 0.0
+        cloud = min(1.0, max(0.1, cloud + rng.gauss(0, 0.03)))
+        solar = 400 * sun ** 1.3 * cloud
+
+        load = 30 + rng.gauss(0, 5) + (45 if 18 <= hour < 22 else 0) + (120 if rng.random() < 0.01 else 0)
+        load = max(5.0, load)
+        net = solar - load
+        soc = min(100.0, max(5.0, soc + net * interval / 3600 / capacity_wh * 100))
+        voltage = 11.9 + soc / 100 * 0.8 + (0.6 if net > 0 else -0.1) * min(1.0, abs(net) / 200)
+        yield_today += solar * interval / 3600 / 1000
+
+        yield {
+            "timestamp": ts,
+            "battery_soc": round(soc, 1),
+            "battery_voltage": round(voltage, 2),
+            "battery_current": round(net / voltage, 2),
+            "battery_power": round(net, 1),
+            "battery_temperature": None,
+            "solar_power": round(solar, 1),
+            "solar_voltage": round(17.5 + 2 * sun, 2) if sun else 0.0,
+            "solar_current": round(solar / voltage, 2),
+            "solar_yield_today": round(yield_today, 3),
+            "consumption_power": round(load, 1),
+            "temperature": round(14 + 6 * math.sin(math.pi * (hour - 9) / 12) + rng.gauss(0, 0.2), 1),
+            "humidity": round(65 - 10 * math.sin(math.pi * (hour - 9) / 12) + rng.gauss(0, 1), 1),
+            "battery_state": "charging" if net > 5 else "discharging" if net < -5 else "idle",
+        }
+
+
+def seed_database(engine, rows: int, chunk_size: int = 50_000, **kwargs) -> float:
+    """Replace all readings in `engine` with `rows` synthetic ones; returns seconds taken."""
+    started = time.perf_counter()
+    Base.metadata.drop_all(bind=engine, tables=[EnergyReading.__table__])
+    Base.metadata.create_all(bind=engine)
+    chunk = []
+    with engine.begin() as conn:
+        for row in generate(rows, **kwargs):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                conn.execute(insert(EnergyReading), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(EnergyReading), chunk)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10k", help="Row count or one of: " + ", ".join(SIZES))
+    parser.add_argument("--db", default="data/bench.db", help="SQLite file to (re)create")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rows = SIZES.get(args.rows) or int(args.rows)
+    engine = create_engine(f"sqlite:///{args.db}", poolclass=NullPool)
+    elapsed = seed_database(engine, rows, seed=args.seed)
+    print(f"Wrote {rows} readings to {args.db} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
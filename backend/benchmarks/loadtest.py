@@ -0,0 +1,254 @@
+"""Async load test replaying the dashboard's request pattern.
+
+Each simulated client behaves like an open dashboard tab (App.jsx): every
+--interval seconds it fetches /api/current, /api/history?hours=24 and
+/api/sun concurrently, and with --refresh-probability it also presses
+refresh (POST /api/refresh followed by a refetch). Clients start at random
+offsets within the first interval.
+
+By default everything runs offline: a fake VRM and the API are started as
+uvicorn subprocesses against a database pre-seeded with synthetic readings,
+and the API's RSS is sampled once a second. Use --url to target a running
+server instead (with --pid to sample its memory).
+
+    python -m benchmarks.loadtest --clients 2000 --duration 120 --interval 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+class LoadTest:
+    def __init__(self, base_url: str, clients: int, duration: float, interval: float,
+                 refresh_probability: float, seed: int = 1,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.transport = transport
+        self.clients = clients
+        self.duration = duration
+        self.interval = interval
+        self.refresh_probability = refresh_probability
+        self.rng = random.Random(seed)
+        # (seconds since start, endpoint, latency seconds, ok)
+        self.samples: list[tuple[float, str, float, bool]] = []
+        self.memory: list[tuple[float, float]] = []
+        self._started = 0.0
+
+    async def _request(self, http: httpx.AsyncClient, method: str, path: str, name: str):
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = await http.request(method, path)
+            await response.aread()
+            ok = response.status_code < 500
+        except httpx.HTTPError:
+            pass
+        self.samples.append((started - self._started, name, time.perf_counter() - started, ok))
+
+    async def _fetch_dashboard(self, http: httpx.AsyncClient):
+        await asyncio.gather(
+            self._request(http, "GET", "/api/current", "current"),
+            self._request(http, "GET", "/api/history?hours=24", "history"),
+            self._request(http, "GET", "/api/sun", "sun"),
+        )
+
+    async def _client(self, http: httpx.AsyncClient, deadline: float):
+        await asyncio.sleep(self.rng.uniform(0, self.interval))
+        while time.perf_counter() < deadline:
+            cycle_started = time.perf_counter()
+            await self._fetch_dashboard(http)
+            if self.rng.random() < self.refresh_probability:
+                await self._request(http, "POST", "/api/refresh", "refresh")
+                await self._fetch_dashboard(http)
+            await asyncio.sleep(max(0.0, self.interval - (time.perf_counter() - cycle_started)))
+
+    async def _sample_memory(self, pid: int):
+        while True:
+            rss = _rss_mb(pid)
+            if rss is not None:
+                self.memory.append((round(time.perf_counter() - self._started, 1), round(rss, 1)))
+            await asyncio.sleep(1)
+
+    async def run(self, pid: Optional[int] = None) -> dict:
+        limits = httpx.Limits(max_connections=min(self.clients * 3, 1000), max_keepalive_connections=200)
+        timeout = httpx.Timeout(30.0)
+        self._started = time.perf_counter()
+        deadline = self._started + self.duration
+        sampler = asyncio.create_task(self._sample_memory(pid)) if pid else None
+        async with httpx.AsyncClient(
+            base_url=self.base_url, limits=limits, timeout=timeout, transport=self.transport
+        ) as http:
+            await asyncio.gather(*(self._client(http, deadline) for _ in range(self.clients)))
+        if sampler:
+            sampler.cancel()
+        return self.report(time.perf_counter() - self._started)
+
+    def report(self, elapsed: float) -> dict:
+        by_endpoint = defaultdict(list)
+        errors = defaultdict(int)
+        windows = defaultdict(list)
+        for at, name, latency, ok in self.samples:
+            by_endpoint[name].append(latency * 1000)
+            windows[int(at // 10) * 10].append(latency * 1000)
+            if not ok:
+                errors[name] += 1
+
+        endpoints = {}
+        for name, latencies in sorted(by_endpoint.items()):
+            latencies.sort()
+            endpoints[name] = {
+                "requests": len(latencies),
+                "errors": errors[name],
+                "p50_ms": round(_percentile(latencies, 50), 1),
+                "p90_ms": round(_percentile(latencies, 90), 1),
+                "p99_ms": round(_percentile(latencies, 99), 1),
+                "max_ms": round(latencies[-1], 1),
+            }
+
+        timeline = []
+        for start, latencies in sorted(windows.items()):
+            latencies.sort()
+            timeline.append({
+                "t": start,
+                "rps": round(len(latencies) / 10, 1),
+                "p95_ms": round(_percentile(latencies, 95), 1),
+            })
+
+        rss = [mb for _, mb in self.memory]
+        return {
+            "benchmark": "loadtest",
+            "clients": self.clients,
+            "interval_s": self.interval,
+            "duration_s": round(elapsed, 1),
+            "requests": len(self.samples),
+            "errors": sum(errors.values()),
+            "throughput_rps": round(len(self.samples) / elapsed, 1) if elapsed else 0.0,
+            "endpoints": endpoints,
+            "timeline": timeline,
+            "memory_mb": {
+                "start": rss[0] if rss else None,
+                "peak": max(rss) if rss else None,
+                "end": rss[-1] if rss else None,
+                "samples": self.memory,
+            },
+        }
+
+
+def _wait_for(url: str, timeout: float = 30.0):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=0.5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} did not come up within {timeout}s")
+
+
+def _start_offline_stack(tmp: str, rows: int, vrm_latency: float) -> tuple[list[subprocess.Popen], str, int]:
+    """Seed a database, start the fake VRM and the API; returns (processes, API URL, API pid)."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+
+    from benchmarks.generator import seed_database
+
+    db_path = os.path.join(tmp, "loadtest.db")
+    seed_database(create_engine(f"sqlite:///{db_path}", poolclass=NullPool), rows)
+
+    vrm_port, api_port = _free_port(), _free_port()
+    env = {
+        **os.environ,
+        "FAKE_VRM_LATENCY": str(vrm_latency),
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "VRM_TOKEN": "loadtest",
+        "VRM_INSTALLATION_ID": "123456",
+        "VRM_API_BASE": f"http://127.0.0.1:{vrm_port}/v2",
+        # Keep retention and the writer away from the real archive and spool
+        "ARCHIVE_DIR": os.path.join(tmp, "archive"),
+        "SPOOL_PATH": os.path.join(tmp, "spool.bin"),
+    }
+    quiet = {"cwd": BACKEND_DIR, "env": env, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning"]
+    vrm = subprocess.Popen(uvicorn + ["fake_vrm:create_app", "--factory", "--port", str(vrm_port)], **quiet)
+    api = subprocess.Popen(uvicorn + ["main:app", "--port", str(api_port)], **quiet)
+    base_url = f"http://127.0.0.1:{api_port}"
+    _wait_for(f"http://127.0.0.1:{vrm_port}/docs")
+    _wait_for(f"{base_url}/api/ready")
+    return [api, vrm], base_url, api.pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500, help="Simulated dashboard tabs")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between polls per client")
+    parser.add_argument("--refresh-probability", type=float, default=0.02, help="Chance per poll of a refresh click")
+    parser.add_argument("--rows", type=int, default=10_000, help="Readings to pre-seed (offline mode)")
+    parser.add_argument("--vrm-latency", type=float, default=0.3, help="Fake VRM response time (offline mode)")
+    parser.add_argument("--url", help="Target a running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="Server pid to sample RSS from (with --url)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            if args.url:
+                base_url, pid = args.url, args.pid
+            else:
+                processes, base_url, pid = _start_offline_stack(tmp, args.rows, args.vrm_latency)
+            test = LoadTest(base_url, args.clients, args.duration, args.interval, args.refresh_probability)
+            report = asyncio.run(test.run(pid))
+        finally:
+            for proc in processes:
+                proc.terminate()
+                proc.wait()
+
+    summary = {k: v for k, v in report.items() if k not in ("timeline", "memory_mb")}
+    summary["memory_peak_mb"] = report["memory_mb"]["peak"]
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Benchmark suite for the API endpoints, retention and ingestion.
+
+Seeds a scratch SQLite database with synthetic readings at each requested
+size, times each benchmark and writes machine-readable results. Pass a
+previous results file as --baseline to fail (exit 1) when any benchmark's
+median is more than --threshold slower.
+
+    python -m benchmarks.run --sizes 10k,1m --output results.json
+    python -m benchmarks.run --baseline results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DB = os.path.join(tempfile.gettempdir(), "victron_bench.db")
+BENCH_ARCHIVE_DIR = os.path.join(tempfile.gettempdir(), "victron_bench_archive")
+BENCH_SPOOL_PATH = os.path.join(tempfile.gettempdir(), "victron_bench_spool.bin")
+HEALTH_URL = "/api/battery/health?days=365"
+QUERY_URL = "/api/query?fields=solar_power&group_by=month,hour_of_day&agg=mean,p95&start=2000-01-01T00:00:00"
+
+
+def _summarize(samples: list[float]) -> dict:
+    samples_ms = sorted(s * 1000 for s in samples)
+    return {
+        "runs": len(samples_ms),
+        "median_ms": round(statistics.median(samples_ms), 3),
+        "p95_ms": round(samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))], 3),
+        "min_ms": round(samples_ms[0], 3),
+    }
+
+
+def timeit(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _summarize(samples)
+
+
+async def timeit_async(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return _summarize(samples)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_suite(sizes: list[str], repeat: int) -> dict:
+    # The app reads DATABASE_URL at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DB}"
+    os.environ["SPOOL_PATH"] = BENCH_SPOOL_PATH
+    os.environ.setdefault("VRM_TOKEN", "benchmark")
+    os.environ.setdefault("VRM_INSTALLATION_ID", "123456")
+    logging_level = os.environ.get("BENCH_LOG_LEVEL", "WARNING")
+
+    import logging
+
+    import httpx
+    from fastapi.testclient import TestClient
+    from sqlalchemy import delete
+
+    import archive
+    import main
+    from benchmarks.generator import SIZES, seed_database
+    from database import engine
+    from fake_vrm import _load, _pad_diagnostics
+    from fake_vrm import create_app as create_fake_vrm
+    from models import BatteryHealthDay
+    from vrm_client import VRMClient
+
+    logging.getLogger().setLevel(logging_level)
+    archive.ARCHIVE_DIR = BENCH_ARCHIVE_DIR
+    client = TestClient(main.app)
+    results = {}
+
+    def get(url: str):
+        # Time the endpoint, not a snapshot cached by CompressionMiddleware
+        main.response_cache.clear()
+        client.get(url).raise_for_status()
+
+    # Parsing doesn't depend on the database size
+    vrm = VRMClient.__new__(VRMClient)
+    for extra in (0, 500):
+        payload = _pad_diagnostics(_load("vrm_diagnostics.json"), extra)
+        results[f"parse_diagnostic_data/{extra}_extra"] = timeit(
+            lambda p=payload: vrm.parse_diagnostic_data(p), repeat * 10
+        )
+
+    for size in sizes:
+        rows = SIZES.get(size) or int(size)
+        # Archive blocks from the previous size (or run) would leak into this size's timings
+        shutil.rmtree(BENCH_ARCHIVE_DIR, ignore_errors=True)
+        print(f"Seeding {rows} readings...", file=sys.stderr)
+        results[f"seed@{size}"] = {"runs": 1, "seconds": round(seed_database(engine, rows), 2)}
+        main._latest_reading = None
+
+        for name, url in [
+            ("current", "/api/current"),
+            ("history_24h", "/api/history?hours=24"),
+            ("history_168h", "/api/history?hours=168"),
+            ("stats", "/api/stats"),
+            ("query_month_hour_p95", QUERY_URL),
+        ]:
+            results[f"{name}@{size}"] = timeit(lambda u=url: get(u), repeat)
+
+        main.vrm_client = VRMClient(transport=httpx.ASGITransport(app=create_fake_vrm()))
+        results[f"ingest_cycle@{size}"] = asyncio.run(timeit_async(main.fetch_and_store_data, repeat))
+        main.vrm_client = None
+
+        # Destructive, so measured once and last; expired days move to the archive
+        results[f"cleanup_old_readings@{size}"] = timeit(main.cleanup_old_readings, 1, warmup=0)
+        results[f"history_720h_archive@{size}"] = timeit(lambda: get("/api/history?hours=720"), repeat)
+        results[f"query_month_hour_p95_archive@{size}"] = timeit(lambda: get(QUERY_URL), repeat)
+
+        # A year of battery health: computed from the archive on first request, then a table read
+        def battery_health_uncached():
+            with engine.begin() as conn:
+                conn.execute(delete(BatteryHealthDay))
+            get(HEALTH_URL)
+
+        results[f"battery_health_365d_uncached@{size}"] = timeit(battery_health_uncached, repeat, warmup=0)
+        results[f"battery_health_365d@{size}"] = timeit(lambda: get(HEALTH_URL), repeat)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print a comparison table and return the names of regressed benchmarks."""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or "median_ms" not in result or "median_ms" not in base:
+            continue
+        change = result["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {base['median_ms']:>10.2f}ms {result['median_ms']:>10.2f}ms {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k", help="Comma-separated dataset sizes (10k, 1m, 10m or a number)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per benchmark")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes.split(","), args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
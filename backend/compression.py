@@ -0,0 +1,244 @@
+"""Response compression (brotli or gzip) with a cache of compressed snapshots.
+
+CompressionMiddleware negotiates the encoding from Accept-Encoding and
+compresses compressible responses of at least `minimum_size` bytes,
+including streamed ones. For the dashboard's polled endpoints, the whole
+response is also cached per data version (the latest reading's timestamp):
+a snapshot is serialized once and compressed once per encoding per new
+reading, instead of once per request.
+"""
+
+import gzip
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is offered
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # Bytes
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "64"))
+# Snapshots are also refreshed after this long, since e.g. history windows slide
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred supported encoding the client accepts (ignores q-values other than q=0)."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor that flushes every chunk so streamed data isn't held back."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, chunk: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._br.process(chunk)
+            return out + (self._br.finish() if final else self._br.flush())
+        out = self._gz.compress(chunk)
+        return out + self._gz.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _compressible(headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return "content-encoding" not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CachedResponse:
+    """A complete response body plus its compressed forms, computed on first use."""
+
+    def __init__(self, status: int, headers: list[tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = [(k, v) for k, v in headers if k.lower() not in (b"content-length", b"vary")]
+        self.body = body
+        self.created = time.monotonic()
+        self.encoded: dict[str, bytes] = {}
+
+    def payload(self, encoding: Optional[str], minimum_size: int) -> tuple[Optional[str], bytes]:
+        if encoding is None or len(self.body) < minimum_size:
+            return None, self.body
+        if encoding not in self.encoded:
+            self.encoded[encoding] = compress(self.body, encoding)
+        return encoding, self.encoded[encoding]
+
+    async def send(self, send, encoding: Optional[str], minimum_size: int, cache_status: str):
+        encoding, body = self.payload(encoding, minimum_size)
+        headers = MutableHeaders(raw=list(self.headers))
+        headers["content-length"] = str(len(body))
+        headers["vary"] = "Accept-Encoding"
+        headers["x-cache"] = cache_status
+        if encoding:
+            headers["content-encoding"] = encoding
+        await send({"type": "http.response.start", "status": self.status, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
+
+
+class ResponseCache:
+    """LRU of CachedResponse keyed by (path, query string, data version)."""
+
+    def __init__(self, size: int = RESPONSE_CACHE_ENTRIES, ttl: float = RESPONSE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.created > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        # Entries for an older data version of the same request are dead
+        for old in [k for k in self._entries if k[:2] == key[:2]]:
+            del self._entries[old]
+        self._entries[key] = entry
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": sum(len(e.body) + sum(map(len, e.encoded.values())) for e in self._entries.values()),
+        }
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses, with an optional snapshot cache.
+
+    GET requests to `cacheable_paths` are answered from `cache` while
+    `version()` is unchanged; all other responses are compressed on the fly.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, cache: Optional[ResponseCache] = None,
+                 version: Optional[Callable[[], object]] = None, cacheable_paths: tuple = ()):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self.version = version or (lambda: None)
+        self.cacheable_paths = set(cacheable_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if self.cache is not None and scope["method"] == "GET" and scope["path"] in self.cacheable_paths:
+            await self._cached(scope, receive, send, encoding)
+        elif encoding:
+            await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+        else:
+            await self.app(scope, receive, send)
+
+    async def _cached(self, scope, receive, send, encoding: Optional[str]):
+        key = (scope["path"], scope["query_string"], self.version())
+        entry = self.cache.get(key)
+        if entry is not None:
+            await entry.send(send, encoding, self.minimum_size, "hit")
+            return
+
+        start, chunks = {}, []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        entry = CachedResponse(start["status"], start.get("headers", []), b"".join(chunks))
+        compressible = _compressible(Headers(raw=entry.headers))
+        if entry.status == 200 and compressible:
+            self.cache.put(key, entry)
+        await entry.send(send, encoding if compressible else None, self.minimum_size, "miss")
+
+
+class _CompressingSend:
+    """Wraps ASGI `send`, compressing the body once the response start is known."""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[dict] = None
+        self.compressor: Optional[_StreamCompressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            if not _compressible(headers) or (not more and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            headers["content-encoding"] = self.encoding
+            headers.append("vary", "Accept-Encoding")
+            if more:
+                del headers["content-length"]
+            else:
+                body = compress(body, self.encoding)
+                headers["content-length"] = str(len(body))
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            self.compressor = _StreamCompressor(self.encoding)
+            await self.send(self.start)
+
+        await self.send({
+            "type": "http.response.body",
+            "body": self.compressor.process(body, final=not more),
+            "more_body": more,
+        })
@@ -5,6 +5,7 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 
 from models import Base
+from profiling import install_sql_hooks
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/victron.db")
 
@@ -13,10 +14,16 @@ os.makedirs("data", exist_ok=True)
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=NullPool)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+install_sql_hooks(engine, SessionLocal)
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        # Persistent per database file: readers (analytics, exports) no longer
+        # block the poller's writes, and vice versa
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
 
 
 def get_db():
@@ -0,0 +1,106 @@
+"""Compact store for every VRM diagnostic attribute.
+
+parse_diagnostic_data keeps only the codes that map to EnergyReading
+columns. Everything a poll returns (charger state, MPPT error codes,
+relays, per-device temperatures, ...) is also kept here: the
+diagnostic_attributes table maps each (code, instance) to a small integer
+id, and each reading gets one narrow (attribute_id, reading_id, value) row
+per attribute, inserted in bulk in the reading's transaction. New codes
+need no schema change. Values are deleted with their readings, in the same
+transaction.
+
+benchmarks/attributes.py compares storage per poll with one column per code.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, insert, select
+
+from database import engine
+from models import DiagnosticAttribute, DiagnosticValue, EnergyReading
+from vrm_client import Attribute
+
+
+def attribute_ids(conn, attributes: list[Attribute]) -> dict[tuple[str, int], int]:
+    """Id per (code, instance), adding attributes not seen before to the dictionary."""
+    query = select(DiagnosticAttribute.code, DiagnosticAttribute.instance, DiagnosticAttribute.id)
+    ids = {(code, instance): id_ for code, instance, id_ in conn.execute(query)}
+    new = {(a.code, a.instance): a for a in attributes if (a.code, a.instance) not in ids}
+    if new:
+        # OR IGNORE: another worker may add the same attribute concurrently
+        conn.execute(insert(DiagnosticAttribute).prefix_with("OR IGNORE"), [
+            {"code": a.code, "instance": a.instance, "device": a.device, "description": a.description}
+            for a in new.values()
+        ])
+        ids = {(code, instance): id_ for code, instance, id_ in conn.execute(query)}
+    return ids
+
+
+def store_attributes(conn, readings: list[tuple[int, list[Attribute]]]) -> int:
+    """Insert the attributes of each (reading id, attributes) pair; returns rows written."""
+    ids = attribute_ids(conn, [a for _, attributes in readings for a in attributes])
+    rows = [
+        {
+            "attribute_id": ids[(a.code, a.instance)],
+            "reading_id": reading_id,
+            "value": a.value if isinstance(a.value, float) else None,
+            "text": a.value if isinstance(a.value, str) else None,
+        }
+        for reading_id, attributes in readings
+        for a in attributes
+    ]
+    if rows:
+        conn.execute(insert(DiagnosticValue), rows)
+    return len(rows)
+
+
+def delete_values(db, readings) -> int:
+    """Delete the values of the readings selected by `readings` (a select of EnergyReading.id).
+
+    Runs in the caller's session, so values go in the same transaction as
+    the readings they belong to. They aren't archived.
+    """
+    return db.execute(delete(DiagnosticValue).where(DiagnosticValue.reading_id.in_(readings))).rowcount
+
+
+def list_attributes() -> list[dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            DiagnosticAttribute.code,
+            DiagnosticAttribute.instance,
+            DiagnosticAttribute.device,
+            DiagnosticAttribute.description,
+        ).order_by(DiagnosticAttribute.code, DiagnosticAttribute.instance))
+        return [row._asdict() for row in rows]
+
+
+def series(code: str, instance: int, start: datetime, end: datetime) -> Optional[dict]:
+    """One attribute's values for readings in [start, end), or None if the attribute is unknown."""
+    with engine.connect() as conn:
+        attribute = conn.execute(select(DiagnosticAttribute).where(
+            DiagnosticAttribute.code == code,
+            DiagnosticAttribute.instance == instance,
+        )).first()
+        if attribute is None:
+            return None
+        rows = conn.execute(
+            select(EnergyReading.timestamp, DiagnosticValue.value, DiagnosticValue.text)
+            .join(EnergyReading, EnergyReading.id == DiagnosticValue.reading_id)
+            .where(
+                DiagnosticValue.attribute_id == attribute.id,
+                EnergyReading.timestamp >= start,
+                EnergyReading.timestamp < end,
+            )
+            .order_by(EnergyReading.timestamp)
+        ).all()
+    return {
+        "code": attribute.code,
+        "instance": attribute.instance,
+        "device": attribute.device,
+        "description": attribute.description,
+        "points": [
+            {"timestamp": ts.isoformat(), "value": value if text is None else text}
+            for ts, value, text in rows
+        ],
+    }
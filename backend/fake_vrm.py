@@ -0,0 +1,77 @@
+"""In-process stand-in for the VRM API, serving recorded fixtures.
+
+Used by tests (via httpx.ASGITransport) and benchmarks so nothing talks to
+the real VRM. Stats are replayed from a single recorded day: every requested
+interval is answered with the fixture point for the same time of day.
+Latency and diagnostics payload size are configurable; to serve it over HTTP:
+
+    FAKE_VRM_LATENCY=0.2 uvicorn fake_vrm:create_app --factory --port 8100
+"""
+
+import asyncio
+import json
+import os
+from collections import deque
+
+from fastapi import FastAPI, Request
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+FAKE_VRM_LATENCY = float(os.getenv("FAKE_VRM_LATENCY", "0"))  # Seconds per response
+FAKE_VRM_EXTRA_RECORDS = int(os.getenv("FAKE_VRM_EXTRA_RECORDS", "0"))  # Padding for diagnostics
+
+
+def _load(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+def _pad_diagnostics(diagnostics: dict, extra_records: int) -> dict:
+    """Add unmapped attribute records, as sent by installations with many devices."""
+    template = diagnostics["records"][0]
+    padding = [
+        {**template, "code": f"X{i}", "idDataAttribute": 10_000 + i, "instance": i % 8,
+         "description": f"Synthetic attribute {i}", "rawValue": float(i), "formattedValue": f"{i}"}
+        for i in range(extra_records)
+    ]
+    return {**diagnostics, "records": diagnostics["records"] + padding}
+
+
+def create_app(latency: float = FAKE_VRM_LATENCY, extra_records: int = FAKE_VRM_EXTRA_RECORDS) -> FastAPI:
+    app = FastAPI(title="Fake VRM")
+    app.state.requests = deque(maxlen=10_000)
+    diagnostics = _pad_diagnostics(_load("vrm_diagnostics.json"), extra_records)
+    stats_day = _load("vrm_stats_day.json")["records"]
+
+    # Index the recorded day by 15-minute slot of the day
+    stats_by_slot = {
+        code: {(point[0] // 1000 % 86400) // 900: point[1:] for point in points}
+        for code, points in stats_day.items()
+    }
+
+    @app.get("/v2/installations/{installation_id}/diagnostics")
+    async def get_diagnostics(installation_id: str, request: Request):
+        app.state.requests.append(request.url.path)
+        if latency:
+            await asyncio.sleep(latency)
+        return diagnostics
+
+    @app.get("/v2/installations/{installation_id}/stats")
+    async def get_stats(installation_id: str, request: Request, start: int, end: int):
+        app.state.requests.append(request.url.path)
+        if latency:
+            await asyncio.sleep(latency)
+        codes = request.query_params.getlist("attributeCodes[]")
+        first_slot = -(-start // 900)
+        records = {}
+        for code in codes:
+            slots = stats_by_slot.get(code)
+            if slots is None:
+                continue
+            records[code] = [
+                [t * 900 * 1000, *slots[t % 96]]
+                for t in range(first_slot, end // 900 + 1)
+                if t % 96 in slots
+            ]
+        return {"success": True, "records": records}
+
+    return app
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import engine
+from models import EnergyReading, Lease
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", "3"))
+READING_WATCH_INTERVAL = float(os.getenv("READING_WATCH_INTERVAL", "1"))
+
+
+def try_acquire(name: str, holder: str, ttl: float) -> bool:
+    """Take or renew a lease in a single statement.
+
+    The upsert only overwrites the row if we already hold it or it has
+    expired, so SQLite's write lock makes this safe across processes.
+    """
+    now = datetime.utcnow()
+    stmt = insert(Lease).values(name=name, holder=holder, expires_at=now + timedelta(seconds=ttl))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Lease.name],
+        set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at},
+        where=(Lease.holder == holder) | (Lease.expires_at < now),
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+        current = conn.execute(select(Lease.holder).where(Lease.name == name)).scalar()
+    return current == holder
+
+
+def release(name: str, holder: str):
+    with engine.begin() as conn:
+        conn.execute(delete(Lease).where(Lease.name == name, Lease.holder == holder))
+
+
+class LeaderElector:
+    """Elects one process (across uvicorn workers) to run background jobs.
+
+    Every worker tries to take the lease every `renew_interval` seconds; the
+    holder renews it, everyone else only wins once it has expired. If the
+    leader dies, another worker takes over within `ttl + renew_interval`
+    seconds. A leader that cannot renew for a whole TTL steps down, since
+    another worker may already have taken over.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        on_elected: Callable[[], None],
+        on_demoted: Callable[[], None],
+        ttl: float = LEADER_LEASE_TTL,
+        renew_interval: float = LEADER_RENEW_INTERVAL,
+    ):
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.is_leader = False
+        self._last_renewed: Optional[float] = None
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            logger.info(f"Acquired {self.name} lease as {self.holder}")
+            self.on_elected()
+        else:
+            logger.warning(f"Lost {self.name} lease as {self.holder}")
+            self.on_demoted()
+
+    async def step(self):
+        loop = asyncio.get_running_loop()
+        try:
+            acquired = await asyncio.to_thread(try_acquire, self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error(f"Lease renewal error: {e}")
+            if self.is_leader and loop.time() - self._last_renewed >= self.ttl:
+                self._set_leader(False)
+            return
+        if acquired:
+            self._last_renewed = loop.time()
+        self._set_leader(acquired)
+
+    async def run(self):
+        try:
+            while True:
+                await self.step()
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            if self.is_leader:
+                self._set_leader(False)
+                try:
+                    release(self.name, self.holder)
+                except Exception as e:
+                    logger.error(f"Lease release error: {e}")
+
+
+def latest_reading_id() -> Optional[int]:
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(EnergyReading.id))).scalar()
+
+
+async def watch_readings(on_change: Callable[[], None], should_watch: Callable[[], bool],
+                         interval: float = READING_WATCH_INTERVAL):
+    """Call `on_change` when another process stores a new reading.
+
+    Workers that don't run the poller use this to keep in-process caches
+    fresh; the newest row id is a cheap primary-key lookup.
+    """
+    unset = object()
+    last_id = unset
+    while True:
+        await asyncio.sleep(interval)
+        if not should_watch():
+            last_id = unset
+            continue
+        try:
+            current = await asyncio.to_thread(latest_reading_id)
+            if last_id is not unset and current != last_id:
+                await asyncio.to_thread(on_change)
+            last_id = current
+        except Exception as e:
+            logger.error(f"Reading watch error: {e}")
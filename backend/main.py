@@ -1,20 +1,50 @@
 import asyncio
-import gc
+import hmac
 import logging
 import os
+import time
 from contextlib import asynccontextmanager, suppress
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import httpx
-from fastapi import Depends, FastAPI, HTTPException, Query
+import numpy as np
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import desc
+from sqlalchemy import desc, select
 from sqlalchemy.orm import Session
 
+import alerts
+import analytics
+import archive
+import battery_health
+import diagnostics
+import resample
+from alerts import (
+    ALERT_STATE_INTERVAL,
+    ALERT_WEBHOOK_URLS,
+    AlertEngine,
+    WebhookDispatcher,
+    load_rules,
+)
+from backfill import backfill
+from battery_health import HEALTH_FLUSH_INTERVAL, DailyTracker
+from compression import CompressionMiddleware, ResponseCache
 from database import get_db, init_db
+from leader import LeaderElector, watch_readings
+from memory import MEMORY_SAMPLE_INTERVAL, MemoryMonitor
 from models import EnergyReading
-from vrm_client import VRMClient
+from profiling import (
+    ProfileStore,
+    StackSampler,
+    end_request,
+    reset_sql_metrics,
+    sql_metrics,
+    start_request,
+)
+from sources import INGEST_SOURCE, IngestionSource, VenusMQTTSource, VRMPollingSource
+from spool import ReadingWriter
+from vrm_client import READING_FIELDS, VRMClient
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,9 +62,28 @@ LOCATION_NAME = os.getenv("LOCATION_NAME", "London")
 # Optional weather API
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 
+# Token for /api/admin/* and request profiling; admin features are off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 vrm_client: VRMClient = None
 http_client: httpx.AsyncClient = None
+alert_engine: AlertEngine = None
+ingest_source: IngestionSource = None
 _background_tasks: list[asyncio.Task] = []
+# Tasks that must run in exactly one worker process (see leader.py)
+_leader_tasks: list[asyncio.Task] = []
+elector: LeaderElector = None
+
+# Most recent reading, kept in memory so /api/current doesn't hit the database.
+# Loaded from the database in the background at startup.
+_latest_reading: Optional[dict] = None
+_sun_cache: dict = {}
+_ready = False
+profiles = ProfileStore()
+memory = MemoryMonitor()
+response_cache = ResponseCache()
+writer = ReadingWriter()
+battery_tracker = DailyTracker(BATTERY_CAPACITY_AH, BATTERY_MIN_SOC)
 
 
 def calculate_time_remaining(
@@ -102,55 +151,67 @@ def calculate_time_remaining(
     return result
 
 
-async def fetch_and_store_data():
-    """Fetch data from VRM and store in database."""
-    from database import SessionLocal
+def store_reading(parsed: dict):
+    """Store a parsed reading and, on the leader, run it through the alert rules.
 
-    try:
-        diagnostics = await vrm_client.get_diagnostic_data()
-        if not diagnostics:
-            logger.warning("No diagnostic data received from VRM")
-            return
+    The database write is queued (see spool.py), so this never waits for
+    storage; the reading is served from memory straight away. Any worker
+    may store a reading (/api/refresh), but only the leader's engine holds
+    the restored alert state, so only it evaluates and notifies.
+    """
+    global _latest_reading
 
-        parsed = vrm_client.parse_diagnostic_data(diagnostics)
+    reading = {"timestamp": datetime.utcnow(), **{field: parsed[field] for field in READING_FIELDS}}
+    writer.submit({**reading, "attributes": parsed.get("attributes")})
+    logger.info(f"Queued reading: SOC={parsed['battery_soc']}%, Solar={parsed['solar_power']}W")
 
-        db = SessionLocal()
-        try:
-            reading = EnergyReading(
-                battery_soc=parsed["battery_soc"],
-                battery_voltage=parsed["battery_voltage"],
-                battery_current=parsed["battery_current"],
-                battery_power=parsed["battery_power"],
-                battery_temperature=parsed["battery_temperature"],
-                solar_power=parsed["solar_power"],
-                solar_voltage=parsed["solar_voltage"],
-                solar_current=parsed["solar_current"],
-                solar_yield_today=parsed["solar_yield_today"],
-                consumption_power=parsed["consumption_power"],
-                temperature=parsed["temperature"],
-                humidity=parsed["humidity"],
-                battery_state=parsed["battery_state"],
-            )
-            db.add(reading)
-            db.commit()
-            logger.info(f"Stored reading: SOC={parsed['battery_soc']}%, Solar={parsed['solar_power']}W")
-        finally:
-            db.close()
+    _latest_reading = reading
+    battery_tracker.observe(reading)
+
+    if alert_engine and (elector is None or elector.is_leader):
+        alert_engine.evaluate(parsed)
+
+
+async def fetch_and_store_data():
+    """Fetch data from VRM and store in database."""
+    try:
+        parsed = await VRMPollingSource(vrm_client).read()
+        if parsed:
+            store_reading(parsed)
     except Exception as e:
         logger.error(f"Error fetching/storing data: {e}")
 
 
+def load_latest_reading() -> Optional[dict]:
+    """Load the most recent stored reading as a dict."""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        reading = db.query(EnergyReading).order_by(desc(EnergyReading.timestamp)).first()
+        if not reading:
+            return None
+        return {"timestamp": reading.timestamp, **{field: getattr(reading, field) for field in READING_FIELDS}}
+    finally:
+        db.close()
+
+
 def cleanup_old_readings():
-    """Delete readings older than 7 days to prevent unbounded database growth."""
+    """Archive, then delete, readings older than 7 days to keep the database small."""
     from database import SessionLocal
 
     db = SessionLocal()
     try:
         cutoff = datetime.utcnow() - timedelta(days=7)
-        deleted = db.query(EnergyReading).filter(
-            EnergyReading.timestamp < cutoff
-        ).delete()
-        db.commit()
+        if archive.ARCHIVE_DIR:
+            # Deletes exactly the readings it archived; any stored meanwhile
+            # (e.g. a spool replay) wait for the next run rather than being lost
+            deleted = archive.archive_expired(cutoff)
+        else:
+            expired = EnergyReading.timestamp < cutoff
+            diagnostics.delete_values(db, select(EnergyReading.id).where(expired))
+            deleted = db.query(EnergyReading).filter(expired).delete()
+            db.commit()
         if deleted:
             logger.info(f"Cleaned up {deleted} readings older than 7 days")
     except Exception as e:
@@ -160,34 +221,182 @@ def cleanup_old_readings():
         db.close()
 
 
-async def _periodic_fetch():
-    """Fetch VRM data every 60 seconds."""
+async def _periodic_alert_check():
+    """Check time-based alert rules (e.g. no data) every 60 seconds."""
     while True:
+        await asyncio.sleep(60)
         try:
-            await fetch_and_store_data()
+            alert_engine.check_stale()
         except Exception as e:
-            logger.error(f"Periodic fetch error: {e}")
-        await asyncio.sleep(60)
+            logger.error(f"Periodic alert check error: {e}")
+
+
+async def _periodic_alert_state():
+    """Carry on from the stored alert state, then store ours whenever it changes (for the other workers)."""
+    try:
+        alert_engine.restore(await asyncio.to_thread(alerts.load_states))
+    except Exception as e:
+        logger.error(f"Alert state restore error: {e}")
+    saved = None
+    while True:
+        try:
+            states = alert_engine.states()
+            if states != saved:
+                await asyncio.to_thread(alerts.save_states, states)
+                saved = states
+        except Exception as e:
+            logger.error(f"Alert state save error: {e}")
+        await asyncio.sleep(ALERT_STATE_INTERVAL)
+
+
+async def _periodic_backfill():
+    """Fill gaps left by downtime from VRM historical stats, on startup and hourly."""
+    while True:
+        try:
+            if await backfill(vrm_client):
+                # Readings older than the ones already folded into today's battery health
+                battery_tracker.invalidate()
+        except Exception as e:
+            logger.error(f"Periodic backfill error: {e}")
+        await asyncio.sleep(3600)
+
+
+async def _periodic_battery_health():
+    """Save today's battery health as readings arrive; recompute recent days hourly and after backfill."""
+    try:
+        await asyncio.to_thread(battery_tracker.resume)
+    except Exception as e:
+        logger.error(f"Battery health resume error: {e}")
+    refreshed = None
+    while True:
+        try:
+            if battery_tracker.stale:
+                await asyncio.to_thread(battery_tracker.resume)
+                refreshed = None
+            if refreshed is None or time.monotonic() - refreshed >= 3600:
+                today = battery_health.local_today()
+                await asyncio.to_thread(
+                    battery_health.refresh_days, today - timedelta(days=7), today - timedelta(days=1),
+                    BATTERY_CAPACITY_AH, BATTERY_MIN_SOC,
+                )
+                refreshed = time.monotonic()
+            await asyncio.to_thread(battery_tracker.flush)
+        except Exception as e:
+            logger.error(f"Battery health update error: {e}")
+        await asyncio.sleep(HEALTH_FLUSH_INTERVAL)
 
 
 async def _periodic_cleanup():
-    """Clean up old readings every hour and collect garbage."""
+    """Clean up old readings every hour."""
     while True:
         try:
-            cleanup_old_readings()
-            gc.collect()
+            await asyncio.to_thread(cleanup_old_readings)
         except Exception as e:
             logger.error(f"Periodic cleanup error: {e}")
         await asyncio.sleep(3600)
 
 
+async def _periodic_memory_check():
+    """Sample memory use and shed caches when over the soft budget."""
+    while True:
+        try:
+            memory.check()
+        except Exception as e:
+            logger.error(f"Memory check error: {e}")
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+
+def _clear_sun_cache() -> int:
+    count = 1 if _sun_cache else 0
+    _sun_cache.clear()
+    return count
+
+
+def _sun_times(day) -> tuple[datetime, datetime]:
+    """Sunrise and sunset for a date, computed once per day."""
+    from zoneinfo import ZoneInfo
+
+    from astral import LocationInfo
+    from astral.sun import sun
+
+    if _sun_cache.get("date") != day:
+        location = LocationInfo(
+            name=LOCATION_NAME,
+            region="",
+            timezone="Europe/London",
+            latitude=LOCATION_LAT,
+            longitude=LOCATION_LON,
+        )
+        s = sun(location.observer, date=day, tzinfo=ZoneInfo("Europe/London"))
+        _sun_cache.update(date=day, sunrise=s["sunrise"], sunset=s["sunset"])
+    return _sun_cache["sunrise"], _sun_cache["sunset"]
+
+
+def _warm_up():
+    """Load state and heavy modules off the request path (runs in a worker thread)."""
+    global _latest_reading
+    from zoneinfo import ZoneInfo
+
+    latest = load_latest_reading()
+    # A reading may have been stored while we were loading
+    if _latest_reading is None:
+        _latest_reading = latest
+    _sun_times(datetime.now(ZoneInfo("Europe/London")).date())
+
+
+def _refresh_latest_reading():
+    """Reload the latest reading after another worker stored one."""
+    global _latest_reading
+    _latest_reading = load_latest_reading()
+
+
+def _start_leader_tasks():
+    """Start polling and maintenance; called when this worker becomes leader."""
+    _leader_tasks.append(asyncio.create_task(_periodic_cleanup()))
+    _leader_tasks.append(asyncio.create_task(_periodic_alert_check()))
+    _leader_tasks.append(asyncio.create_task(_periodic_alert_state()))
+    battery_tracker.start()
+    _leader_tasks.append(asyncio.create_task(_periodic_battery_health()))
+    if vrm_client:
+        _leader_tasks.append(asyncio.create_task(_periodic_backfill()))
+    if ingest_source:
+        logger.info(f"Ingesting readings from {ingest_source.name}")
+        _leader_tasks.append(asyncio.create_task(ingest_source.run(store_reading)))
+
+
+def _stop_leader_tasks():
+    battery_tracker.stop()
+    for task in _leader_tasks:
+        task.cancel()
+    _leader_tasks.clear()
+
+
+async def _startup():
+    """Warm caches in the background, then mark the app ready."""
+    global _ready
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_warm_up)
+    except Exception as e:
+        logger.error(f"Startup warm-up error: {e}")
+    _ready = True
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global vrm_client, http_client
+    global vrm_client, http_client, alert_engine, ingest_source, elector
 
     # Initialize database
     init_db()
 
+    # Memory is tracked per worker process
+    memory.register_cache("profiles", profiles.clear)
+    memory.register_cache("sql_statement_stats", reset_sql_metrics)
+    memory.register_cache("sun_times", _clear_sun_cache)
+    memory.register_cache("responses", response_cache.clear)
+    _background_tasks.append(asyncio.create_task(_periodic_memory_check()))
+
     # Initialize shared HTTP client
     http_client = httpx.AsyncClient(timeout=10.0)
 
@@ -199,24 +408,47 @@ async def lifespan(app: FastAPI):
         logger.error(f"VRM client initialization failed: {e}")
         logger.warning("Running without VRM connection - configure VRM_TOKEN and VRM_INSTALLATION_ID")
 
-    # Run cleanup on startup
-    cleanup_old_readings()
-
-    # Start background tasks
-    _background_tasks.append(asyncio.create_task(_periodic_cleanup()))
-    if vrm_client:
-        await fetch_and_store_data()
-        _background_tasks.append(asyncio.create_task(_periodic_fetch()))
+    if INGEST_SOURCE == "mqtt":
+        try:
+            ingest_source = VenusMQTTSource()
+        except ValueError as e:
+            logger.error(f"MQTT source initialization failed: {e}")
+    elif vrm_client:
+        ingest_source = VRMPollingSource(vrm_client)
+
+    # Initialize alerting
+    dispatcher = WebhookDispatcher(ALERT_WEBHOOK_URLS)
+    alert_engine = AlertEngine(load_rules(BATTERY_MIN_SOC, ingesting=ingest_source is not None), dispatcher)
+    if ALERT_WEBHOOK_URLS:
+        _background_tasks.append(asyncio.create_task(dispatcher.run(http_client)))
+
+    # Everything below runs in the background so the app serves traffic
+    # immediately: warm-up, retention cleanup and the first fetch.
+    _background_tasks.append(asyncio.create_task(_startup()))
+
+    # With several uvicorn workers only the elected leader polls and runs
+    # maintenance; the others follow new readings through the database.
+    elector = LeaderElector("poller", _start_leader_tasks, _stop_leader_tasks)
+    _background_tasks.append(asyncio.create_task(elector.run()))
+    # Any worker may store readings (e.g. /api/refresh); only the leader
+    # replays the spool
+    _background_tasks.append(asyncio.create_task(writer.run(lambda: elector.is_leader)))
+    _background_tasks.append(asyncio.create_task(
+        watch_readings(_refresh_latest_reading, lambda: not elector.is_leader)
+    ))
 
     yield
 
-    # Shutdown background tasks
-    for task in _background_tasks:
+    # Shutdown background tasks (the elector releases its lease so another
+    # worker can take over straight away)
+    tasks = _background_tasks + _leader_tasks
+    for task in tasks:
         task.cancel()
-    for task in _background_tasks:
+    for task in tasks:
         with suppress(asyncio.CancelledError):
             await task
     _background_tasks.clear()
+    _leader_tasks.clear()
 
     if vrm_client:
         await vrm_client.close()
@@ -226,6 +458,20 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="Victron Monitor", lifespan=lifespan)
 
+
+def _data_version():
+    """Changes whenever a new reading is stored (or seen from another worker)."""
+    return _latest_reading["timestamp"] if _latest_reading else None
+
+
+# Dashboard polls are served from compressed snapshots until the next reading
+app.add_middleware(
+    CompressionMiddleware,
+    cache=response_cache,
+    version=_data_version,
+    cacheable_paths=("/api/current", "/api/history", "/api/stats"),
+)
+
 # CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -237,82 +483,217 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id", "X-Cache"],
 )
 
 
+def _flag(value: Optional[str]) -> bool:
+    """A boolean query parameter or header: 1/true/yes/on."""
+    return value is not None and value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency for admin endpoints: a valid X-Admin-Token header."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Log each API request with its SQL statement count and time.
+
+    With ?profile=1 or an X-Profile header (plus a valid X-Admin-Token) the
+    request is also run under a sampling profiler and rows returned are
+    counted; the profile is stored and its id returned in the X-Profile-Id
+    header.
+    """
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+
+    profiled = (_flag(request.query_params.get("profile")) or _flag(request.headers.get("x-profile"))) and _is_admin(
+        request.headers.get("x-admin-token")
+    )
+    stats, token = start_request(count_rows=profiled)
+    sampler = None
+    if profiled:
+        sampler = StackSampler()
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profile = sampler.stop() if sampler else None
+        end_request(token)
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    response.headers["Server-Timing"] = (
+        f'sql;dur={stats.total_ms:.1f};desc="{stats.count} queries", app;dur={duration_ms:.1f}'
+    )
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profiles.add(
+            request.method, request.url.path, duration_ms, profile, stats
+        )
+    logger.info(
+        f"{request.method} {request.url.path} {response.status_code} {duration_ms:.1f}ms "
+        f"sql={stats.count} sql_ms={stats.total_ms:.1f}" + (f" rows={stats.rows}" if profiled else "")
+    )
+    return response
+
+
 @app.get("/api/current")
 async def get_current_data(db: Session = Depends(get_db)):
     """Get the most recent reading."""
-    reading = db.query(EnergyReading).order_by(desc(EnergyReading.timestamp)).first()
+    reading = _latest_reading
+    if reading is None:
+        row = db.query(EnergyReading).order_by(desc(EnergyReading.timestamp)).first()
+        if row:
+            reading = {"timestamp": row.timestamp, **{field: getattr(row, field) for field in READING_FIELDS}}
 
     if not reading:
         return {"error": "No data available"}
 
     time_remaining = calculate_time_remaining(
-        reading.battery_soc,
-        reading.consumption_power,
-        reading.solar_power,
+        reading["battery_soc"],
+        reading["consumption_power"],
+        reading["solar_power"],
     )
 
     return {
-        "timestamp": reading.timestamp.isoformat(),
+        "timestamp": reading["timestamp"].isoformat(),
         "battery": {
-            "soc": reading.battery_soc,
-            "voltage": reading.battery_voltage,
-            "current": reading.battery_current,
-            "power": reading.battery_power,
-            "state": reading.battery_state,
+            "soc": reading["battery_soc"],
+            "voltage": reading["battery_voltage"],
+            "current": reading["battery_current"],
+            "power": reading["battery_power"],
+            "state": reading["battery_state"],
             "time_remaining": time_remaining,
             "capacity_ah": BATTERY_CAPACITY_AH,
             "min_soc": BATTERY_MIN_SOC,
         },
         "solar": {
-            "power": reading.solar_power,
-            "voltage": reading.solar_voltage,
-            "current": reading.solar_current,
-            "yield_today": reading.solar_yield_today,
+            "power": reading["solar_power"],
+            "voltage": reading["solar_voltage"],
+            "current": reading["solar_current"],
+            "yield_today": reading["solar_yield_today"],
         },
         "consumption": {
-            "power": reading.consumption_power,
+            "power": reading["consumption_power"],
         },
         "environment": {
-            "temperature": reading.temperature,
-            "humidity": reading.humidity,
+            "temperature": reading["temperature"],
+            "humidity": reading["humidity"],
         }
     }
 
 
+HISTORY_FIELDS = [
+    "battery_voltage",
+    "battery_current",
+    "battery_power",
+    "battery_state",
+    "solar_power",
+    "solar_voltage",
+    "solar_current",
+    "solar_yield_today",
+    "temperature",
+    "humidity",
+]
+
+
+def _resample_options(step: str, max_gap: Optional[str], policy: Optional[str]) -> tuple[int, int, dict]:
+    """Parse resampling query parameters; (step, max gap) in microseconds and per-field policies."""
+    try:
+        return (
+            resample.parse_duration(step),
+            resample.parse_duration(max_gap or resample.RESAMPLE_MAX_GAP),
+            resample.parse_policies(policy),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from None
+
+
+def _resampled(start: datetime, end: datetime, fields: list[str], options: tuple[int, int, dict]) -> dict:
+    """Readings in [start, end) resampled onto a uniform grid, as column lists."""
+    step, max_gap, policies = options
+    grid = resample.make_grid(archive.to_micros(start), archive.to_micros(end), step)
+    # Load a little before the range so the first grid points can interpolate
+    data = analytics.load_columns(start - timedelta(microseconds=max_gap), end, fields)
+    columns = resample.resample(data, grid, policies, max_gap, step)
+    return {
+        "timestamp": np.datetime_as_string(grid.astype("datetime64[us]"), unit="s").tolist(),
+        **{f: resample.to_list(columns[f]) for f in fields},
+    }
+
+
+def _archived_history(since: datetime, hot_start: datetime, hot_rows: int) -> tuple[int, list[dict]]:
+    """Downsampling step for the whole range and the archived readings in [since, hot_start)."""
+    archived_count = archive.count_rows(since, hot_start) if since < hot_start else 0
+    # Downsample for large ranges: keep ~1440 points (one per minute for 24h)
+    step = max(1, (hot_rows + archived_count) // 1440)
+    if not archived_count:
+        return step, []
+    return step, [
+        {**row, "timestamp": row["timestamp"].isoformat()}
+        for row in archive.iter_rows(since, hot_start, HISTORY_FIELDS, step)
+    ]
+
+
 @app.get("/api/history")
-async def get_history(hours: int = Query(24, ge=1, le=168), db: Session = Depends(get_db)):
-    """Get historical readings (max 168 hours / 1 week).
+async def get_history(
+    hours: int = Query(24, ge=1, le=24 * 366 * 10),
+    resample_step: Optional[str] = Query(None, alias="resample", description="Grid step, e.g. 1m, 5m, 1h"),
+    max_gap: Optional[str] = Query(None, description="Leave grid points null across longer gaps"),
+    policy: Optional[str] = Query(None, description="Per-field overrides, e.g. solar_power:mean"),
+    db: Session = Depends(get_db),
+):
+    """Get historical readings.
 
     For ranges over 24 hours, readings are downsampled to keep response
     size bounded (~1440 points max) and reduce memory usage.
     Uses column projections (lightweight tuples) instead of full ORM objects.
+    Ranges reaching past the oldest reading in the database are read from
+    the archive. With `resample`, readings are aligned to a uniform grid
+    instead (see resample.py).
     """
+    from sqlalchemy import func
+
     since = datetime.utcnow() - timedelta(hours=hours)
+    if resample_step:
+        options = _resample_options(resample_step, max_gap, policy)
+        try:
+            columns = await asyncio.to_thread(_resampled, since, datetime.utcnow(), HISTORY_FIELDS, options)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from None
+        names = ["timestamp", *HISTORY_FIELDS]
+        return {
+            "readings": [
+                dict(zip(names, values, strict=True))
+                for values in zip(*(columns[n] for n in names), strict=True)
+            ]
+        }
+
     readings = db.query(
         EnergyReading.timestamp,
-        EnergyReading.battery_voltage,
-        EnergyReading.battery_current,
-        EnergyReading.battery_power,
-        EnergyReading.battery_state,
-        EnergyReading.solar_power,
-        EnergyReading.solar_voltage,
-        EnergyReading.solar_current,
-        EnergyReading.solar_yield_today,
-        EnergyReading.temperature,
-        EnergyReading.humidity,
+        *(getattr(EnergyReading, field) for field in HISTORY_FIELDS),
     ).filter(
         EnergyReading.timestamp >= since
     ).order_by(EnergyReading.timestamp).all()
 
-    # Downsample for large ranges: keep ~1440 points (one per minute for 24h)
-    step = max(1, len(readings) // 1440)
+    hot_start = readings[0].timestamp if readings else db.query(func.min(EnergyReading.timestamp)).scalar()
+    if hot_start is None:
+        hot_start = datetime.utcnow()
+    # Decompressing archive blocks is CPU work: keep it off the event loop
+    step, archived = await asyncio.to_thread(_archived_history, since, hot_start, len(readings))
     sampled = readings[::step] if step > 1 else readings
 
     return {
-        "readings": [
+        "readings": archived + [
             {
                 "timestamp": r.timestamp.isoformat(),
                 "battery_voltage": r.battery_voltage,
@@ -331,6 +712,124 @@ async def get_history(hours: int = Query(24, ge=1, le=168), db: Session = Depend
     }
 
 
+def _naive_utc(ts: datetime) -> datetime:
+    """Readings are stored as naive UTC; convert aware datetimes to match."""
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _export_rows(start: datetime, end: datetime, fields: list[str]):
+    """Yield readings in [start, end) as CSV lines: archived days first, then the database."""
+    import csv
+    import io
+
+    from sqlalchemy import func
+
+    from database import SessionLocal
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(["timestamp", *fields])
+    yield flush()
+
+    db = SessionLocal()
+    try:
+        hot_start = db.query(func.min(EnergyReading.timestamp)).filter(
+            EnergyReading.timestamp >= start
+        ).scalar() or end
+    finally:
+        db.close()
+
+    for row in archive.iter_rows(start, min(end, hot_start), fields):
+        writer.writerow([row["timestamp"].isoformat(), *(row[f] for f in fields)])
+        if buffer.tell() > 65536:
+            yield flush()
+
+    # Keyset pagination keeps memory flat for long exports
+    columns = [EnergyReading.timestamp, *(getattr(EnergyReading, f) for f in fields)]
+    after = max(start, hot_start) - timedelta(microseconds=1)
+    while True:
+        db = SessionLocal()
+        try:
+            page = db.query(*columns).filter(
+                EnergyReading.timestamp > after,
+                EnergyReading.timestamp < end,
+            ).order_by(EnergyReading.timestamp).limit(5000).all()
+        finally:
+            db.close()
+        if not page:
+            break
+        for r in page:
+            writer.writerow([r[0].isoformat(), *r[1:]])
+        yield flush()
+        after = page[-1].timestamp
+    yield flush()
+
+
+def _export_resampled(start: datetime, end: datetime, fields: list[str], options: tuple[int, int, dict]):
+    """Yield resampled readings in [start, end) as CSV, one day of grid points at a time."""
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["timestamp", *fields])
+    day = start
+    while day < end:
+        next_day = min(day + timedelta(days=1), end)
+        columns = _resampled(day, next_day, fields, options)
+        writer.writerows(zip(*(columns[n] for n in ["timestamp", *fields]), strict=True))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        day = next_day
+
+
+@app.get("/api/export")
+async def export_readings(
+    start: datetime,
+    end: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated reading fields (default: all)"),
+    resample_step: Optional[str] = Query(None, alias="resample", description="Grid step, e.g. 1m, 5m, 1h"),
+    max_gap: Optional[str] = Query(None, description="Leave grid points null across longer gaps"),
+    policy: Optional[str] = Query(None, description="Per-field overrides, e.g. solar_power:mean"),
+):
+    """Export readings between `start` and `end` (UTC) as CSV, including archived days.
+
+    Raw readings by default; with `resample`, aligned to a uniform grid.
+    """
+    from fastapi.responses import StreamingResponse
+
+    end = end or datetime.utcnow()
+    if _naive_utc(end) <= _naive_utc(start):
+        raise HTTPException(status_code=422, detail="end must be after start")
+    selected = fields.split(",") if fields else list(READING_FIELDS)
+    unknown = [f for f in selected if f not in READING_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    if resample_step:
+        options = _resample_options(resample_step, max_gap, policy)
+        rows = _export_resampled(_naive_utc(start), _naive_utc(end), selected, options)
+    else:
+        rows = _export_rows(_naive_utc(start), _naive_utc(end), selected)
+
+    filename = f"readings-{start:%Y%m%d}-{end:%Y%m%d}.csv"
+    return StreamingResponse(
+        rows,
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/api/stats")
 async def get_stats(db: Session = Depends(get_db)):
     """Get summary statistics for today using SQL aggregation."""
@@ -361,6 +860,124 @@ async def get_stats(db: Session = Depends(get_db)):
     }
 
 
+_analytics_slots = asyncio.Semaphore(analytics.ANALYTICS_CONCURRENCY)
+
+
+@app.get("/api/query")
+async def query_readings(
+    fields: str = Query(..., description="Comma-separated numeric reading fields"),
+    group_by: str = Query("day", description="One or two of hour_of_day, day, week, month"),
+    agg: str = Query("mean", description="Comma-separated: mean, min, max, sum, count, p1..p99"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tz: str = "Europe/London",
+    hour_from: Optional[int] = Query(None, ge=0, le=23),
+    hour_to: Optional[int] = Query(None, ge=0, le=24),
+    resample_step: Optional[str] = Query(None, alias="resample", description="Resample first, e.g. 5m"),
+    max_gap: Optional[str] = Query(None, description="Leave grid points null across longer gaps"),
+    policy: Optional[str] = Query(None, description="Per-field overrides, e.g. solar_power:mean"),
+):
+    """Aggregate readings over any range, including archived days.
+
+    For example, average overnight consumption per month:
+    /api/query?fields=consumption_power&group_by=month&hour_from=22&hour_to=6&start=2026-01-01
+
+    Queries run in a worker thread, one at a time by default, so they never
+    hold up ingestion or other requests on the event loop.
+    """
+    end = _naive_utc(end) if end else datetime.utcnow()
+    query = analytics.Query(
+        fields=fields.split(","),
+        start=_naive_utc(start) if start else end - timedelta(days=30),
+        end=end,
+        group_by=group_by.split(","),
+        aggregations=agg.split(","),
+        timezone=tz,
+        hour_from=hour_from,
+        hour_to=hour_to,
+    )
+    if resample_step:
+        query.resample_step, query.max_gap, query.policies = _resample_options(resample_step, max_gap, policy)
+    try:
+        query.validate()
+    except analytics.QueryError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from None
+
+    started = time.perf_counter()
+    async with _analytics_slots:
+        try:
+            result = await asyncio.to_thread(analytics.run_query, query)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from None
+    return {
+        "start": query.start.isoformat(),
+        "end": query.end.isoformat(),
+        "group_by": query.group_by,
+        **result,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+@app.get("/api/battery/health")
+async def get_battery_health(days: int = Query(30, ge=1, le=366 * 10)):
+    """Daily battery usage: throughput, equivalent full cycles, DoD distribution and time below min SOC.
+
+    Past days are stored once computed, so a year is a table read. A day's
+    DoD histogram counts the cycles that closed that day; the totals also
+    count the swings still open at the end as half cycles.
+    """
+    last = battery_health.local_today()
+    first = last - timedelta(days=days - 1)
+    history = await asyncio.to_thread(
+        battery_health.history, first, last, BATTERY_CAPACITY_AH, BATTERY_MIN_SOC
+    )
+
+    def present(result: dict) -> dict:
+        result = dict(result)
+        result["hours_below_min_soc"] = round(result.pop("seconds_below_min_soc") / 3600, 2)
+        result.pop("residual", None)
+        return result
+
+    totals = {name: sum(day[name] for day in history.values()) for name in battery_health.SUM_FIELDS}
+    totals = {name: round(value, 3) for name, value in totals.items()}
+    totals["equivalent_cycles"] = round(sum(day["equivalent_cycles"] for day in history.values()), 3)
+    residual = list(history.values())[-1]["residual"] if history else []
+    totals["dod_histogram"] = [
+        sum(counts) for counts in zip(
+            battery_health.dod_histogram(*battery_health.half_cycles(residual)),
+            *(day["dod_histogram"] for day in history.values()),
+            strict=True,
+        )
+    ]
+    return {
+        "capacity_ah": BATTERY_CAPACITY_AH,
+        "min_soc": BATTERY_MIN_SOC,
+        "dod_bins": battery_health.DOD_BINS,
+        "totals": present(totals),
+        "days": [{"date": day.isoformat(), **present(result)} for day, result in history.items()],
+    }
+
+
+@app.get("/api/diagnostics")
+async def list_diagnostics():
+    """Every VRM diagnostic attribute stored so far."""
+    return {"attributes": await asyncio.to_thread(diagnostics.list_attributes)}
+
+
+@app.get("/api/diagnostics/{code}")
+async def get_diagnostic_series(
+    code: str,
+    instance: int = 0,
+    hours: int = Query(24, ge=1, le=24 * 7),
+):
+    """One diagnostic attribute's values over the last `hours` (within retention)."""
+    end = datetime.utcnow()
+    result = await asyncio.to_thread(diagnostics.series, code, instance, end - timedelta(hours=hours), end)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Unknown diagnostic attribute {code!r} (instance {instance})")
+    return result
+
+
 @app.post("/api/refresh")
 async def refresh_data():
     """Manually trigger a data refresh from VRM."""
@@ -373,37 +990,133 @@ async def refresh_data():
 
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint."""
+    """Liveness check: the process is up and serving requests."""
     return {
         "status": "healthy",
-        "vrm_connected": vrm_client is not None
+        "vrm_connected": vrm_client is not None,
+        "leader": elector.is_leader if elector else False,
+    }
+
+
+@app.get("/api/ready")
+async def readiness_check(response: Response):
+    """Readiness check: startup warm-up has finished."""
+    if not _ready:
+        response.status_code = 503
+        return {"status": "starting"}
+    return {
+        "status": "ready",
+        "has_data": _latest_reading is not None,
     }
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Operational metrics: VRM connection (retries, circuit breaker) and SQL timings.
+
+    Only statement counts and times; the statements themselves are under
+    /api/admin/sql.
+    """
+    return {
+        "vrm": vrm_client.http.metrics() if vrm_client else None,
+        "sql": sql_metrics(top=0),
+        "storage": writer.metrics(),
+        "memory": memory.status(),
+        "response_cache": response_cache.metrics(),
+    }
+
+
+@app.get("/api/admin/sql", dependencies=[Depends(require_admin)])
+async def get_sql_metrics(top: int = Query(5, ge=1, le=50)):
+    """The slowest SQL statements since startup, with their text."""
+    return sql_metrics(top)
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List captured request profiles, oldest first."""
+    return {"profiles": profiles.summary()}
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Get a captured profile: sampled stacks and the request's SQL statements."""
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@app.delete("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def clear_profiles():
+    return {"deleted": profiles.clear()}
+
+
+@app.get("/api/admin/memory", dependencies=[Depends(require_admin)])
+async def get_memory(hours: float = Query(24, gt=0)):
+    """Memory status, RSS/heap samples over the last `hours` and recent shed reports."""
+    since = time.time() - hours * 3600
+    return {
+        **memory.status(),
+        "samples": [s for s in memory.samples if s["at"] >= since],
+        "sheds": list(memory.sheds),
+    }
+
+
+@app.post("/api/admin/memory/shed", dependencies=[Depends(require_admin)])
+async def shed_memory():
+    """Clear all registered caches now and report what was freed."""
+    return memory.shed()
+
+
+@app.post("/api/admin/memory/tracemalloc", dependencies=[Depends(require_admin)])
+async def toggle_tracemalloc(enabled: bool = True, frames: int = Query(1, ge=1, le=25)):
+    """Start or stop tracemalloc. Tracing slows allocations, so stop it when done."""
+    if enabled:
+        memory.start_tracing(frames)
+    else:
+        memory.stop_tracing()
+    return {"tracing": enabled}
+
+
+@app.get("/api/admin/memory/allocations", dependencies=[Depends(require_admin)])
+async def get_allocations(
+    limit: int = Query(20, ge=1, le=200),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    compare: bool = False,
+):
+    """Top allocation sites (tracemalloc must be started); `compare` shows growth since the last call."""
+    import tracemalloc
+
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not running")
+    return {"allocations": await asyncio.to_thread(memory.top_allocations, limit, group_by, compare)}
+
+
+@app.get("/api/alerts")
+async def get_alerts():
+    """Get the state of every alert rule.
+
+    Rules are only evaluated on the leader; other workers serve the state
+    it stores every ALERT_STATE_INTERVAL seconds.
+    """
+    if not alert_engine:
+        return {"rules": []}
+    if elector and not elector.is_leader:
+        return {"rules": alert_engine.status(await asyncio.to_thread(alerts.load_states))}
+    return {"rules": alert_engine.status()}
+
+
 @app.get("/api/sun")
 async def get_sun_info():
     """Get sunrise, sunset, and daylight information."""
     from zoneinfo import ZoneInfo
 
-    from astral import LocationInfo
-    from astral.sun import sun
-
     try:
-        location = LocationInfo(
-            name=LOCATION_NAME,
-            region="",
-            timezone="Europe/London",
-            latitude=LOCATION_LAT,
-            longitude=LOCATION_LON,
-        )
-
         # Get sun times for today
         tz = ZoneInfo("Europe/London")
         now = datetime.now(tz)
-        s = sun(location.observer, date=now.date(), tzinfo=tz)
-
-        sunrise = s["sunrise"]
-        sunset = s["sunset"]
+        sunrise, sunset = _sun_times(now.date())
 
         # Calculate daylight remaining
         if now < sunrise:
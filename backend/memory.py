@@ -0,0 +1,163 @@
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "60"))  # Seconds
+MEMORY_HISTORY = int(os.getenv("MEMORY_HISTORY", "1440"))  # Samples kept (24h at the default interval)
+# Shed caches when RSS goes above this; the Fly VM has 256 MB. 0 disables.
+MEMORY_SOFT_LIMIT_MB = float(os.getenv("MEMORY_SOFT_LIMIT_MB", "200"))
+# While RSS stays over budget after a shed, wait this long before shedding again
+MEMORY_SHED_COOLDOWN = float(os.getenv("MEMORY_SHED_COOLDOWN", "900"))  # Seconds
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return round(value / 1024 / 1024, 2) if value is not None else None
+
+
+class MemoryMonitor:
+    """Tracks RSS and Python heap over time and sheds caches over a soft budget.
+
+    Caches register a clear function returning how many items it dropped;
+    when RSS exceeds `soft_limit_mb`, every cache is cleared, a full GC is
+    run and the result is kept as a shed report. Freed memory is rarely
+    returned to the OS, so after a shed the monitor only sheds again once
+    RSS has dropped back under the budget or `cooldown` seconds have passed.
+    """
+
+    def __init__(
+        self,
+        soft_limit_mb: float = MEMORY_SOFT_LIMIT_MB,
+        history: int = MEMORY_HISTORY,
+        cooldown: float = MEMORY_SHED_COOLDOWN,
+    ):
+        self.soft_limit_mb = soft_limit_mb
+        self.cooldown = cooldown
+        self._last_shed: Optional[float] = None  # monotonic; None once back under budget
+        self.samples: deque[dict] = deque(maxlen=history)
+        self.sheds: deque[dict] = deque(maxlen=20)
+        self._caches: dict[str, Callable[[], Optional[int]]] = {}
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def register_cache(self, name: str, clear: Callable[[], Optional[int]]):
+        self._caches[name] = clear
+
+    def sample(self) -> dict:
+        point = {
+            "at": time.time(),
+            "rss_mb": _mb(rss_bytes()),
+            # Live objects allocated through Python's small-object allocator
+            "heap_blocks": sys.getallocatedblocks(),
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            point["traced_mb"], point["traced_peak_mb"] = _mb(current), _mb(peak)
+        self.samples.append(point)
+        return point
+
+    def over_budget(self, point: dict) -> bool:
+        return bool(self.soft_limit_mb) and point["rss_mb"] is not None and point["rss_mb"] > self.soft_limit_mb
+
+    def shed(self, reason: str = "manual") -> dict:
+        """Clear every registered cache and collect garbage; returns what was freed."""
+        before = rss_bytes()
+        freed = {}
+        for name, clear in self._caches.items():
+            try:
+                freed[name] = clear() or 0
+            except Exception as e:
+                logger.error(f"Failed to shed cache {name}: {e}")
+        collected = gc.collect()
+        after = rss_bytes()
+        report = {
+            "at": time.time(),
+            "reason": reason,
+            "rss_before_mb": _mb(before),
+            "rss_after_mb": _mb(after),
+            "released_mb": _mb(before - after) if before is not None and after is not None else None,
+            "freed_items": freed,
+            "gc_collected": collected,
+        }
+        self.sheds.append(report)
+        logger.warning(
+            f"Memory shed ({reason}): RSS {report['rss_before_mb']} -> {report['rss_after_mb']} MB, "
+            f"freed {freed}, {collected} objects collected"
+        )
+        return report
+
+    def check(self) -> Optional[dict]:
+        """Take a sample and shed caches if over budget; returns the shed report if any."""
+        point = self.sample()
+        if not self.over_budget(point):
+            self._last_shed = None
+            return None
+        now = time.monotonic()
+        if self._last_shed is not None and now - self._last_shed < self.cooldown:
+            return None
+        self._last_shed = now
+        return self.shed(reason=f"rss {point['rss_mb']} MB over {self.soft_limit_mb} MB budget")
+
+    def status(self) -> dict:
+        latest = self.samples[-1] if self.samples else self.sample()
+        return {
+            "rss_mb": latest["rss_mb"],
+            "heap_blocks": latest["heap_blocks"],
+            "soft_limit_mb": self.soft_limit_mb or None,
+            "peak_rss_mb": max((s["rss_mb"] for s in self.samples if s["rss_mb"] is not None), default=None),
+            "caches": list(self._caches),
+            "tracemalloc": tracemalloc.is_tracing(),
+            "last_shed": self.sheds[-1] if self.sheds else None,
+        }
+
+    def start_tracing(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._snapshot = None
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self._snapshot = None
+
+    def top_allocations(self, limit: int = 20, group_by: str = "lineno", compare: bool = False) -> list[dict]:
+        """Top allocation sites from a tracemalloc snapshot.
+
+        With `compare`, sizes are the growth since the previous snapshot.
+        Requires tracing to have been started.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        previous, self._snapshot = self._snapshot, snapshot
+        if compare and previous is not None:
+            stats = snapshot.compare_to(previous, group_by)
+            return [
+                {"location": self._location(s.traceback), "size_kb": round(s.size / 1024, 1),
+                 "size_diff_kb": round(s.size_diff / 1024, 1), "count": s.count, "count_diff": s.count_diff}
+                for s in stats[:limit]
+            ]
+        return [
+            {"location": self._location(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+            for s in snapshot.statistics(group_by)[:limit]
+        ]
+
+    @staticmethod
+    def _location(traceback: tracemalloc.Traceback) -> str:
+        return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in traceback)
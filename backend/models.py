@@ -1,6 +1,16 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -34,3 +44,86 @@ class EnergyReading(Base):
 
     # Battery state
     battery_state = Column(String, nullable=True)  # charging/idle/discharging
+
+
+class BackfillRange(Base):
+    """A gap in energy_readings that backfill has already filled from VRM stats."""
+
+    __tablename__ = "backfill_ranges"
+
+    id = Column(Integer, primary_key=True)
+    start = Column(DateTime, nullable=False, index=True)
+    end = Column(DateTime, nullable=False)
+    rows = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Lease(Base):
+    """A named lease held by one worker process (see leader.py)."""
+
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class AlertState(Base):
+    """The leader's current state of one alert rule, for the other workers to serve."""
+
+    __tablename__ = "alert_states"
+
+    rule = Column(String, primary_key=True)
+    active = Column(Boolean, nullable=False, default=False)
+    since = Column(DateTime, nullable=True)
+    value = Column(Float, nullable=True)
+    message = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DiagnosticAttribute(Base):
+    """Dictionary of VRM diagnostic codes: one small integer id per (code, instance)."""
+
+    __tablename__ = "diagnostic_attributes"
+    __table_args__ = (UniqueConstraint("code", "instance"),)
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String, nullable=False)
+    instance = Column(Integer, nullable=False, default=0)
+    device = Column(String, nullable=True)
+    description = Column(String, nullable=True)
+
+
+class DiagnosticValue(Base):
+    """One diagnostic attribute's value for one reading.
+
+    Clustered by (attribute_id, reading_id) (a WITHOUT ROWID table in
+    SQLite), so one attribute's time series is a single range scan; the
+    reading_id index serves retention deletes.
+    """
+
+    __tablename__ = "diagnostic_values"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    attribute_id = Column(Integer, ForeignKey("diagnostic_attributes.id"), primary_key=True)
+    reading_id = Column(Integer, primary_key=True, index=True)
+    value = Column(Float, nullable=True)
+    text = Column(String, nullable=True)  # Non-numeric values
+
+
+class BatteryHealthDay(Base):
+    """Battery usage for one local day (see battery_health.py)."""
+
+    __tablename__ = "battery_health_days"
+
+    day = Column(Date, primary_key=True)
+    samples = Column(Integer, nullable=False, default=0)
+    charge_ah = Column(Float, nullable=False, default=0.0)
+    discharge_ah = Column(Float, nullable=False, default=0.0)
+    charge_wh = Column(Float, nullable=False, default=0.0)
+    discharge_wh = Column(Float, nullable=False, default=0.0)
+    equivalent_cycles = Column(Float, nullable=False, default=0.0)
+    seconds_below_min_soc = Column(Float, nullable=False, default=0.0)
+    dod_histogram = Column(String, nullable=False, default="[]")  # JSON cycle counts per DOD_BINS bin
+    rainflow_residual = Column(String, nullable=False, default="[]")  # JSON SOC reversals still open at day end
+    updated_at = Column(DateTime, default=datetime.utcnow)
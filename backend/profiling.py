@@ -0,0 +1,220 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Optional
+
+from sqlalchemy import event
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))  # Seconds between stack samples
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "20"))
+
+# Aggregate statement stats are kept for at most this many distinct statements
+MAX_TRACKED_STATEMENTS = 200
+
+
+class RequestStats:
+    """SQL statements executed while handling one request.
+
+    Rows returned by selects are only counted when `count_rows` is set
+    (profiled requests), as counting means buffering each ORM result.
+    """
+
+    def __init__(self, count_rows: bool = False):
+        self.count_rows = count_rows
+        self.statements: list[dict] = []
+
+    def add(self, statement: str, duration: float, rows: Optional[int]):
+        self.statements.append({
+            "sql": statement[:300],
+            "ms": round(duration * 1000, 3),
+            "rows": rows,
+        })
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def total_ms(self) -> float:
+        return round(sum(s["ms"] for s in self.statements), 3)
+
+    @property
+    def rows(self) -> int:
+        return sum(s["rows"] or 0 for s in self.statements)
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None
+)
+_statement_totals: dict[str, list] = {}  # sql -> [count, total_ms, max_ms]
+_statement_totals_lock = threading.Lock()  # Statements run in threadpool workers too
+
+
+def start_request(count_rows: bool = False) -> tuple[RequestStats, contextvars.Token]:
+    stats = RequestStats(count_rows)
+    return stats, _request_stats.set(stats)
+
+
+def end_request(token: contextvars.Token):
+    _request_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    # sqlite3 only reports a row count for writes; reads are counted in _count_rows
+    rows = cursor.rowcount if cursor.rowcount >= 0 else None
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(statement, duration, rows)
+
+    ms = duration * 1000
+    with _statement_totals_lock:
+        totals = _statement_totals.get(statement)
+        if totals is None:
+            if len(_statement_totals) >= MAX_TRACKED_STATEMENTS:
+                return
+            totals = _statement_totals[statement] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += ms
+        totals[2] = max(totals[2], ms)
+
+
+def _count_rows(orm_execute_state):
+    """Count rows returned by ORM selects made during a profiled request.
+
+    The result is buffered and copied, so this only runs when asked for;
+    the count is attached to the statement just timed.
+    """
+    stats = _request_stats.get()
+    if stats is None or not stats.count_rows or not orm_execute_state.is_select:
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    if stats.statements:
+        stats.statements[-1]["rows"] = len(frozen.data)
+    return frozen()
+
+
+def install_sql_hooks(engine, session_factory):
+    """Time every statement on `engine` and count ORM rows per request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(session_factory, "do_orm_execute", _count_rows)
+
+
+def reset_sql_metrics() -> int:
+    """Forget the aggregate statement stats; returns how many statements were tracked."""
+    with _statement_totals_lock:
+        count = len(_statement_totals)
+        _statement_totals.clear()
+    return count
+
+
+def sql_metrics(top: int = 5) -> dict:
+    """Process-wide statement counts and, if `top`, the slowest statements (with their SQL)."""
+    with _statement_totals_lock:
+        totals = {sql: list(t) for sql, t in _statement_totals.items()}
+    summary = {
+        "statements": sum(t[0] for t in totals.values()),
+        "total_ms": round(sum(t[1] for t in totals.values()), 1),
+    }
+    if not top:
+        return summary
+    slowest = sorted(totals.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return {
+        **summary,
+        "slowest": [
+            {"sql": sql[:300], "count": t[0], "avg_ms": round(t[1] / t[0], 3), "max_ms": round(t[2], 3)}
+            for sql, t in slowest
+        ],
+    }
+
+
+class StackSampler:
+    """Sampling profiler for one thread.
+
+    A background thread records the target thread's Python stack every
+    `interval` seconds. Only runs while a profile is requested; concurrent
+    requests on the same event loop show up in the samples too.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        own: Counter[str] = Counter()
+        cumulative: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = [f.rsplit(":", 1)[0] for f in stack.split(";")]
+            own[frames[-1]] += count
+            for name in set(frames):
+                cumulative[name] += count
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "top_self": own.most_common(20),
+            "top_cumulative": cumulative.most_common(20),
+            # Collapsed stacks, usable with flamegraph.pl / speedscope
+            "stacks": dict(self.stacks.most_common(200)),
+        }
+
+
+class ProfileStore:
+    """The last few captured profiles, kept in memory."""
+
+    def __init__(self, size: int = PROFILE_HISTORY):
+        self._profiles: deque[dict] = deque(maxlen=size)
+
+    def add(self, method: str, path: str, duration_ms: float, profile: dict, stats: RequestStats) -> str:
+        profile_id = uuid.uuid4().hex[:12]
+        self._profiles.append({
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "duration_ms": round(duration_ms, 2),
+            "captured_at": time.time(),
+            "profile": profile,
+            "sql": stats.statements,
+        })
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        return next((p for p in self._profiles if p["id"] == profile_id), None)
+
+    def summary(self) -> list[dict]:
+        return [{k: p[k] for k in ("id", "method", "path", "duration_ms", "captured_at")} for p in self._profiles]
+
+    def clear(self) -> int:
+        count = len(self._profiles)
+        self._profiles.clear()
+        return count
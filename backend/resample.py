@@ -0,0 +1,131 @@
+"""Align readings to a uniform time grid.
+
+Each field has a policy:
+
+- ``linear``: interpolate between the readings either side of a grid point
+- ``ffill``: carry the last reading forward (used for battery_state)
+- ``mean``: average the readings inside each grid interval
+
+A grid point is null when the readings around it are more than `max_gap`
+apart (or, for ffill, when the last reading is older than `max_gap`), so
+outages show up as gaps rather than as invented data. Everything is done
+with whole-array numpy operations.
+"""
+
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from vrm_client import READING_FIELDS
+
+POLICIES = ("linear", "ffill", "mean")
+DEFAULT_POLICIES = {field: "linear" for field in READING_FIELDS} | {"battery_state": "ffill"}
+
+RESAMPLE_MAX_GAP = os.getenv("RESAMPLE_MAX_GAP", "10m")  # Longer gaps are left null
+RESAMPLE_MAX_POINTS = int(os.getenv("RESAMPLE_MAX_POINTS", "200000"))
+
+_DURATION = re.compile(r"^(\d+)(s|m|h|d)$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> int:
+    """'30s', '5m', '1h' or '1d' as microseconds."""
+    match = _DURATION.match(value)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid duration {value!r}; use e.g. 30s, 5m, 1h or 1d")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)] * 1_000_000
+
+
+def parse_policies(spec: Optional[str]) -> dict[str, str]:
+    """Overrides like 'solar_power:mean,battery_soc:ffill' merged over the defaults."""
+    policies = dict(DEFAULT_POLICIES)
+    for item in filter(None, (spec or "").split(",")):
+        field, _, policy = item.partition(":")
+        if field not in policies or policy not in POLICIES:
+            raise ValueError(f"Invalid policy {item!r}; use field:{'|'.join(POLICIES)}")
+        if field == "battery_state" and policy != "ffill":
+            raise ValueError("battery_state can only be forward-filled")
+        policies[field] = policy
+    return policies
+
+
+def make_grid(start_us: int, end_us: int, step_us: int) -> np.ndarray:
+    """Grid points in [start, end), aligned to multiples of the step."""
+    first = -(-start_us // step_us) * step_us
+    count = max(0, -(-(end_us - first) // step_us))
+    if count > RESAMPLE_MAX_POINTS:
+        raise ValueError(f"Resampling would produce {count} points (max {RESAMPLE_MAX_POINTS})")
+    return first + np.arange(count, dtype=np.int64) * step_us
+
+
+def _linear(grid, ts, values, max_gap):
+    result = np.interp(grid, ts, values)
+    after = np.searchsorted(ts, grid, side="left")
+    before = np.searchsorted(ts, grid, side="right") - 1
+    exact = after <= before
+    inside = (before >= 0) & (after < len(ts))
+    span = ts[np.minimum(after, len(ts) - 1)] - ts[np.maximum(before, 0)]
+    result[~(exact | (inside & (span <= max_gap)))] = np.nan
+    return result
+
+
+def _last_index(grid, ts, max_gap):
+    """Index of the last reading at or before each grid point, -1 if none within max_gap."""
+    idx = np.searchsorted(ts, grid, side="right") - 1
+    stale = (idx < 0) | (grid - ts[np.maximum(idx, 0)] > max_gap)
+    idx[stale] = -1
+    return idx
+
+
+def _mean(grid, ts, values, step):
+    bucket = np.searchsorted(grid, ts, side="right") - 1
+    keep = (bucket >= 0) & (ts < grid[-1] + step)
+    sums = np.bincount(bucket[keep], weights=values[keep], minlength=len(grid))
+    counts = np.bincount(bucket[keep], minlength=len(grid))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = sums / counts
+    return result
+
+
+def resample(data: dict[str, np.ndarray], grid: np.ndarray, policies: dict[str, str],
+             max_gap_us: int, step_us: int) -> dict[str, np.ndarray]:
+    """Resample column arrays (as returned by analytics.load_columns) onto `grid`.
+
+    `step_us` is the grid step (the bucket `mean` averages over); it can't
+    be taken from the grid, which may hold a single point. Numeric fields
+    come back as float64 with NaN for null; battery_state as an object
+    array with None.
+    """
+    ts = data["timestamp"]
+    result = {"timestamp": grid}
+    for name, values in data.items():
+        if name == "timestamp":
+            continue
+        policy = policies.get(name, "linear")
+        valid = np.not_equal(values, None) if values.dtype == object else ~np.isnan(values)
+        field_ts, field_values = ts[valid], values[valid]
+
+        if not len(grid) or not len(field_ts):
+            result[name] = np.full(len(grid), None if values.dtype == object else np.nan,
+                                   dtype=values.dtype)
+        elif policy == "ffill" or values.dtype == object:
+            idx = _last_index(grid, field_ts, max_gap_us)
+            filled = field_values[np.maximum(idx, 0)].copy()
+            filled[idx < 0] = None if values.dtype == object else np.nan
+            result[name] = filled
+        elif policy == "mean":
+            result[name] = _mean(grid, field_ts, field_values, step_us)
+        else:
+            result[name] = _linear(grid, field_ts, field_values, max_gap_us)
+    return result
+
+
+def to_list(column: np.ndarray) -> list:
+    """A resampled column as JSON-friendly Python values (NaN -> None)."""
+    if column.dtype == object:
+        return column.tolist()
+    values = np.round(column, 4).astype(object)
+    values[np.isnan(column)] = None
+    return values.tolist()
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from typing import Callable, Optional
+
+from vrm_client import READING_FIELDS, VRMClient, estimate_soc_from_voltage
+
+logger = logging.getLogger(__name__)
+
+INGEST_SOURCE = os.getenv("INGEST_SOURCE", "vrm")  # vrm or mqtt
+VRM_POLL_INTERVAL = float(os.getenv("VRM_POLL_INTERVAL", "60"))
+
+# Venus OS MQTT broker on the GX device (Settings > Services > MQTT)
+MQTT_HOST = os.getenv("MQTT_HOST", "")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USERNAME = os.getenv("MQTT_USERNAME") or None
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD") or None
+MQTT_PORTAL_ID = os.getenv("MQTT_PORTAL_ID", "")  # Discovered from the broker if empty
+MQTT_READING_INTERVAL = float(os.getenv("MQTT_READING_INTERVAL", "10"))
+
+# Venus OS only keeps publishing N/ topics while it receives keepalives
+MQTT_KEEPALIVE_INTERVAL = 30
+
+# (service, path) -> reading field. The device instance between service and
+# path is ignored, so e.g. any solarcharger feeds the solar fields.
+TOPIC_MAPPING = {
+    ("system", "Dc/Battery/Voltage"): "battery_voltage",
+    ("system", "Dc/Battery/Current"): "battery_current",
+    ("system", "Dc/Battery/Power"): "battery_power",
+    ("system", "Dc/Battery/Soc"): "battery_soc",
+    ("system", "Dc/Battery/Temperature"): "battery_temperature",
+    ("system", "Dc/Battery/State"): "battery_state",
+    ("system", "Dc/Pv/Power"): "solar_power",
+    ("system", "Dc/System/Power"): "consumption_power",
+    ("solarcharger", "Pv/V"): "solar_voltage",
+    ("solarcharger", "Dc/0/Current"): "solar_current",
+    ("solarcharger", "History/Day/0/Yield"): "solar_yield_today",
+    ("temperature", "Temperature"): "temperature",
+    ("temperature", "Humidity"): "humidity",
+}
+
+# /Dc/Battery/State on com.victronenergy.system
+BATTERY_STATES = {0: "idle", 1: "charging", 2: "discharging"}
+
+
+class IngestionSource(ABC):
+    """A source of parsed readings.
+
+    `run` produces readings in the same shape as
+    `VRMClient.parse_diagnostic_data` and hands each to `store` until it is
+    cancelled. Sources recover from their own errors; cancelling the task is
+    the only way to stop one.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def run(self, store: Callable[[dict], None]):
+        """Hand readings to `store` until cancelled."""
+
+
+class VRMPollingSource(IngestionSource):
+    """Polls VRM cloud diagnostics at a fixed interval."""
+
+    name = "vrm"
+
+    def __init__(self, client: VRMClient, interval: float = VRM_POLL_INTERVAL):
+        self.client = client
+        self.interval = interval
+
+    async def read(self) -> Optional[dict]:
+        diagnostics = await self.client.get_diagnostic_data()
+        if not diagnostics:
+            logger.warning("No diagnostic data received from VRM")
+            return None
+        parsed = self.client.parse_diagnostic_data(diagnostics)
+        # Every code, for troubleshooting (see diagnostics.py)
+        parsed["attributes"] = self.client.parse_attributes(diagnostics)
+        return parsed
+
+    async def run(self, store):
+        while True:
+            try:
+                parsed = await self.read()
+                if parsed:
+                    store(parsed)
+            except Exception as e:
+                logger.error(f"VRM poll error: {e}")
+            await asyncio.sleep(self.interval)
+
+
+class VenusMQTTSource(IngestionSource):
+    """Subscribes to a GX device's local MQTT broker (Venus OS).
+
+    Venus OS publishes every D-Bus value change under
+    `N/<portal id>/<service>/<instance>/<path>` as `{"value": ...}`, often
+    several times a second. Updates are folded into the latest known value
+    for each field and a reading is emitted every `interval` seconds while
+    connected.
+    """
+
+    name = "mqtt"
+
+    def __init__(
+        self,
+        host: str = MQTT_HOST,
+        port: int = MQTT_PORT,
+        portal_id: str = MQTT_PORTAL_ID,
+        interval: float = MQTT_READING_INTERVAL,
+        username: Optional[str] = MQTT_USERNAME,
+        password: Optional[str] = MQTT_PASSWORD,
+        reconnect_delay: float = 5.0,
+    ):
+        if not host:
+            raise ValueError("MQTT_HOST environment variable is required for MQTT ingestion")
+        self.host = host
+        self.port = port
+        self.portal_id = portal_id
+        self.interval = interval
+        self.username = username
+        self.password = password
+        self.reconnect_delay = reconnect_delay
+        self._latest: dict = dict.fromkeys(READING_FIELDS)
+        self._received = 0
+
+    def handle_message(self, topic: str, payload: bytes):
+        """Fold one N/ topic update into the latest values."""
+        parts = topic.split("/")
+        if len(parts) < 5 or parts[0] != "N":
+            return
+        field = TOPIC_MAPPING.get((parts[2], "/".join(parts[4:])))
+        if field is None:
+            return
+
+        value = None
+        if payload:
+            try:
+                value = json.loads(payload).get("value")
+            except (ValueError, AttributeError):
+                return
+        if value is not None:
+            if field == "battery_state":
+                value = BATTERY_STATES.get(value, str(value))
+            else:
+                try:
+                    value = float(value)
+                except (ValueError, TypeError):
+                    return
+        self._latest[field] = value
+        self._received += 1
+
+    def snapshot(self) -> Optional[dict]:
+        """Current coalesced reading, or None if nothing has been received."""
+        if not self._received:
+            return None
+        parsed = dict(self._latest)
+        if parsed["battery_soc"] is None and parsed["battery_voltage"] is not None:
+            parsed["battery_soc"] = estimate_soc_from_voltage(parsed["battery_voltage"])
+        return parsed
+
+    async def _discover_portal_id(self, client) -> str:
+        await client.subscribe("N/+/system/0/Serial")
+        async for message in client.messages:
+            portal_id = message.topic.value.split("/")[1]
+            await client.unsubscribe("N/+/system/0/Serial")
+            logger.info(f"Discovered Venus OS portal ID {portal_id}")
+            return portal_id
+
+    async def _keepalive(self, client):
+        while True:
+            await client.publish(f"R/{self.portal_id}/keepalive", b"")
+            await asyncio.sleep(MQTT_KEEPALIVE_INTERVAL)
+
+    async def _emit(self, store):
+        while True:
+            await asyncio.sleep(self.interval)
+            parsed = self.snapshot()
+            if parsed:
+                try:
+                    store(parsed)
+                except Exception as e:
+                    logger.error(f"Error storing MQTT reading: {e}")
+
+    async def _session(self, client, store):
+        if not self.portal_id:
+            self.portal_id = await self._discover_portal_id(client)
+        await client.subscribe(f"N/{self.portal_id}/#")
+        logger.info(f"Subscribed to Venus OS MQTT on {self.host}:{self.port}")
+
+        tasks = [
+            asyncio.create_task(self._keepalive(client)),
+            asyncio.create_task(self._emit(store)),
+        ]
+        try:
+            async for message in client.messages:
+                self.handle_message(message.topic.value, message.payload)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                with suppress(asyncio.CancelledError):
+                    await task
+
+    async def run(self, store):
+        # Deferred so the VRM-only deployment doesn't pay for the import at startup
+        import aiomqtt
+
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    self.host, self.port, username=self.username, password=self.password
+                ) as client:
+                    await self._session(client, store)
+            except aiomqtt.MqttError as e:
+                logger.error(f"MQTT connection error: {e}")
+            # Don't write stale values while disconnected
+            self._latest = dict.fromkeys(READING_FIELDS)
+            self._received = 0
+            await asyncio.sleep(self.reconnect_delay)
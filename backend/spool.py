@@ -0,0 +1,406 @@
+"""Durable local spool for readings the database couldn't take in time.
+
+Readings go to a ReadingWriter, which stores them in the database off the
+event loop. If a write fails or takes longer than STORE_TIMEOUT, the
+readings are appended to a spool file instead, and the writer keeps
+spooling until a replay has moved them into the database. The poller
+only ever puts readings on a queue, so it never waits for storage.
+
+File layout (SPOOL_PATH):
+
+    b"VCS1" | header length (uint16 LE) | JSON header (field names) | records
+
+Each record is ``body length (uint16) | crc32 of body (uint32) | body``.
+The body is the timestamp (int64 microseconds), a bitmask of non-null
+fields (uint32), then a float64 per non-null numeric field and a
+length-prefixed UTF-8 string for battery_state, optionally followed by
+the reading's diagnostic attributes (count, then code, instance and
+float64 or string value for each). Appends are fsynced. A
+record torn by a crash mid-append is cut off before the next append, and
+records failing their checksum are skipped (and counted) on replay.
+
+Replay renames the spool aside first, so new readings can be spooled
+while the old ones are inserted in bulk. Timestamps already in the
+database are skipped (a timed-out write may have committed after all, or a
+replay may have been interrupted), so replaying twice is harmless.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager, suppress
+from typing import Callable, Optional
+
+from sqlalchemy import insert, select
+
+import archive
+from database import engine
+from diagnostics import store_attributes
+from models import EnergyReading
+from vrm_client import READING_FIELDS, Attribute
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PATH = os.getenv("SPOOL_PATH", "data/spool.bin")
+STORE_TIMEOUT = float(os.getenv("STORE_TIMEOUT", "5"))  # Seconds before a write counts as stalled
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "30"))  # Seconds
+SPOOL_REPLAY_BATCH = 5000  # Readings per insert transaction
+
+MAGIC = b"VCS1"
+STRING_FIELDS = {"battery_state"}
+_RECORD = struct.Struct("<HI")
+_BODY = struct.Struct("<qI")
+_FLOAT = struct.Struct("<d")
+_COUNT = struct.Struct("<H")
+_ATTRIBUTE = struct.Struct("<i?")  # Instance, value is text
+
+
+def insert_readings(readings: list[dict]) -> int:
+    """Insert readings (and their diagnostic attributes) in one transaction.
+
+    Timestamps already stored are skipped. Returns the number of readings
+    inserted.
+    """
+    if not readings:
+        return 0
+    timestamps = [r["timestamp"] for r in readings]
+    with engine.begin() as conn:
+        existing = set(conn.execute(
+            select(EnergyReading.timestamp).where(EnergyReading.timestamp.between(min(timestamps), max(timestamps)))
+        ).scalars())
+        new = [r for r in readings if r["timestamp"] not in existing]
+        if new:
+            ids = conn.execute(
+                insert(EnergyReading).returning(EnergyReading.id, sort_by_parameter_order=True),
+                [{k: v for k, v in r.items() if k != "attributes"} for r in new],
+            ).scalars().all()
+            attributes = [(id_, r["attributes"]) for id_, r in zip(ids, new, strict=True) if r.get("attributes")]
+            if attributes:
+                store_attributes(conn, attributes)
+    return len(new)
+
+
+def _pack_string(value: str) -> bytes:
+    raw = value.encode()[:255]
+    return bytes([len(raw)]) + raw
+
+
+def _unpack_string(body: bytes, offset: int) -> tuple[str, int]:
+    length = body[offset]
+    return body[offset + 1:offset + 1 + length].decode(errors="replace"), offset + 1 + length
+
+
+def encode_record(reading: dict, fields: list[str] = READING_FIELDS) -> bytes:
+    mask, parts = 0, []
+    for i, name in enumerate(fields):
+        value = reading.get(name)
+        if value is None:
+            continue
+        mask |= 1 << i
+        parts.append(_pack_string(str(value)) if name in STRING_FIELDS else _FLOAT.pack(value))
+    attributes = reading.get("attributes") or []
+    if attributes:
+        parts.append(_COUNT.pack(len(attributes)))
+        for a in attributes:
+            is_text = isinstance(a.value, str)
+            parts.append(_pack_string(a.code) + _ATTRIBUTE.pack(a.instance, is_text))
+            parts.append(_pack_string(a.value) if is_text else _FLOAT.pack(a.value))
+    body = _BODY.pack(archive.to_micros(reading["timestamp"]), mask) + b"".join(parts)
+    return _RECORD.pack(len(body), zlib.crc32(body)) + body
+
+
+def _decode_body(body: bytes, fields: list[str]) -> dict:
+    micros, mask = _BODY.unpack_from(body)
+    offset = _BODY.size
+    reading = {"timestamp": archive.from_micros(micros)}
+    for i, name in enumerate(fields):
+        if not mask >> i & 1:
+            reading[name] = None
+        elif name in STRING_FIELDS:
+            reading[name], offset = _unpack_string(body, offset)
+        else:
+            (reading[name],) = _FLOAT.unpack_from(body, offset)
+            offset += _FLOAT.size
+    if offset < len(body):
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+        attributes = []
+        for _ in range(count):
+            code, offset = _unpack_string(body, offset)
+            instance, is_text = _ATTRIBUTE.unpack_from(body, offset)
+            offset += _ATTRIBUTE.size
+            if is_text:
+                value, offset = _unpack_string(body, offset)
+            else:
+                (value,) = _FLOAT.unpack_from(body, offset)
+                offset += _FLOAT.size
+            attributes.append(Attribute(code, instance, value))
+        reading["attributes"] = attributes
+    return reading
+
+
+def _header(fields: list[str]) -> bytes:
+    header = json.dumps({"fields": fields}).encode()
+    return MAGIC + struct.pack("<H", len(header)) + header
+
+
+def scan(data: bytes) -> tuple[list[dict], int, int]:
+    """Decode a spool file's contents.
+
+    Returns the readings, the number of records skipped for a bad checksum,
+    and the offset just past the last complete record (less than
+    ``len(data)`` when the file ends in a torn record or header).
+    """
+    if len(data) < 6:
+        return [], 0, 0
+    if data[:4] != MAGIC:
+        raise ValueError("Not a spool file")
+    (header_len,) = struct.unpack_from("<H", data, 4)
+    offset = 6 + header_len
+    if len(data) < offset:
+        return [], 0, 0
+    fields = json.loads(data[6:offset])["fields"]
+
+    readings, corrupt = [], 0
+    while offset + _RECORD.size <= len(data):
+        length, crc = _RECORD.unpack_from(data, offset)
+        end = offset + _RECORD.size + length
+        if end > len(data):
+            break
+        body = data[offset + _RECORD.size:end]
+        if zlib.crc32(body) == crc and length >= _BODY.size:
+            try:
+                readings.append(_decode_body(body, fields))
+            except (struct.error, IndexError):
+                corrupt += 1
+        else:
+            corrupt += 1
+        offset = end
+    return readings, corrupt, offset
+
+
+class Spool:
+    """Append-only spool file plus the renamed-aside file being replayed.
+
+    Appends, repair and the replay rename take an exclusive lock on a
+    sidecar lock file, so several worker processes can share one spool.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or SPOOL_PATH
+        self.replay_path = f"{self.path}.replay"
+        self._repaired = False
+        self.appended = 0
+        self.replayed = 0
+        self.corrupt = 0
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _scan(self, path: str, data: bytes) -> Optional[tuple[list[dict], int, int]]:
+        """scan(), or None after moving an unreadable file (bad header) aside."""
+        try:
+            return scan(data)
+        except (ValueError, KeyError) as e:
+            corrupt_path = f"{path}.{time.time_ns()}.corrupt"
+            logger.error(f"Unreadable spool file {path} ({e}); moved to {corrupt_path}")
+            os.replace(path, corrupt_path)
+            return None
+
+    def _repair(self):
+        """Cut off a torn record (or header) left by a crash mid-append."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        scanned = self._scan(self.path, data)
+        if scanned is None:
+            return
+        _, _, end = scanned
+        if end < len(data):
+            logger.warning(f"Truncating {len(data) - end} bytes of torn data at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+    def append(self, readings: list[dict]):
+        records = b"".join(encode_record(r) for r in readings)
+        with self._locked():
+            if not self._repaired:
+                self._repair()
+                self._repaired = True
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(_header(READING_FIELDS))
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
+        self.appended += len(readings)
+
+    def pending_bytes(self) -> int:
+        size = 0
+        for path in (self.path, self.replay_path):
+            with suppress(FileNotFoundError):
+                size += os.path.getsize(path)
+        return size
+
+    def replay(self, insert_batch: Callable[[list[dict]], int] = insert_readings,
+               batch: int = SPOOL_REPLAY_BATCH) -> int:
+        """Move spooled readings into the database; returns the number inserted.
+
+        If `insert_batch` raises, the readings stay spooled and the next
+        replay starts over (already inserted ones are then skipped).
+        """
+        with self._locked():
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path):
+                    return 0
+                os.replace(self.path, self.replay_path)
+
+        with open(self.replay_path, "rb") as f:
+            data = f.read()
+        scanned = self._scan(self.replay_path, data)
+        if scanned is None:
+            return 0
+        readings, corrupt, end = scanned
+        if corrupt or end < len(data):
+            logger.warning(f"Skipped {corrupt} corrupt records and {len(data) - end} torn bytes in {self.replay_path}")
+
+        inserted = 0
+        for i in range(0, len(readings), batch):
+            inserted += insert_batch(readings[i:i + batch])
+        os.remove(self.replay_path)
+        self.replayed += inserted
+        self.corrupt += corrupt
+        return inserted
+
+
+class ReadingWriter:
+    """Stores readings without ever making the caller wait for storage.
+
+    While `run` is active, `submit` only queues the reading. The run loop
+    writes queued readings in bulk with a STORE_TIMEOUT; on failure or
+    timeout it switches to the spool until a replay has caught up. Without
+    a running loop (scripts, tests) `submit` writes directly, still falling
+    back to the spool.
+    """
+
+    def __init__(self, spool: Optional[Spool] = None, timeout: float = STORE_TIMEOUT,
+                 replay_interval: float = SPOOL_REPLAY_INTERVAL):
+        self.spool = spool or Spool()
+        self.timeout = timeout
+        self.replay_interval = replay_interval
+        self.degraded = False
+        self.stored = 0
+        self.last_error: Optional[str] = None
+        self._queue: Optional[asyncio.Queue] = None
+        # Readings taken off the queue but not yet safely stored
+        self._pending: list[dict] = []
+
+    def submit(self, reading: dict):
+        if self._queue is None:
+            self.store_now([reading])
+        else:
+            self._queue.put_nowait(reading)
+
+    def _failed(self, error: Exception):
+        if not self.degraded:
+            logger.error(f"Database write failed ({error!r}); spooling readings to {self.spool.path}")
+        self.degraded = True
+        self.last_error = repr(error)
+
+    def store_now(self, readings: list[dict]):
+        """Write synchronously: to the database, or the spool if that fails."""
+        try:
+            self.stored += insert_readings(readings)
+        except Exception as e:
+            self._failed(e)
+            self.spool.append(readings)
+
+    async def _write(self, readings: list[dict]):
+        if not self.degraded:
+            try:
+                stored = await asyncio.wait_for(asyncio.to_thread(insert_readings, readings), self.timeout)
+                self.stored += stored
+                logger.debug(f"Stored {stored} of {len(readings)} readings")
+                return
+            except Exception as e:
+                self._failed(e)
+        await asyncio.to_thread(self.spool.append, readings)
+        logger.debug(f"Spooled {len(readings)} readings")
+
+    async def _replay_loop(self, should_replay: Callable[[], bool]):
+        while True:
+            if not should_replay():
+                # Another process replays the shared spool; once it has
+                # caught up the database is back, so write to it again
+                if self.degraded and not self.spool.pending_bytes():
+                    logger.info("Spool replayed elsewhere; writing readings to the database again")
+                    self.degraded = False
+            elif self.spool.pending_bytes():
+                try:
+                    inserted = await asyncio.to_thread(self.spool.replay)
+                    logger.info(f"Replayed {inserted} spooled readings into the database")
+                    # More may have been spooled meanwhile; go again straight away
+                    if self.spool.pending_bytes():
+                        continue
+                    self.degraded = False
+                except Exception as e:
+                    logger.error(f"Spool replay error: {e}")
+            await asyncio.sleep(self.replay_interval)
+
+    async def run(self, should_replay: Callable[[], bool] = lambda: True):
+        """Write queued readings until cancelled; replays the spool when `should_replay()`.
+
+        Only one process should replay (the leader); any may spool.
+        """
+        self._queue = asyncio.Queue()
+        replayer = asyncio.create_task(self._replay_loop(should_replay))
+        try:
+            while True:
+                self._pending.append(await self._queue.get())
+                while not self._queue.empty():
+                    self._pending.append(self._queue.get_nowait())
+                try:
+                    await self._write(self._pending)
+                    self._pending = []
+                except Exception as e:
+                    # Database and spool both unavailable; keep the readings and retry with the next one
+                    logger.error(f"Could not spool {len(self._pending)} readings: {e!r}")
+        finally:
+            replayer.cancel()
+            queue, self._queue = self._queue, None
+            while not queue.empty():
+                self._pending.append(queue.get_nowait())
+            if self._pending:
+                # Shutting down (or demoted) mid-write: the spool is the quick, safe place
+                try:
+                    self.spool.append(self._pending)
+                except Exception as e:
+                    logger.error(f"Lost {len(self._pending)} readings: could not spool them ({e!r})")
+                self._pending = []
+
+    def metrics(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "stored": self.stored,
+            "spooled": self.spool.appended,
+            "replayed": self.spool.replayed,
+            "corrupt": self.spool.corrupt,
+            "spool_bytes": self.spool.pending_bytes(),
+            "degraded": self.degraded,
+            "last_error": self.last_error,
+        }
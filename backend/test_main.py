@@ -1,6 +1,17 @@
+import asyncio
+import gzip
+import json
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+from contextlib import suppress
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 
+import brotli
+import httpx
+import numpy
 import pytest
 from fastapi.testclient import TestClient
 
@@ -10,15 +21,37 @@ os.environ["BATTERY_CAPACITY_AH"] = "150"
 os.environ["BATTERY_VOLTAGE_NOMINAL"] = "12"
 os.environ["BATTERY_MIN_SOC"] = "50"
 
+import alerts
+import analytics
+import archive
+import battery_health
+import main
+import memory
+import resample
+from alerts import AlertEngine, WebhookDispatcher, build_rule
+from backfill import backfill, find_gaps, store_backfill
+from benchmarks.generator import generate
+from benchmarks.loadtest import LoadTest
+from benchmarks.run import compare as compare_benchmarks
+from compression import choose_encoding
 from database import SessionLocal, engine
+from fake_vrm import create_app as create_fake_vrm
+from leader import LeaderElector, release, try_acquire, watch_readings
 from main import app, calculate_time_remaining, cleanup_old_readings
-from models import Base, EnergyReading
-from vrm_client import VRMClient
+from memory import MemoryMonitor
+from models import BackfillRange, Base, BatteryHealthDay, DiagnosticValue, EnergyReading
+from sources import IngestionSource, VenusMQTTSource
+from spool import ReadingWriter, Spool, insert_readings, scan
+from transport import CircuitBreaker, CircuitOpenError, ResilientTransport, parse_retry_after
+from vrm_client import READING_FIELDS, VRMClient
 
 
 @pytest.fixture(autouse=True)
-def setup_database():
+def setup_database(tmp_path, monkeypatch):
     """Create test database tables before each test, clean up after."""
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    main.response_cache.clear()
+    monkeypatch.setattr(main, "writer", ReadingWriter(Spool(str(tmp_path / "spool.bin"))))
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
@@ -370,3 +403,1653 @@ class TestSunEndpoint:
         assert "daylight_remaining_hours" in data
         assert "is_daylight" in data
         assert "location" in data
+
+
+class TestAlertEngine:
+    def _engine(self, specs):
+        return AlertEngine([build_rule(s) for s in specs], cooldown=0)
+
+    def test_threshold_fires_once_and_resolves_with_hysteresis(self):
+        engine = self._engine([
+            {"name": "low_soc", "type": "threshold", "field": "battery_soc", "below": 50, "hysteresis": 2}
+        ])
+        t0 = datetime(2026, 1, 1, 12, 0)
+        assert engine.evaluate({"battery_soc": 55}, t0) == []
+        events = engine.evaluate({"battery_soc": 49}, t0 + timedelta(minutes=1))
+        assert [e["state"] for e in events] == ["firing"]
+        # Still low: no duplicate notification
+        assert engine.evaluate({"battery_soc": 48}, t0 + timedelta(minutes=2)) == []
+        # Inside the hysteresis band: stays active
+        assert engine.evaluate({"battery_soc": 51}, t0 + timedelta(minutes=3)) == []
+        events = engine.evaluate({"battery_soc": 53}, t0 + timedelta(minutes=4))
+        assert [e["state"] for e in events] == ["resolved"]
+
+    def test_rate_of_change(self):
+        engine = self._engine([
+            {"name": "pv_collapse", "type": "rate_of_change", "field": "solar_power", "max_drop": 100}
+        ])
+        t0 = datetime(2026, 1, 1, 12, 0)
+        engine.evaluate({"solar_power": 400}, t0)
+        assert engine.evaluate({"solar_power": 380}, t0 + timedelta(minutes=1)) == []
+        events = engine.evaluate({"solar_power": 20}, t0 + timedelta(minutes=2))
+        assert events[0]["rule"] == "pv_collapse"
+        assert events[0]["value"] == -360.0
+
+    def test_zscore(self):
+        engine = self._engine([
+            {"name": "temp_spike", "type": "zscore", "field": "temperature", "window": 20, "threshold": 3}
+        ])
+        t0 = datetime(2026, 1, 1, 12, 0)
+        for i in range(20):
+            assert engine.evaluate({"temperature": 20 + (i % 2) * 0.2}, t0 + timedelta(minutes=i)) == []
+        events = engine.evaluate({"temperature": 35}, t0 + timedelta(minutes=21))
+        assert events[0]["state"] == "firing"
+
+    def test_stale_field(self):
+        engine = self._engine([
+            {"name": "temp_stale", "type": "stale", "field": "temperature", "minutes": 10}
+        ])
+        t0 = datetime(2026, 1, 1, 12, 0)
+        engine.evaluate({"temperature": 20}, t0)
+        assert engine.evaluate({"temperature": None}, t0 + timedelta(minutes=5)) == []
+        events = engine.check_stale(t0 + timedelta(minutes=11))
+        assert events[0]["state"] == "firing"
+        events = engine.evaluate({"temperature": 21}, t0 + timedelta(minutes=12))
+        assert events[0]["state"] == "resolved"
+
+    def test_cooldown_suppresses_flapping(self):
+        engine = AlertEngine([build_rule(
+            {"name": "low_soc", "type": "threshold", "field": "battery_soc", "below": 50}
+        )], cooldown=600)
+        t0 = datetime(2026, 1, 1, 12, 0)
+        assert len(engine.evaluate({"battery_soc": 40}, t0)) == 1
+        assert len(engine.evaluate({"battery_soc": 60}, t0 + timedelta(minutes=1))) == 1
+        # Fires again within the cooldown: suppressed, and so is its resolve
+        assert engine.evaluate({"battery_soc": 40}, t0 + timedelta(minutes=2)) == []
+        assert engine.evaluate({"battery_soc": 60}, t0 + timedelta(minutes=3)) == []
+        assert engine.suppressed == 1
+
+    def test_rule_without_check_cannot_be_built(self):
+        class Incomplete(alerts.Rule):
+            type = "incomplete"
+
+        with pytest.raises(TypeError):
+            Incomplete("x")
+
+    def test_invalid_rule(self):
+        with pytest.raises(ValueError):
+            build_rule({"name": "x", "type": "nope"})
+        with pytest.raises(ValueError):
+            build_rule({"name": "x", "type": "threshold", "field": "battery_soc"})
+
+    def test_invalid_rule_config_falls_back_to_defaults(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(alerts, "ALERT_RULES", "[{not json")
+        assert [r.name for r in alerts.load_rules(40)] == [s["name"] for s in alerts.default_rules(40)]
+        monkeypatch.setattr(alerts, "ALERT_RULES", '[{"name": "x", "type": "nope"}]')
+        assert [r.name for r in alerts.load_rules(40)] == [s["name"] for s in alerts.default_rules(40)]
+        monkeypatch.setattr(alerts, "ALERT_RULES", "")
+        monkeypatch.setattr(alerts, "ALERT_RULES_FILE", str(tmp_path / "missing.json"))
+        assert [r.name for r in alerts.load_rules(40)] == [s["name"] for s in alerts.default_rules(40)]
+
+    def test_no_staleness_rules_without_ingest_source(self):
+        names = [r.name for r in alerts.load_rules(40, ingesting=False)]
+        assert "low_soc" in names
+        assert "no_data" not in names and "temperature_sensor_stale" not in names
+
+    def test_alerts_endpoint(self):
+        with TestClient(app) as c:
+            response = c.get("/api/alerts")
+        assert response.status_code == 200
+        assert any(r["rule"] == "low_soc" for r in response.json()["rules"])
+
+
+    def test_followers_do_not_evaluate_readings(self, monkeypatch):
+        engine = self._engine([{"name": "low_soc", "type": "threshold", "field": "battery_soc", "below": 50}])
+        monkeypatch.setattr(main, "alert_engine", engine)
+        monkeypatch.setattr(main, "elector", SimpleNamespace(is_leader=False))
+        parsed = dict.fromkeys(READING_FIELDS)
+        parsed.update(battery_soc=10.0)
+        main.store_reading(parsed)
+        assert not engine.status()[0]["active"]
+        main.elector.is_leader = True
+        main.store_reading(parsed)
+        assert engine.status()[0]["active"]
+
+    def test_followers_serve_the_leaders_state(self, monkeypatch):
+        specs = [{"name": "low_soc", "type": "threshold", "field": "battery_soc", "below": 50}]
+        leader = self._engine(specs)
+        t0 = datetime(2026, 1, 1, 12, 0)
+        leader.evaluate({"battery_soc": 40}, t0)
+        alerts.save_states(leader.states())
+
+        monkeypatch.setattr(main, "alert_engine", self._engine(specs))
+        monkeypatch.setattr(main, "elector", SimpleNamespace(is_leader=False))
+        (rule,) = client.get("/api/alerts").json()["rules"]
+        assert rule["active"] and rule["value"] == 40
+        assert rule["since"] == t0.isoformat()
+
+        # A new leader carries on: the alert doesn't fire again, but resolving is reported
+        successor = self._engine(specs)
+        successor.restore(alerts.load_states())
+        assert successor.evaluate({"battery_soc": 30}, t0 + timedelta(minutes=1)) == []
+        events = successor.evaluate({"battery_soc": 60}, t0 + timedelta(minutes=2))
+        assert [e["state"] for e in events] == ["resolved"]
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    received: list = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append(json.loads(body))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook_server():
+    _WebhookHandler.received = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/hook", _WebhookHandler.received
+    server.shutdown()
+    server.server_close()
+
+
+class TestWebhookDispatcher:
+    @pytest.mark.asyncio
+    async def test_delivers_to_webhook(self, webhook_server):
+        url, received = webhook_server
+        dispatcher = WebhookDispatcher([url])
+        engine = AlertEngine([build_rule(
+            {"name": "low_soc", "type": "threshold", "field": "battery_soc", "below": 50}
+        )], dispatcher, cooldown=0)
+
+        async with httpx.AsyncClient() as http:
+            worker = asyncio.create_task(dispatcher.run(http))
+            engine.evaluate({"battery_soc": 30})
+            for _ in range(100):
+                if received:
+                    break
+                await asyncio.sleep(0.02)
+            worker.cancel()
+
+        assert received[0]["rule"] == "low_soc"
+        assert received[0]["state"] == "firing"
+        assert dispatcher.sent == 1
+
+    def test_dedups_queued_events(self):
+        dispatcher = WebhookDispatcher(["http://127.0.0.1:9/hook"])
+        event = {"rule": "low_soc", "state": "firing"}
+        assert dispatcher.submit(event) is True
+        assert dispatcher.submit(dict(event)) is False
+        assert dispatcher.dropped == 1
+
+    def test_rate_limit(self):
+        dispatcher = WebhookDispatcher(["http://127.0.0.1:9/hook"], max_per_minute=2)
+        assert not dispatcher._rate_limited()
+        assert not dispatcher._rate_limited()
+        assert dispatcher._rate_limited()
+
+
+class FakeMQTTBroker:
+    """Minimal in-process MQTT 3.1.1 broker: QoS 0 publish/subscribe only."""
+
+    def __init__(self):
+        self.subscriptions: list[tuple[str, asyncio.StreamWriter]] = []
+        self.received: list[tuple[str, bytes]] = []
+        self.subscribed = asyncio.Event()
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        for _, writer in self.subscriptions:
+            writer.close()
+
+    @staticmethod
+    def _packet(packet_type: int, body: bytes) -> bytes:
+        length, encoded = len(body), bytearray()
+        while True:
+            byte, length = length % 128, length // 128
+            encoded.append(byte | (0x80 if length else 0))
+            if not length:
+                break
+        return bytes([packet_type]) + bytes(encoded) + body
+
+    @staticmethod
+    def _matches(pattern: str, topic: str) -> bool:
+        p, t = pattern.split("/"), topic.split("/")
+        for i, part in enumerate(p):
+            if part == "#":
+                return True
+            if i >= len(t) or (part != "+" and part != t[i]):
+                return False
+        return len(p) == len(t)
+
+    def publish(self, topic: str, payload: bytes):
+        encoded = topic.encode()
+        packet = self._packet(0x30, len(encoded).to_bytes(2, "big") + encoded + payload)
+        for pattern, writer in self.subscriptions:
+            if self._matches(pattern, topic):
+                writer.write(packet)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 8:  # SUBSCRIBE
+                    packet_id, pos, granted = body[:2], 2, b""
+                    while pos < len(body):
+                        size = int.from_bytes(body[pos:pos + 2], "big")
+                        self.subscriptions.append((body[pos + 2:pos + 2 + size].decode(), writer))
+                        pos += size + 3
+                        granted += b"\x00"
+                    writer.write(self._packet(0x90, packet_id + granted))
+                    self.subscribed.set()
+                elif kind == 10:  # UNSUBSCRIBE
+                    writer.write(self._packet(0xB0, body[:2]))
+                elif kind == 3:  # PUBLISH (QoS 0)
+                    size = int.from_bytes(body[:2], "big")
+                    self.received.append((body[2:2 + size].decode(), body[2 + size:]))
+                elif kind == 12:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 14:  # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class TestVenusMQTTSource:
+    def _source(self):
+        return VenusMQTTSource(host="localhost", portal_id="c0ffee", interval=0.05)
+
+    def test_source_without_run_cannot_be_built(self):
+        class Incomplete(IngestionSource):
+            name = "incomplete"
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_handle_message_maps_topics(self):
+        source = self._source()
+        source.handle_message("N/c0ffee/system/0/Dc/Battery/Voltage", b'{"value": 12.6}')
+        source.handle_message("N/c0ffee/solarcharger/279/Pv/V", b'{"value": 18.2}')
+        source.handle_message("N/c0ffee/system/0/Dc/Battery/State", b'{"value": 1}')
+        source.handle_message("N/c0ffee/temperature/24/Humidity", b'{"value": 55}')
+        source.handle_message("N/c0ffee/system/0/Unmapped/Path", b'{"value": 1}')
+        parsed = source.snapshot()
+        assert parsed["battery_voltage"] == 12.6
+        assert parsed["solar_voltage"] == 18.2
+        assert parsed["battery_state"] == "charging"
+        assert parsed["humidity"] == 55.0
+        # SOC estimated from voltage when not published
+        assert 85 <= parsed["battery_soc"] <= 90
+
+    def test_coalesces_to_latest_value(self):
+        source = self._source()
+        for watts in (100, 150, 210):
+            source.handle_message("N/c0ffee/system/0/Dc/Pv/Power", json.dumps({"value": watts}).encode())
+        assert source.snapshot()["solar_power"] == 210.0
+
+    def test_ignores_bad_payloads(self):
+        source = self._source()
+        source.handle_message("N/c0ffee/system/0/Dc/Battery/Voltage", b"not json")
+        assert source.snapshot() is None
+        source.handle_message("N/c0ffee/system/0/Dc/Battery/Voltage", b'{"value": 12.4}')
+        source.handle_message("N/c0ffee/system/0/Dc/Battery/Voltage", b"")
+        assert source.snapshot()["battery_voltage"] is None
+
+    def test_requires_host(self):
+        with pytest.raises(ValueError):
+            VenusMQTTSource(host="")
+
+    @pytest.mark.asyncio
+    async def test_ingests_from_broker(self):
+        broker = FakeMQTTBroker()
+        port = await broker.start()
+        source = VenusMQTTSource(host="127.0.0.1", port=port, portal_id="", interval=0.05)
+        stored = []
+        task = asyncio.create_task(source.run(stored.append))
+        try:
+            # Portal ID is discovered from the Serial topic
+            await asyncio.wait_for(broker.subscribed.wait(), 5)
+            broker.subscribed.clear()
+            broker.publish("N/c0ffee/system/0/Serial", b'{"value": "c0ffee"}')
+            await asyncio.wait_for(broker.subscribed.wait(), 5)
+
+            broker.publish("N/c0ffee/system/0/Dc/Battery/Soc", b'{"value": 81.5}')
+            broker.publish("N/c0ffee/system/0/Dc/Pv/Power", b'{"value": 140}')
+            for _ in range(100):
+                if stored and stored[-1]["solar_power"] == 140.0:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            await broker.stop()
+
+        assert source.portal_id == "c0ffee"
+        assert stored[-1]["battery_soc"] == 81.5
+        assert stored[-1]["solar_power"] == 140.0
+        assert ("R/c0ffee/keepalive", b"") in broker.received
+
+
+@pytest.fixture
+def fake_vrm(monkeypatch):
+    """VRMClient wired to the in-process fake VRM server."""
+    monkeypatch.setenv("VRM_TOKEN", "test-token")
+    monkeypatch.setenv("VRM_INSTALLATION_ID", "123456")
+    fake_app = create_fake_vrm()
+    return VRMClient(transport=httpx.ASGITransport(app=fake_app)), fake_app
+
+
+class TestBackfill:
+    def _add(self, *timestamps):
+        db = SessionLocal()
+        try:
+            db.add_all([EnergyReading(timestamp=ts, battery_voltage=12.6) for ts in timestamps])
+            db.commit()
+        finally:
+            db.close()
+
+    def test_find_gaps(self):
+        now = datetime(2026, 6, 21, 12, 0)
+        since = now - timedelta(days=1)
+        self._add(since + timedelta(minutes=5), since + timedelta(minutes=6),
+                  since + timedelta(hours=3), now - timedelta(minutes=1))
+        db = SessionLocal()
+        try:
+            gaps = find_gaps(db, since, now, timedelta(minutes=10))
+        finally:
+            db.close()
+        assert gaps == [(since + timedelta(minutes=6), since + timedelta(hours=3)),
+                        (since + timedelta(hours=3), now - timedelta(minutes=1))]
+
+    def test_parse_stats_data(self):
+        vrm = VRMClient.__new__(VRMClient)
+        data = {"records": {
+            "bv": [[1782043200000, 12.6, 12.5, 12.7]],
+            "PVP": [[1782043200000, 150, 140, 160], [1782044100000, "bad", 0, 0]],
+            "unknown": [[1782043200000, 1, 1, 1]],
+        }}
+        result = vrm.parse_stats_data(data)
+        assert len(result) == 1
+        ts, parsed = result[0]
+        assert ts == datetime(2026, 6, 21, 12, 0)
+        assert parsed["battery_voltage"] == 12.6
+        assert parsed["solar_power"] == 150.0
+        assert parsed["battery_soc"] is not None
+
+    @pytest.mark.asyncio
+    async def test_fills_gap_idempotently(self, fake_vrm):
+        client, fake_app = fake_vrm
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        gap_start = now - timedelta(hours=6)
+        gap_end = now - timedelta(hours=2)
+        self._add(now - timedelta(days=7), gap_start, gap_end, now)
+
+        inserted = await backfill(client, now)
+        # 15-minute stats strictly inside the 4-hour gap (plus the older gap)
+        db = SessionLocal()
+        try:
+            in_gap = db.query(EnergyReading).filter(
+                EnergyReading.timestamp > gap_start, EnergyReading.timestamp < gap_end
+            ).all()
+            assert 15 <= len(in_gap) <= 16
+            assert all(r.battery_voltage is not None and r.solar_power is not None for r in in_gap)
+            assert db.query(BackfillRange).count() > 0
+            total = db.query(EnergyReading).count()
+        finally:
+            db.close()
+        assert inserted == total - 4
+
+        # Settled ranges are not fetched again; only the unsettled last minutes are retried
+        requests_before = len(fake_app.state.requests)
+        assert await backfill(client, now) == 0
+        assert len(fake_app.state.requests) == requests_before + 1
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_store_backfill_skips_existing(self):
+        start, end = datetime(2026, 6, 21, 10), datetime(2026, 6, 21, 11)
+        readings = [(datetime(2026, 6, 21, 10, 15), {"battery_voltage": 12.5}),
+                    (datetime(2026, 6, 21, 10, 30), {"battery_voltage": 12.6}),
+                    (datetime(2026, 6, 21, 11, 15), {"battery_voltage": 12.7})]
+        assert store_backfill(start, end, readings, settled=False) == 2
+        assert store_backfill(start, end, readings, settled=True) == 0
+        db = SessionLocal()
+        try:
+            assert db.query(EnergyReading).count() == 2
+            assert db.query(BackfillRange).count() == 1
+        finally:
+            db.close()
+
+
+def _scripted_transport(responses: list):
+    """MockTransport returning queued responses (or raising queued exceptions) in order."""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        item = responses.pop(0)
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    return httpx.MockTransport(handler), calls
+
+
+class TestResilientTransport:
+    def _transport(self, responses, **kwargs):
+        mock, calls = _scripted_transport(responses)
+        kwargs.setdefault("backoff_base", 0.001)
+        return ResilientTransport(transport=mock, **kwargs), calls
+
+    @pytest.mark.asyncio
+    async def test_retries_server_errors(self):
+        transport, calls = self._transport([httpx.Response(503), httpx.Response(502), httpx.Response(200)])
+        response = await transport.get("https://vrm.test/x")
+        assert response.status_code == 200
+        assert len(calls) == 3
+        assert transport.counters["retries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_returns_last_response_when_retries_exhausted(self):
+        transport, calls = self._transport([httpx.Response(500)] * 3, max_retries=2)
+        response = await transport.get("https://vrm.test/x")
+        assert response.status_code == 500
+        assert transport.counters["failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_client_errors(self):
+        transport, calls = self._transport([httpx.Response(404)])
+        assert (await transport.get("https://vrm.test/x")).status_code == 404
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_retries_transport_errors(self):
+        transport, calls = self._transport([httpx.ConnectTimeout("slow"), httpx.Response(200)])
+        assert (await transport.get("https://vrm.test/x")).status_code == 200
+
+    @pytest.mark.asyncio
+    async def test_retry_after_beyond_deadline_gives_up(self):
+        transport, calls = self._transport(
+            [httpx.Response(429, headers={"Retry-After": "120"}), httpx.Response(200)], deadline=5
+        )
+        response = await transport.get("https://vrm.test/x")
+        assert response.status_code == 429
+        assert len(calls) == 1
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("garbage") is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+    @pytest.mark.asyncio
+    async def test_circuit_opens_and_fails_fast(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        transport, calls = self._transport([httpx.ConnectError("down")] * 2, max_retries=1, breaker=breaker)
+        with pytest.raises(httpx.ConnectError):
+            await transport.get("https://vrm.test/x")
+        assert breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await transport.get("https://vrm.test/x")
+        assert len(calls) == 2
+        assert transport.metrics()["circuit"]["transitions"]["open"] == 1
+
+    @pytest.mark.asyncio
+    async def test_circuit_half_open_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        transport, calls = self._transport([httpx.ConnectError("down"), httpx.Response(200)],
+                                           max_retries=0, breaker=breaker)
+        with pytest.raises(httpx.ConnectError):
+            await transport.get("https://vrm.test/x")
+        await asyncio.sleep(0.02)
+        assert (await transport.get("https://vrm.test/x")).status_code == 200
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert [t["to"] for t in breaker.history] == ["open", "half_open", "closed"]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_half_open_trial_releases_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        started = asyncio.Event()
+
+        async def handler(request):
+            started.set()
+            await asyncio.sleep(60)
+
+        transport = ResilientTransport(transport=httpx.MockTransport(handler), max_retries=0, breaker=breaker)
+        breaker.record_failure()
+        await asyncio.sleep(0.02)
+        task = asyncio.create_task(transport.get("https://vrm.test/x"))
+        await started.wait()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.allow()
+
+    @pytest.mark.asyncio
+    async def test_interrupt_is_not_a_breaker_failure(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        transport, calls = self._transport([KeyboardInterrupt()], max_retries=0, breaker=breaker)
+        with pytest.raises(KeyboardInterrupt):
+            await transport.get("https://vrm.test/x")
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.failures == 0
+
+    @pytest.mark.asyncio
+    async def test_unexpected_error_in_half_open_trial_reopens_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        transport, calls = self._transport([ValueError("bad payload")], max_retries=0, breaker=breaker)
+        breaker.record_failure()
+        await asyncio.sleep(0.02)
+        with pytest.raises(ValueError):
+            await transport.get("https://vrm.test/x")
+        assert breaker.state == CircuitBreaker.OPEN
+        await asyncio.sleep(0.02)
+        assert breaker.allow()
+
+    @pytest.mark.asyncio
+    async def test_vrm_client_returns_none_when_circuit_open(self, monkeypatch):
+        monkeypatch.setenv("VRM_TOKEN", "test-token")
+        monkeypatch.setenv("VRM_INSTALLATION_ID", "123456")
+        vrm = VRMClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+        vrm.http.breaker.state = CircuitBreaker.OPEN
+        vrm.http.breaker.opened_at = float("inf")
+        assert await vrm.get_diagnostic_data() is None
+
+    def test_metrics_endpoint(self):
+        response = client.get("/api/metrics")
+        assert response.status_code == 200
+        assert "vrm" in response.json()
+
+
+class TestStartup:
+    def test_ready_after_warm_up(self):
+        with TestClient(app) as c:
+            for _ in range(100):
+                response = c.get("/api/ready")
+                if response.status_code == 200:
+                    break
+                time.sleep(0.02)
+            assert response.status_code == 200
+            assert response.json()["status"] == "ready"
+
+    def test_ready_is_503_while_starting(self, monkeypatch):
+        monkeypatch.setattr(main, "_ready", False)
+        response = client.get("/api/ready")
+        assert response.status_code == 503
+        assert client.get("/api/health").status_code == 200
+
+    def test_warm_up_loads_latest_reading(self, monkeypatch):
+        db = SessionLocal()
+        try:
+            db.add_all([
+                EnergyReading(timestamp=datetime.utcnow() - timedelta(minutes=2), battery_voltage=12.4),
+                EnergyReading(timestamp=datetime.utcnow() - timedelta(minutes=1), battery_voltage=12.7),
+            ])
+            db.commit()
+        finally:
+            db.close()
+        monkeypatch.setattr(main, "_latest_reading", None)
+        main._warm_up()
+        assert main._latest_reading["battery_voltage"] == 12.7
+        assert client.get("/api/current").json()["battery"]["voltage"] == 12.7
+
+    def test_current_served_from_stored_reading(self, monkeypatch):
+        monkeypatch.setattr(main, "_latest_reading", None)
+        parsed = dict.fromkeys(READING_FIELDS)
+        parsed.update(battery_soc=80.0, battery_voltage=12.9, solar_power=100.0, consumption_power=40.0)
+        main.store_reading(parsed)
+        data = client.get("/api/current").json()
+        assert data["battery"]["soc"] == 80.0
+        assert data["battery"]["time_remaining"]["is_charging"] is True
+
+    def test_startup_does_not_wait_for_vrm(self, monkeypatch):
+        async def slow_vrm(request):
+            await asyncio.sleep(5)
+            return httpx.Response(200, json={})
+
+        monkeypatch.setenv("VRM_TOKEN", "test-token")
+        monkeypatch.setenv("VRM_INSTALLATION_ID", "123456")
+        monkeypatch.setattr(main, "VRMClient", lambda: VRMClient(transport=httpx.MockTransport(slow_vrm)))
+        started = time.perf_counter()
+        with TestClient(app) as c:
+            assert c.get("/api/health").status_code == 200
+            assert time.perf_counter() - started < 2
+
+
+class TestLeaderElection:
+    def test_single_holder(self):
+        assert try_acquire("poller", "a", ttl=10) is True
+        assert try_acquire("poller", "b", ttl=10) is False
+        # Holder renews
+        assert try_acquire("poller", "a", ttl=10) is True
+
+    def test_takeover_after_expiry(self):
+        assert try_acquire("poller", "a", ttl=0.05) is True
+        assert try_acquire("poller", "b", ttl=10) is False
+        time.sleep(0.06)
+        assert try_acquire("poller", "b", ttl=10) is True
+        assert try_acquire("poller", "a", ttl=10) is False
+
+    def test_release_allows_immediate_takeover(self):
+        assert try_acquire("poller", "a", ttl=10) is True
+        release("poller", "a")
+        assert try_acquire("poller", "b", ttl=10) is True
+
+    @pytest.mark.asyncio
+    async def test_elector_callbacks(self):
+        events = []
+        a = LeaderElector("poller", lambda: events.append("a up"), lambda: events.append("a down"), ttl=0.1)
+        b = LeaderElector("poller", lambda: events.append("b up"), lambda: events.append("b down"), ttl=0.1)
+        await a.step()
+        await b.step()
+        assert a.is_leader and not b.is_leader
+
+        # a stops renewing (e.g. the worker died): b takes over after the TTL
+        await asyncio.sleep(0.15)
+        await b.step()
+        assert b.is_leader
+        await a.step()
+        assert not a.is_leader
+        assert events == ["a up", "b up", "a down"]
+
+    @pytest.mark.asyncio
+    async def test_watch_readings_notifies_on_new_row(self):
+        changes = []
+        task = asyncio.create_task(watch_readings(lambda: changes.append(1), lambda: True, interval=0.01))
+        await asyncio.sleep(0.05)
+        db = SessionLocal()
+        try:
+            db.add(EnergyReading(battery_voltage=12.5))
+            db.commit()
+        finally:
+            db.close()
+        for _ in range(50):
+            if changes:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        assert changes
+
+    def test_health_reports_leader(self):
+        with TestClient(app) as c:
+            for _ in range(100):
+                if c.get("/api/health").json()["leader"]:
+                    break
+                time.sleep(0.02)
+            assert c.get("/api/health").json()["leader"] is True
+
+
+class TestBenchmarkTools:
+    def test_generator_is_deterministic_and_realistic(self):
+        end = datetime(2026, 6, 21, 23, 59)
+        rows = list(generate(2000, end=end, seed=1))
+        assert rows == list(generate(2000, end=end, seed=1))
+        assert len(rows) == 2000
+        assert all(a["timestamp"] < b["timestamp"] for a, b in zip(rows, rows[1:], strict=False))
+        # Solar only during the day
+        assert all(r["solar_power"] == 0 for r in rows if r["timestamp"].hour < 3)
+        assert max(r["solar_power"] for r in rows if 11 <= r["timestamp"].hour <= 13) > 100
+        assert all(5 <= r["battery_soc"] <= 100 for r in rows)
+
+    def test_generator_leaves_gaps(self):
+        rows = list(generate(5000, gap_probability=0.01, seed=2))
+        steps = [(b["timestamp"] - a["timestamp"]).total_seconds() for a, b in zip(rows, rows[1:], strict=False)]
+        assert max(steps) > 120
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": {"a": {"median_ms": 10.0}, "b": {"median_ms": 10.0}}}
+        current = {"results": {"a": {"median_ms": 11.0}, "b": {"median_ms": 20.0}, "c": {"median_ms": 1.0}}}
+        assert compare_benchmarks(current, baseline, threshold=0.25) == ["b"]
+
+    @pytest.mark.asyncio
+    async def test_fake_vrm_latency_and_payload(self):
+        fake = create_fake_vrm(latency=0.05, extra_records=100)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), base_url="http://vrm") as http:
+            started = time.perf_counter()
+            response = await http.get("/v2/installations/1/diagnostics")
+            assert time.perf_counter() - started >= 0.05
+        assert len(response.json()["records"]) == 114
+
+    @pytest.mark.asyncio
+    async def test_loadtest_report(self):
+        test = LoadTest("http://testserver", clients=5, duration=0.3, interval=0.1,
+                        refresh_probability=0.0, transport=httpx.ASGITransport(app=app))
+        report = await test.run()
+        assert report["requests"] > 0
+        assert set(report["endpoints"]) == {"current", "history", "sun"}
+        assert report["endpoints"]["history"]["p50_ms"] <= report["endpoints"]["history"]["max_ms"]
+        assert report["errors"] == 0
+
+
+class TestProfiling:
+    def _add_readings(self, count: int):
+        db = SessionLocal()
+        now = datetime.utcnow()
+        db.add_all(EnergyReading(timestamp=now - timedelta(minutes=i), battery_soc=80.0) for i in range(count))
+        db.commit()
+        db.close()
+
+    def test_sql_stats_logged_per_request(self, caplog):
+        self._add_readings(5)
+        with caplog.at_level("INFO", logger="main"):
+            response = client.get("/api/history?hours=1")
+        assert response.status_code == 200
+        assert 'desc="1 queries"' in response.headers["Server-Timing"]
+        line = next(r.message for r in caplog.records if r.message.startswith("GET /api/history"))
+        assert "sql=1" in line
+        # Rows are only counted (which buffers results) for profiled requests
+        assert "rows=" not in line
+
+    def test_metrics_count_statements_without_their_text(self):
+        client.get("/api/history")
+        sql = client.get("/api/metrics").json()["sql"]
+        assert sql["statements"] > 0
+        assert "slowest" not in sql
+
+    def test_admin_lists_slowest_statements(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        client.get("/api/history")
+        assert client.get("/api/admin/sql").status_code == 403
+        sql = client.get("/api/admin/sql", headers={"X-Admin-Token": "secret"}).json()
+        assert any("energy_readings" in s["sql"] for s in sql["slowest"])
+
+    def test_profile_flag_parsed_as_boolean(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        headers = {"X-Admin-Token": "secret"}
+        for off in ("0", "false", "no", ""):
+            assert "X-Profile-Id" not in client.get(f"/api/history?profile={off}", headers=headers).headers
+        assert "X-Profile-Id" not in client.get("/api/history", headers={**headers, "X-Profile": "off"}).headers
+        assert "X-Profile-Id" in client.get("/api/history?profile=true", headers=headers).headers
+
+    def test_profiling_requires_admin_token(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        assert "X-Profile-Id" not in client.get("/api/history?profile=1").headers
+        assert "X-Profile-Id" not in client.get(
+            "/api/history?profile=1", headers={"X-Admin-Token": "wrong"}
+        ).headers
+        assert client.get("/api/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    def test_admin_disabled_without_token(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+        assert client.get("/api/admin/profiles", headers={"X-Admin-Token": ""}).status_code == 404
+
+    def test_profile_captured_and_stored(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        self._add_readings(3)
+        headers = {"X-Admin-Token": "secret"}
+        response = client.get("/api/history", headers={**headers, "X-Profile": "1"})
+        profile_id = response.headers["X-Profile-Id"]
+
+        listed = client.get("/api/admin/profiles", headers=headers).json()["profiles"]
+        assert profile_id in [p["id"] for p in listed]
+        profile = client.get(f"/api/admin/profiles/{profile_id}", headers=headers).json()
+        assert profile["path"] == "/api/history"
+        assert profile["sql"][0]["rows"] == 3
+        assert "samples" in profile["profile"]
+        assert client.get("/api/admin/profiles/missing", headers=headers).status_code == 404
+
+
+class TestMemoryMonitor:
+    def test_samples_rss_and_heap(self):
+        monitor = MemoryMonitor(soft_limit_mb=0)
+        point = monitor.sample()
+        assert point["rss_mb"] > 0
+        assert point["heap_blocks"] > 0
+        assert monitor.check() is None
+
+    def test_sheds_caches_over_budget(self):
+        monitor = MemoryMonitor(soft_limit_mb=1)
+        cache = {i: str(i) for i in range(1000)}
+
+        def clear_cache():
+            count = len(cache)
+            cache.clear()
+            return count
+
+        monitor.register_cache("test", clear_cache)
+        monitor.register_cache("broken", lambda: 1 / 0)
+        report = monitor.check()
+        assert report["freed_items"] == {"test": 1000}
+        assert "over 1 MB budget" in report["reason"]
+        assert report["rss_before_mb"] > 0
+        assert cache == {}
+        assert monitor.status()["last_shed"] is report
+
+    def test_sheds_again_only_after_cooldown_or_recovery(self, monkeypatch):
+        monitor = MemoryMonitor(soft_limit_mb=1, cooldown=60)
+        clock = [1000.0]
+        monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+        assert monitor.check() is not None
+        clock[0] += 30
+        assert monitor.check() is None  # Still over budget, within the cooldown
+        clock[0] += 31
+        assert monitor.check() is not None
+
+        # Dropping back under the budget re-arms it straight away
+        monitor.soft_limit_mb = 1_000_000
+        assert monitor.check() is None
+        monitor.soft_limit_mb = 1
+        assert monitor.check() is not None
+        assert len(monitor.sheds) == 3
+
+    def test_tracemalloc_top_allocations(self):
+        monitor = MemoryMonitor()
+        monitor.start_tracing()
+        try:
+            monitor.top_allocations()
+            retained = [bytearray(1024) for _ in range(500)]
+            growth = monitor.top_allocations(limit=5, compare=True)
+            assert growth[0]["size_diff_kb"] >= 400
+            assert "test_main.py" in growth[0]["location"]
+            del retained
+        finally:
+            monitor.stop_tracing()
+
+    def test_admin_memory_endpoints(self, monkeypatch):
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        headers = {"X-Admin-Token": "secret"}
+        assert client.get("/api/admin/memory").status_code == 403
+        status = client.get("/api/admin/memory", headers=headers).json()
+        assert status["rss_mb"] > 0
+        assert client.get("/api/admin/memory/allocations", headers=headers).status_code == 409
+        client.post("/api/admin/memory/tracemalloc", headers=headers)
+        try:
+            allocations = client.get("/api/admin/memory/allocations?limit=3", headers=headers).json()
+            assert len(allocations["allocations"]) == 3
+        finally:
+            client.post("/api/admin/memory/tracemalloc?enabled=false", headers=headers)
+        report = client.post("/api/admin/memory/shed", headers=headers).json()
+        assert report["reason"] == "manual"
+        assert "memory" in client.get("/api/metrics").json()
+
+
+class TestArchive:
+    def _add(self, *readings):
+        db = SessionLocal()
+        try:
+            db.add_all([EnergyReading(**r) for r in readings])
+            db.commit()
+        finally:
+            db.close()
+
+    def _count(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(EnergyReading).count()
+        finally:
+            db.close()
+
+    def test_day_file_round_trip_with_pruning(self, tmp_path):
+        day = datetime(2026, 6, 21)
+        timestamps = [day + timedelta(minutes=i) for i in range(60)]
+        columns = {"timestamp": timestamps}
+        for field in READING_FIELDS:
+            columns[field] = [float(i) if i % 7 else None for i in range(60)]
+        columns["battery_state"] = ["charging" if i % 2 else None for i in range(60)]
+        path = str(tmp_path / "day.vca")
+        archive.write_day_file(path, columns)
+
+        chunk = archive.read_day_file(path, ["battery_voltage", "battery_state"],
+                                      day + timedelta(minutes=10), day + timedelta(minutes=20))
+        assert set(chunk) == {"timestamp", "battery_voltage", "battery_state"}
+        assert [archive.from_micros(us) for us in chunk["timestamp"]] == timestamps[10:20]
+        assert list(chunk["battery_voltage"][:4]) == [10.0, 11.0, 12.0, 13.0]
+        assert chunk["battery_voltage"][4] != chunk["battery_voltage"][4]  # NaN for missing
+        assert chunk["battery_state"][:2] == [None, "charging"]
+
+    def test_archives_expired_days_incrementally(self):
+        now = datetime.utcnow()
+        old = now - timedelta(days=9)
+        self._add(*({"timestamp": old + timedelta(minutes=i), "battery_voltage": 12.0 + i / 100,
+                     "battery_state": "idle"} for i in range(30)),
+                  {"timestamp": now - timedelta(hours=1), "battery_voltage": 13.0})
+
+        cleanup_old_readings()
+        assert self._count() == 1
+        manifest = archive.get_manifest().days
+        assert sum(entry["rows"] for entry in manifest.values()) == 30
+
+        # Simulate a run interrupted after the manifest was written: the
+        # same rows are still in the database and get merged, not duplicated
+        self._add({"timestamp": old, "battery_voltage": 12.0, "battery_state": "idle"})
+        cleanup_old_readings()
+        assert self._count() == 1
+        assert sum(entry["rows"] for entry in archive.get_manifest().days.values()) == 30
+
+        rows = list(archive.iter_rows(old - timedelta(hours=1), now, ["battery_voltage", "battery_state"]))
+        assert len(rows) == 30
+        assert rows[0] == {"timestamp": old, "battery_voltage": 12.0, "battery_state": "idle"}
+
+    def test_readings_stored_while_archiving_are_kept(self, monkeypatch):
+        old = datetime.utcnow() - timedelta(days=9)
+        self._add({"timestamp": old, "battery_voltage": 12.0})
+        archive_expired = archive.archive_expired
+
+        def archive_then_replay(cutoff):
+            moved = archive_expired(cutoff)
+            self._add({"timestamp": old + timedelta(minutes=1), "battery_voltage": 12.1})
+            return moved
+
+        monkeypatch.setattr(archive, "archive_expired", archive_then_replay)
+        cleanup_old_readings()
+        assert self._count() == 1
+        monkeypatch.setattr(archive, "archive_expired", archive_expired)
+        cleanup_old_readings()
+        assert self._count() == 0
+        assert sum(entry["rows"] for entry in archive.get_manifest().days.values()) == 2
+
+    def test_disabled_without_archive_dir(self, monkeypatch):
+        monkeypatch.setattr(archive, "ARCHIVE_DIR", "")
+        self._add({"timestamp": datetime.utcnow() - timedelta(days=8), "battery_voltage": 12.5})
+        cleanup_old_readings()
+        assert self._count() == 0
+        assert archive.count_rows(datetime.utcnow() - timedelta(days=30), datetime.utcnow()) == 0
+
+    def test_history_reads_past_hot_window(self):
+        now = datetime.utcnow()
+        self._add({"timestamp": now - timedelta(days=20), "battery_voltage": 12.1},
+                  {"timestamp": now - timedelta(hours=2), "battery_voltage": 12.9})
+        cleanup_old_readings()
+
+        readings = client.get("/api/history?hours=24").json()["readings"]
+        assert [r["battery_voltage"] for r in readings] == [12.9]
+        readings = client.get(f"/api/history?hours={24 * 30}").json()["readings"]
+        assert [r["battery_voltage"] for r in readings] == [12.1, 12.9]
+
+    def test_export_csv_spans_archive_and_database(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        self._add({"timestamp": now - timedelta(days=20), "battery_voltage": 12.1, "solar_power": 5.0},
+                  {"timestamp": now - timedelta(hours=2), "battery_voltage": 12.9, "solar_power": None})
+        cleanup_old_readings()
+
+        start = (now - timedelta(days=30)).isoformat()
+        response = client.get(f"/api/export?start={start}&fields=battery_voltage,solar_power")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        lines = response.text.strip().splitlines()
+        assert lines[0] == "timestamp,battery_voltage,solar_power"
+        assert lines[1] == f"{(now - timedelta(days=20)).isoformat()},12.1,5.0"
+        assert lines[2] == f"{(now - timedelta(hours=2)).isoformat()},12.9,"
+
+        assert client.get(f"/api/export?start={start}&fields=nope").status_code == 422
+        assert client.get(f"/api/export?start={start}&end={start}").status_code == 422
+
+
+class TestAnalytics:
+    def _add(self, readings):
+        db = SessionLocal()
+        try:
+            db.add_all([EnergyReading(**r) for r in readings])
+            db.commit()
+        finally:
+            db.close()
+
+    def test_group_by_hour_with_percentiles(self):
+        day = datetime(2026, 1, 10)
+        self._add({"timestamp": day + timedelta(minutes=m), "solar_power": float(m % 60),
+                   "consumption_power": None if m % 2 else 40.0} for m in range(180))
+        result = analytics.run_query(analytics.Query(
+            fields=["solar_power", "consumption_power"], start=day, end=day + timedelta(days=1),
+            group_by=["hour_of_day"], aggregations=["mean", "min", "max", "p90", "count"], timezone="UTC",
+        ))
+        assert result["rows_scanned"] == 180
+        assert [g["hour_of_day"] for g in result["groups"]] == [0, 1, 2]
+        solar = result["groups"][1]["solar_power"]
+        assert solar == {"mean": 29.5, "min": 0.0, "max": 59.0, "count": 60,
+                         "p90": round(float(numpy.percentile(numpy.arange(60.0), 90)), 3)}
+        # Missing values are skipped
+        assert result["groups"][0]["consumption_power"]["count"] == 30
+
+    def test_local_time_and_overnight_window(self):
+        # 21:30 UTC in June is 22:30 in London
+        summer = datetime(2026, 6, 1, 21, 30)
+        self._add([{"timestamp": summer, "consumption_power": 10.0},
+                   {"timestamp": summer - timedelta(hours=2), "consumption_power": 99.0}])
+        result = analytics.run_query(analytics.Query(
+            fields=["consumption_power"], start=summer - timedelta(days=1), end=summer + timedelta(days=1),
+            group_by=["hour_of_day"], hour_from=22, hour_to=6,
+        ))
+        assert result["groups"] == [{"hour_of_day": 22, "consumption_power": {"mean": 10.0}}]
+
+    def test_monthly_query_spans_archive(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        old = now - timedelta(days=40)
+        self._add([{"timestamp": old, "solar_power": 100.0},
+                   {"timestamp": old + timedelta(minutes=1), "solar_power": 300.0},
+                   {"timestamp": now - timedelta(hours=1), "solar_power": 50.0}])
+        cleanup_old_readings()
+
+        response = client.get("/api/query", params={
+            "fields": "solar_power", "group_by": "month,day", "agg": "mean,sum",
+            "start": (now - timedelta(days=60)).isoformat(), "tz": "UTC",
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["rows_scanned"] == 3
+        first, last = data["groups"][0], data["groups"][-1]
+        assert first["month"] == old.strftime("%Y-%m")
+        assert first["solar_power"] == {"mean": 200.0, "sum": 400.0}
+        assert last["solar_power"]["sum"] == 50.0
+
+    def test_week_labels_are_mondays(self):
+        self._add([{"timestamp": datetime(2026, 10, 15, 12), "battery_voltage": 12.5}])  # A Thursday
+        result = analytics.run_query(analytics.Query(
+            fields=["battery_voltage"], start=datetime(2026, 10, 1), end=datetime(2026, 11, 1), group_by=["week"],
+        ))
+        assert result["groups"][0]["week"] == "2026-10-12"
+
+    @pytest.mark.parametrize("params", [
+        {"fields": "battery_state"},
+        {"fields": "solar_power", "group_by": "year"},
+        {"fields": "solar_power", "agg": "median"},
+        {"fields": "solar_power", "tz": "Mars/Olympus"},
+        {"fields": "solar_power", "hour_from": 22},
+    ])
+    def test_rejects_unsupported_queries(self, params):
+        assert client.get("/api/query", params=params).status_code == 422
+
+
+class TestResample:
+    MINUTE = 60_000_000
+
+    def _data(self, minutes, voltages, states):
+        return {
+            "timestamp": (numpy.array(minutes) * self.MINUTE).astype(numpy.int64),
+            "battery_voltage": numpy.array(voltages, dtype=float),
+            "battery_state": numpy.array(states, dtype=object),
+        }
+
+    def test_policies_and_gaps(self):
+        # Readings at 0, 1.5, 3 and then nothing until 20 minutes
+        data = self._data([0, 1.5, 3, 20], [12.0, 12.3, numpy.nan, 13.0], ["idle", None, "charging", "idle"])
+        grid = resample.make_grid(0, 22 * self.MINUTE, self.MINUTE)
+        out = resample.resample(data, grid, resample.DEFAULT_POLICIES, 10 * self.MINUTE, self.MINUTE)
+
+        voltage = out["battery_voltage"]
+        assert voltage[0] == 12.0
+        assert voltage[1] == pytest.approx(12.2)
+        # 1.5 -> 20 minutes is longer than max_gap, so nothing is invented
+        assert numpy.isnan(voltage[2:20]).all()
+        assert voltage[20] == 13.0
+        assert numpy.isnan(voltage[21])
+
+        state = out["battery_state"].tolist()
+        assert state[:3] == ["idle", "idle", "idle"]
+        assert state[3:14] == ["charging"] * 11
+        assert state[14:20] == [None] * 6  # Last state older than max_gap
+        assert state[20:] == ["idle", "idle"]
+
+    def test_mean_policy_and_grid_alignment(self):
+        data = self._data([0, 0.5, 1, 1.5, 4], [10.0, 20.0, 30.0, 50.0, 1.0], ["idle"] * 5)
+        grid = resample.make_grid(self.MINUTE // 2, 5 * self.MINUTE, 2 * self.MINUTE)
+        assert grid.tolist() == [2 * self.MINUTE, 4 * self.MINUTE]
+        policies = resample.parse_policies("battery_voltage:mean")
+        out = resample.resample(data, resample.make_grid(0, 4 * self.MINUTE, 2 * self.MINUTE), policies,
+                                10 * self.MINUTE, 2 * self.MINUTE)
+        assert out["battery_voltage"].tolist()[0] == 27.5
+        assert numpy.isnan(out["battery_voltage"][1])
+
+    def test_mean_over_a_single_bucket_grid(self):
+        # One day of minutes: a one-point grid still averages the whole bucket, not max_gap
+        minutes = list(range(60))
+        data = self._data(minutes, [float(m) for m in minutes], ["idle"] * 60)
+        grid = resample.make_grid(0, self.MINUTE * 60 * 24, self.MINUTE * 60 * 24)
+        assert len(grid) == 1
+        out = resample.resample(data, grid, resample.parse_policies("battery_voltage:mean"),
+                                10 * self.MINUTE, self.MINUTE * 60 * 24)
+        assert out["battery_voltage"].tolist() == [29.5]
+
+    @pytest.mark.parametrize("value", ["5", "0m", "1w", "m"])
+    def test_rejects_bad_durations(self, value):
+        with pytest.raises(ValueError):
+            resample.parse_duration(value)
+
+    def test_rejects_bad_policies(self):
+        for spec in ("battery_state:linear", "nope:ffill", "solar_power:cubic"):
+            with pytest.raises(ValueError):
+                resample.parse_policies(spec)
+
+    def _add(self, readings):
+        db = SessionLocal()
+        try:
+            db.add_all([EnergyReading(**r) for r in readings])
+            db.commit()
+        finally:
+            db.close()
+
+    def test_history_and_export_resampled(self):
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        self._add({"timestamp": now - timedelta(minutes=m, seconds=17), "battery_voltage": 12.0 + m / 100,
+                   "battery_state": "idle"} for m in range(30))
+
+        readings = client.get("/api/history?hours=1&resample=5m").json()["readings"]
+        assert len(readings) == 12
+        steps = {datetime.fromisoformat(b["timestamp"]) - datetime.fromisoformat(a["timestamp"])
+                 for a, b in zip(readings, readings[1:], strict=False)}
+        assert steps == {timedelta(minutes=5)}
+        assert all(datetime.fromisoformat(r["timestamp"]).minute % 5 == 0 for r in readings)
+        filled = [r for r in readings if r["battery_voltage"] is not None]
+        assert 5 <= len(filled) <= 7
+        assert {r["battery_state"] for r in filled} == {"idle"}
+
+        start = (now - timedelta(hours=1)).isoformat()
+        response = client.get(f"/api/export?start={start}&fields=battery_voltage&resample=15m")
+        lines = response.text.strip().splitlines()
+        assert lines[0] == "timestamp,battery_voltage"
+        assert len(lines) == 5
+
+        assert client.get("/api/history?resample=5").status_code == 422
+        assert client.get("/api/history?resample=5m&policy=battery_state:mean").status_code == 422
+        assert client.get("/api/history?hours=87600&resample=1s").status_code == 422
+
+    def test_query_resampled_is_time_weighted(self):
+        start = datetime(2026, 3, 1)
+        # One reading at 100 W for the first half hour, then 59 at 0 W for the second
+        self._add([{"timestamp": start, "solar_power": 100.0},
+                   *({"timestamp": start + timedelta(minutes=30 + m / 2), "solar_power": 0.0} for m in range(59))])
+        params = {"fields": "solar_power", "group_by": "hour_of_day", "tz": "UTC",
+                  "start": start.isoformat(), "end": (start + timedelta(hours=1)).isoformat()}
+        raw = client.get("/api/query", params=params).json()
+        assert raw["groups"][0]["solar_power"]["mean"] < 2
+        resampled = client.get("/api/query", params={
+            **params, "resample": "1m", "max_gap": "30m", "policy": "solar_power:ffill",
+        }).json()
+        assert resampled["groups"][0]["solar_power"] == {"mean": 50.0}
+
+
+class TestCompression:
+    def _add(self, count: int):
+        db = SessionLocal()
+        now = datetime.utcnow()
+        db.add_all(EnergyReading(timestamp=now - timedelta(minutes=i), battery_voltage=12.5, solar_power=100.0)
+                   for i in range(count))
+        db.commit()
+        db.close()
+
+    def test_choose_encoding(self):
+        assert choose_encoding("gzip, deflate, br") == "br"
+        assert choose_encoding("gzip, br;q=0") == "gzip"
+        assert choose_encoding("deflate") is None
+        assert choose_encoding("") is None
+
+    @pytest.mark.parametrize("encoding,decode", [("gzip", gzip.decompress), ("br", brotli.decompress)])
+    def test_negotiates_encoding(self, encoding, decode):
+        self._add(100)
+        raw = client.get("/api/history", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in raw.headers
+        response = client.get("/api/history", headers={"Accept-Encoding": encoding})
+        assert response.headers["content-encoding"] == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(raw.content) / 4
+        assert response.json() == raw.json()
+
+    def test_small_responses_not_compressed(self):
+        response = client.get("/api/health", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+    def test_snapshot_cached_until_new_reading(self, monkeypatch):
+        self._add(10)
+        headers = {"Accept-Encoding": "gzip"}
+        assert client.get("/api/history", headers=headers).headers["x-cache"] == "miss"
+        assert client.get("/api/history", headers=headers).headers["x-cache"] == "hit"
+        # Other encodings are compressed once from the same snapshot
+        assert client.get("/api/history", headers={"Accept-Encoding": "br"}).headers["x-cache"] == "hit"
+        assert client.get("/api/history?hours=2", headers=headers).headers["x-cache"] == "miss"
+
+        monkeypatch.setattr(main, "_latest_reading", {"timestamp": datetime.utcnow()})
+        response = client.get("/api/history", headers=headers)
+        assert response.headers["x-cache"] == "miss"
+        assert len(response.json()["readings"]) == 10
+        assert main.response_cache.metrics()["entries"] == 2
+
+    def test_streamed_export_compressed(self):
+        self._add(50)
+        start = (datetime.utcnow() - timedelta(hours=2)).isoformat()
+        with client.stream("GET", f"/api/export?start={start}", headers={"Accept-Encoding": "gzip"}) as response:
+            assert response.headers["content-encoding"] == "gzip"
+            assert "content-length" not in response.headers
+            body = b"".join(response.iter_raw())
+        assert len(gzip.decompress(body).decode().strip().splitlines()) == 51
+
+
+class TestSpool:
+    def _reading(self, minutes_ago: float, **values) -> dict:
+        reading = dict.fromkeys(READING_FIELDS)
+        reading.update(timestamp=datetime.utcnow().replace(microsecond=0) - timedelta(minutes=minutes_ago), **values)
+        return reading
+
+    def _count(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(EnergyReading).count()
+        finally:
+            db.close()
+
+    def test_records_round_trip(self, tmp_path):
+        spool = Spool(str(tmp_path / "spool.bin"))
+        readings = [
+            self._reading(2, battery_soc=81.5, battery_state="charging"),
+            self._reading(1, solar_power=0.0, humidity=None),
+        ]
+        spool.append(readings[:1])
+        spool.append(readings[1:])
+        with open(spool.path, "rb") as f:
+            decoded, corrupt, end = scan(f.read())
+        assert decoded == readings
+        assert corrupt == 0
+        assert end == os.path.getsize(spool.path)
+
+    def test_torn_tail_cut_and_corrupt_records_skipped(self, tmp_path):
+        spool = Spool(str(tmp_path / "spool.bin"))
+        spool.append([self._reading(3, battery_soc=70.0), self._reading(2, battery_soc=71.0)])
+        with open(spool.path, "r+b") as f:
+            data = bytearray(f.read())
+            data[-1] ^= 0xFF  # Flip a byte in the last record
+            f.seek(0)
+            f.write(data + b"\x20\x00\x01")  # Plus half a record from a crash mid-append
+        spool = Spool(spool.path)
+        spool.append([self._reading(1, battery_soc=72.0)])
+
+        assert spool.replay() == 2
+        assert spool.corrupt == 1
+        assert self._count() == 2
+        assert spool.pending_bytes() == 0
+
+    def test_failed_write_spooled_then_replayed(self, tmp_path, monkeypatch):
+        writer = ReadingWriter(Spool(str(tmp_path / "spool.bin")))
+        readings = [self._reading(3 - i, battery_soc=60.0 + i) for i in range(3)]
+        original = insert_readings
+
+        def locked(rows):
+            raise OSError("database is locked")
+
+        monkeypatch.setattr("spool.insert_readings", locked)
+        writer.store_now(readings[:2])
+        assert writer.degraded
+        assert self._count() == 0
+
+        monkeypatch.setattr("spool.insert_readings", original)
+        original(readings[:1])  # As if the failed write had committed after all
+        writer.spool.append(readings[2:])
+        assert writer.spool.replay() == 2
+        assert self._count() == 3
+        assert writer.spool.replay() == 0
+
+    def test_slow_database_does_not_block_submit(self, tmp_path, monkeypatch):
+        def slow(rows):
+            time.sleep(0.5)
+            raise OSError("disk I/O error")
+
+        monkeypatch.setattr("spool.insert_readings", slow)
+        writer = ReadingWriter(Spool(str(tmp_path / "spool.bin")), timeout=0.05, replay_interval=3600)
+
+        async def scenario():
+            task = asyncio.create_task(writer.run(lambda: False))
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            for i in range(5):
+                writer.submit(self._reading(5 - i, battery_soc=50.0 + i))
+            submitted = time.perf_counter() - started
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            return submitted
+
+        assert asyncio.run(scenario()) < 0.01
+        assert writer.degraded
+        with open(writer.spool.path, "rb") as f:
+            readings, _, _ = scan(f.read())
+        assert [r["battery_soc"] for r in readings] == [50.0, 51.0, 52.0, 53.0, 54.0]
+
+    def test_follower_writes_to_database_again_once_spool_replayed(self, tmp_path, monkeypatch):
+        writer = ReadingWriter(Spool(str(tmp_path / "spool.bin")), replay_interval=0.01)
+
+        def locked(rows):
+            raise OSError("database is locked")
+
+        async def scenario():
+            task = asyncio.create_task(writer.run(lambda: False))
+            await asyncio.sleep(0)
+            with monkeypatch.context() as m:
+                m.setattr("spool.insert_readings", locked)
+                writer.submit(self._reading(2, battery_soc=50.0))
+                await asyncio.sleep(0.05)
+            assert writer.degraded
+            # The leader replays the shared spool
+            assert Spool(writer.spool.path).replay() == 1
+            await asyncio.sleep(0.05)
+            assert not writer.degraded
+            writer.submit(self._reading(1, battery_soc=51.0))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+        assert self._count() == 2
+        assert writer.spool.pending_bytes() == 0
+
+    def test_unreadable_spool_files_moved_aside(self, tmp_path):
+        path = tmp_path / "spool.bin"
+        path.write_bytes(b"garbage, not a spool file")
+        spool = Spool(str(path))
+        spool.append([self._reading(2, battery_soc=50.0)])
+        assert len(list(tmp_path.glob("spool.bin.*.corrupt"))) == 1
+
+        (tmp_path / "spool.bin.replay").write_bytes(b"more garbage")
+        assert spool.replay() == 0
+        assert len(list(tmp_path.glob("spool.bin.*.corrupt"))) == 2
+        assert spool.replay() == 1
+        assert spool.pending_bytes() == 0
+
+    def test_writer_survives_unexpected_spool_errors(self, tmp_path, monkeypatch):
+        writer = ReadingWriter(Spool(str(tmp_path / "spool.bin")), replay_interval=3600)
+        calls = []
+
+        def locked(rows):
+            raise OSError("database is locked")
+
+        monkeypatch.setattr("spool.insert_readings", locked)
+
+        def broken(readings):
+            calls.append(len(readings))
+            if len(calls) == 1:
+                raise ValueError("boom")
+
+        monkeypatch.setattr(writer.spool, "append", broken)
+
+        async def scenario():
+            task = asyncio.create_task(writer.run(lambda: False))
+            await asyncio.sleep(0)
+            writer.submit(self._reading(2, battery_soc=50.0))
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            writer.submit(self._reading(1, battery_soc=51.0))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+        # The failed batch was kept and written with the next reading
+        assert calls == [1, 2]
+
+    def test_stored_reading_reaches_database(self):
+        parsed = dict.fromkeys(READING_FIELDS)
+        parsed.update(battery_soc=90.0, battery_state="idle")
+        main.store_reading(parsed)
+        assert self._count() == 1
+        assert client.get("/api/metrics").json()["storage"]["stored"] == 1
+
+
+class TestDiagnostics:
+    def _diagnostics(self) -> dict:
+        with open(os.path.join(os.path.dirname(__file__), "fixtures", "vrm_diagnostics.json")) as f:
+            data = json.load(f)
+        data["records"] += [
+            {"code": "MCS", "instance": 288, "Device": "Solar Charger", "description": "Charge state", "rawValue": "Bulk"},
+            {"code": "ScT", "instance": 288, "Device": "Solar Charger", "description": "Temperature", "rawValue": 31.5},
+            {"code": "ScT", "instance": 289, "Device": "Solar Charger", "description": "Temperature", "rawValue": "29"},
+            {"code": "ERR", "instance": 288, "rawValue": None},
+        ]
+        return data
+
+    def _store(self, data: dict):
+        vrm = VRMClient.__new__(VRMClient)
+        parsed = vrm.parse_diagnostic_data(data)
+        parsed["attributes"] = vrm.parse_attributes(data)
+        main.store_reading(parsed)
+
+    def test_parse_attributes_keeps_every_code(self):
+        data = self._diagnostics()
+        attributes = {(a.code, a.instance): a for a in VRMClient.__new__(VRMClient).parse_attributes(data)}
+        assert len(attributes) == len(data["records"]) - 1
+        assert attributes[("bv", 0)].value == 12.95
+        assert attributes[("MCS", 288)].value == "Bulk"
+        assert attributes[("ScT", 289)].value == 29.0
+        assert attributes[("ScT", 288)].device == "Solar Charger"
+
+    def test_series_per_code_and_instance(self):
+        data = self._diagnostics()
+        self._store(data)
+        data["records"][-3]["rawValue"] = 33.0
+        self._store(data)
+
+        listed = client.get("/api/diagnostics").json()["attributes"]
+        assert {"code": "ScT", "instance": 289, "device": "Solar Charger", "description": "Temperature"} in listed
+
+        series = client.get("/api/diagnostics/ScT?instance=288").json()
+        assert [p["value"] for p in series["points"]] == [31.5, 33.0]
+        assert client.get("/api/diagnostics/MCS?instance=288").json()["points"][0]["value"] == "Bulk"
+        assert len(client.get("/api/diagnostics/ScT?instance=289").json()["points"]) == 2
+        assert client.get("/api/diagnostics/ScT").status_code == 404
+
+    def test_attributes_survive_the_spool(self, tmp_path):
+        vrm = VRMClient.__new__(VRMClient)
+        reading = dict.fromkeys(READING_FIELDS)
+        reading.update(timestamp=datetime.utcnow().replace(microsecond=0),
+                       attributes=vrm.parse_attributes(self._diagnostics()))
+        spool = Spool(str(tmp_path / "spool.bin"))
+        spool.append([reading])
+        with open(spool.path, "rb") as f:
+            (decoded,), _, _ = scan(f.read())
+        assert [(a.code, a.instance, a.value) for a in decoded["attributes"]] == [
+            (a.code, a.instance, a.value) for a in reading["attributes"]
+        ]
+
+        assert spool.replay() == 1
+        assert client.get("/api/diagnostics/MCS?instance=288").json()["points"][0]["value"] == "Bulk"
+
+    def test_cleanup_removes_expired_values(self):
+        self._store(self._diagnostics())
+        db = SessionLocal()
+        try:
+            db.query(EnergyReading).update({"timestamp": datetime.utcnow() - timedelta(days=8)})
+            db.commit()
+            self._store(self._diagnostics())
+            cleanup_old_readings()
+            assert db.query(DiagnosticValue).count() == len(self._diagnostics()["records"]) - 1
+        finally:
+            db.close()
+
+
+    def test_failed_archive_keeps_values(self, monkeypatch):
+        self._store(self._diagnostics())
+        db = SessionLocal()
+        try:
+            db.query(EnergyReading).update({"timestamp": datetime.utcnow() - timedelta(days=8)})
+            db.commit()
+
+            def fail(*args):
+                raise OSError("disk full")
+
+            monkeypatch.setattr(archive, "write_day_file", fail)
+            cleanup_old_readings()
+            assert db.query(EnergyReading).count() == 1
+            assert db.query(DiagnosticValue).count() == len(self._diagnostics()["records"]) - 1
+        finally:
+            db.close()
+
+    def test_retention_delete_uses_reading_index(self):
+        with engine.connect() as conn:
+            plan = conn.exec_driver_sql(
+                "EXPLAIN QUERY PLAN DELETE FROM diagnostic_values WHERE reading_id IN (1, 2)"
+            ).all()
+        assert "ix_diagnostic_values_reading_id" in " ".join(row[-1] for row in plan)
+
+class TestBatteryHealth:
+    def _add(self, readings):
+        db = SessionLocal()
+        try:
+            db.add_all([EnergyReading(**r) for r in readings])
+            db.commit()
+        finally:
+            db.close()
+
+    def _two_hours(self, start: datetime) -> list[dict]:
+        # Discharge at 10 A from 80% to 40%, then charge at 5 A back to 60%
+        readings = []
+        for m in range(121):
+            soc = 80 - 40 * m / 60 if m <= 60 else 40 + 20 * (m - 60) / 60
+            current = -10.0 if m < 60 else 5.0
+            readings.append({"timestamp": start + timedelta(minutes=m), "battery_soc": soc,
+                             "battery_current": current, "battery_power": current * 12})
+        return readings
+
+    def test_rainflow_astm_example(self):
+        ranges, counts = battery_health.rainflow(numpy.array([-2, 1, -3, 5, -1, 3, -4, 4, -2.0]))
+        totals = {}
+        for r, c in zip(ranges.tolist(), counts.tolist(), strict=True):
+            totals[r] = totals.get(r, 0) + c
+        assert totals == {3.0: 0.5, 4.0: 1.5, 6.0: 0.5, 8.0: 1.0, 9.0: 0.5}
+
+    def test_daily_throughput_cycles_and_time_below_min_soc(self):
+        readings = self._two_hours(datetime(2026, 1, 10, 1))
+        # A reading after a long outage adds nothing
+        readings.append({**readings[-1], "timestamp": readings[-1]["timestamp"] + timedelta(hours=2)})
+        self._add(readings)
+        data = analytics.load_columns(datetime(2026, 1, 10), datetime(2026, 1, 11), battery_health.HEALTH_FIELDS)
+        day = battery_health.compute_days(data, capacity_ah=150, min_soc=50)[date(2026, 1, 10)]
+
+        assert day["samples"] == 122
+        assert day["discharge_ah"] == pytest.approx(10.0)
+        assert day["charge_ah"] == pytest.approx(5.0)
+        assert day["discharge_wh"] == pytest.approx(120.0)
+        assert day["equivalent_cycles"] == pytest.approx(10 / 150, abs=1e-4)
+        assert day["seconds_below_min_soc"] == pytest.approx(44 * 60)
+        # Down 40% and back up 20% closes no cycle yet: both swings carry over
+        assert day["dod_histogram"] == [0] * 10
+        assert day["residual"] == [80, 40, 60]
+
+    def test_cycle_across_midnight_is_not_split(self):
+        # 90% -> 20% overnight, then charged back to 90% the next afternoon
+        start = datetime(2026, 1, 10, 22)
+        readings = []
+        for m in range(0, 16 * 60 + 1, 5):
+            soc = 90 - 70 * m / 480 if m <= 480 else 20 + 70 * (m - 480) / 480
+            readings.append({"timestamp": start + timedelta(minutes=m), "battery_soc": soc,
+                             "battery_current": -5.0, "battery_power": -60.0})
+        self._add(readings)
+
+        first = battery_health.refresh_days(date(2026, 1, 10), date(2026, 1, 10), 150, 50)
+        second = battery_health.refresh_days(date(2026, 1, 11), date(2026, 1, 11), 150, 50)
+        assert first[date(2026, 1, 10)]["dod_histogram"] == [0] * 10
+        # One 70% half cycle down, closed by the 70% charge back up
+        assert second[date(2026, 1, 11)]["dod_histogram"] == [0, 0, 0, 0, 0, 0, 0, 0.5, 0, 0]
+        assert second[date(2026, 1, 11)]["residual"] == [20, 90]
+
+        ranges, counts = battery_health.rainflow(numpy.array([r["battery_soc"] for r in readings]))
+        whole = battery_health.dod_histogram(ranges, counts)
+        by_day = [a + b for a, b in zip(
+            second[date(2026, 1, 11)]["dod_histogram"],
+            battery_health.dod_histogram(*battery_health.half_cycles([20, 90])),
+            strict=True,
+        )]
+        assert by_day == whole
+
+    def test_tracker_matches_batch(self):
+        end = datetime(2026, 3, 5, 12)
+        readings = list(generate(4000, end=end, seed=3))
+        self._add(readings)
+        tracker = battery_health.DailyTracker(150, 50)
+        tracker.start()
+        for reading in readings:
+            tracker.observe(reading)
+        tracker.process()
+        incremental = {**tracker.finished, tracker.day: tracker.snapshot()}
+
+        end = readings[-1]["timestamp"] + timedelta(seconds=1)
+        data = analytics.load_columns(readings[0]["timestamp"], end, battery_health.HEALTH_FIELDS)
+        batch = battery_health.compute_days(data, 150, 50)
+        assert list(incremental) == list(batch)
+        for day, result in batch.items():
+            assert incremental[day]["dod_histogram"] == result["dod_histogram"]
+            assert incremental[day] == pytest.approx(result, rel=1e-6)
+
+    def test_endpoint_reads_archive_and_stores_days(self):
+        start = battery_health.day_start(battery_health.local_today() - timedelta(days=10)) + timedelta(hours=1)
+        self._add(self._two_hours(start))
+        cleanup_old_readings()  # Moves them to the archive
+
+        data = client.get("/api/battery/health?days=12").json()
+        assert data["days"][0]["date"] == (battery_health.local_today() - timedelta(days=10)).isoformat()
+        assert data["days"][0]["discharge_ah"] == pytest.approx(10.0)
+        assert data["days"][0]["hours_below_min_soc"] == pytest.approx(44 / 60, abs=0.01)
+        assert data["totals"]["equivalent_cycles"] == pytest.approx(10 / 150, abs=1e-3)
+        assert data["totals"]["dod_histogram"] == [0, 0, 0.5, 0, 0.5, 0, 0, 0, 0, 0]
+        # Later days without readings are stored as empty, not recomputed
+        db = SessionLocal()
+        try:
+            assert db.query(BatteryHealthDay).count() == 10
+        finally:
+            db.close()
+        assert client.get("/api/battery/health?days=12").json() == data
+
+    def test_store_reading_feeds_tracker(self, monkeypatch):
+        tracker = battery_health.DailyTracker(150, 50)
+        monkeypatch.setattr(main, "battery_tracker", tracker)
+        parsed = dict.fromkeys(READING_FIELDS)
+        parsed.update(battery_soc=45.0, battery_current=-2.0)
+        # Not leader: nothing is queued
+        main.store_reading(parsed)
+        assert not tracker._inbox
+        tracker.start()
+        main.store_reading(parsed)
+        main.store_reading(parsed)
+        tracker.flush()
+        today = client.get("/api/battery/health?days=1").json()["days"]
+        assert today[0]["samples"] == 2
+        tracker.stop()
+        main.store_reading(parsed)
+        assert not tracker._inbox
+
+    def test_resume_picks_up_backfilled_readings(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        start = max(battery_health.day_start(battery_health.local_today()), now - timedelta(hours=2))
+        tracker = battery_health.DailyTracker(150, 50)
+        tracker.start()
+        latest = {"timestamp": now, "battery_soc": 80.0, "battery_current": 0.0, "battery_power": 0.0}
+        self._add([latest])
+        tracker.observe(latest)
+        tracker.process()
+        assert tracker.snapshot()["samples"] == 1
+
+        # Backfill stores a reading from earlier today: skipped until resumed
+        self._add([{**latest, "timestamp": start}])
+        tracker.observe({**latest, "timestamp": start})
+        tracker.process()
+        assert tracker.snapshot()["samples"] == 1
+        tracker.invalidate()
+        tracker.resume()
+        assert not tracker.stale
+        assert tracker.snapshot()["samples"] == 2
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+VRM_CONNECT_TIMEOUT = float(os.getenv("VRM_CONNECT_TIMEOUT", "5"))
+VRM_READ_TIMEOUT = float(os.getenv("VRM_READ_TIMEOUT", "10"))
+VRM_MAX_RETRIES = int(os.getenv("VRM_MAX_RETRIES", "2"))
+VRM_REQUEST_DEADLINE = float(os.getenv("VRM_REQUEST_DEADLINE", "20"))  # Seconds per call, retries included
+VRM_BREAKER_THRESHOLD = int(os.getenv("VRM_BREAKER_THRESHOLD", "5"))
+VRM_BREAKER_RESET = float(os.getenv("VRM_BREAKER_RESET", "60"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without making a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Classic closed -> open -> half-open breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    rejects calls for `reset_timeout` seconds. It then lets a single trial
+    request through (half-open): success closes it, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = VRM_BREAKER_THRESHOLD,
+                 reset_timeout: float = VRM_BREAKER_RESET, name: str = "vrm"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.transitions = {self.CLOSED: 0, self.OPEN: 0, self.HALF_OPEN: 0}
+        self.history: deque[dict] = deque(maxlen=20)
+        self._trial_in_flight = False
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.history.append({
+            "from": self.state,
+            "to": state,
+            "at": datetime.now(timezone.utc).isoformat(),
+        })
+        self.state = state
+        self.transitions[state] += 1
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_in_flight = False
+        self._transition(self.CLOSED)
+
+    def release(self):
+        """Give up a half-open trial without a verdict (the request was cancelled)."""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds to wait."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class ResilientTransport:
+    """Shared HTTP client with bounded retries and a circuit breaker.
+
+    Connection errors, timeouts, 5xx and 429 responses are retried up to
+    `max_retries` times with full-jitter exponential backoff (or the
+    server's Retry-After, if given), as long as the retry still fits inside
+    `deadline` seconds. The last response is returned as-is so callers can
+    still `raise_for_status()`.
+    """
+
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_retries: int = VRM_MAX_RETRIES,
+        deadline: float = VRM_REQUEST_DEADLINE,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.timeout = httpx.Timeout(
+            connect=VRM_CONNECT_TIMEOUT, read=VRM_READ_TIMEOUT, write=VRM_READ_TIMEOUT, pool=VRM_CONNECT_TIMEOUT
+        )
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._transport = transport
+        # Reuse a single HTTP client to prevent memory leaks from repeated SSL context creation
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=self._transport)
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        self.counters["requests"] += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.counters["rejected"] += 1
+                raise CircuitOpenError(f"Circuit breaker open for {self.breaker.name}")
+
+            delay = None
+            try:
+                response = await self._get_client().request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error, response = e, None
+            except Exception:
+                # Anything else (a bad URL, a decode error) must not leave a half-open trial in flight
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Cancelled, KeyboardInterrupt, SystemExit: not VRM's fault, just give the trial slot back
+                self.breaker.release()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                # 429 means VRM is up but throttling us: not a breaker failure
+                if response.status_code == 429:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                error = None
+
+            if delay is None:
+                delay = self._backoff(attempt)
+            elapsed = time.monotonic() - started
+            if attempt >= self.max_retries or elapsed + delay >= self.deadline:
+                self.counters["failures"] += 1
+                if response is not None:
+                    return response
+                raise error
+
+            attempt += 1
+            self.counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "transitions": dict(self.breaker.transitions),
+                "recent": list(self.breaker.history),
+            },
+        }
@@ -1,16 +1,67 @@
 import logging
 import os
-from typing import Optional
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional, Union
 
 import httpx
 
+from transport import ResilientTransport
+
 logger = logging.getLogger(__name__)
 
-VRM_API_BASE = "https://vrmapi.victronenergy.com/v2"
+VRM_API_BASE = os.getenv("VRM_API_BASE", "https://vrmapi.victronenergy.com/v2")
+
+# Fields of a parsed reading (one EnergyReading column each)
+READING_FIELDS = (
+    "battery_soc",
+    "battery_voltage",
+    "battery_current",
+    "battery_power",
+    "battery_temperature",
+    "solar_power",
+    "solar_voltage",
+    "solar_current",
+    "solar_yield_today",
+    "consumption_power",
+    "temperature",
+    "humidity",
+    "battery_state",
+)
+
+# VRM diagnostic codes mapping (based on actual GlobalLink 520 data)
+CODE_MAPPING = {
+    # Battery/System
+    "bv": "battery_voltage",        # System voltage
+    "bc": "battery_current",        # Battery current
+    "bp": "battery_power",          # Battery power
+    "SOC": "battery_soc",           # State of charge (if BMV present)
+    "bst": "battery_state",         # Battery state (charging/idle/discharging)
+    # Solar Charger
+    "PVP": "solar_power",           # PV power
+    "ScV": "solar_voltage",         # Solar charger voltage
+    "ScI": "solar_current",         # Solar charger current
+    "ScW": "solar_power",           # Battery watts from solar (alt)
+    "YT": "solar_yield_today",      # Yield today
+    # Temperature sensor
+    "tsT": "temperature",           # Temperature
+    "tsH": "humidity",              # Humidity
+    # Load
+    "SLI": "consumption_power",     # Load current (will need conversion)
+}
+
+
+class Attribute(NamedTuple):
+    """One diagnostic record's value; numeric values are floats."""
+
+    code: str
+    instance: int
+    value: Union[float, str]
+    device: Optional[str] = None
+    description: Optional[str] = None
 
 
 class VRMClient:
-    def __init__(self):
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.token = os.getenv("VRM_TOKEN")
         self.installation_id = os.getenv("VRM_INSTALLATION_ID")
 
@@ -23,28 +74,19 @@ class VRMClient:
             "X-Authorization": f"Token {self.token}",
             "Content-Type": "application/json"
         }
-        # Reuse a single HTTP client to prevent memory leaks from repeated SSL context creation
-        self._client: Optional[httpx.AsyncClient] = None
-
-    async def _get_client(self) -> httpx.AsyncClient:
-        """Get or create the shared HTTP client."""
-        if self._client is None or self._client.is_closed:
-            self._client = httpx.AsyncClient(timeout=30.0)
-        return self._client
+        # Retries, timeouts and circuit breaking around one shared HTTP client
+        self.http = ResilientTransport(transport=transport)
 
     async def close(self):
         """Close the HTTP client."""
-        if self._client is not None and not self._client.is_closed:
-            await self._client.aclose()
-            self._client = None
+        await self.http.close()
 
     async def get_installation_stats(self) -> Optional[dict]:
         """Get current system stats from VRM."""
         url = f"{VRM_API_BASE}/installations/{self.installation_id}/system-overview"
 
         try:
-            client = await self._get_client()
-            response = await client.get(url, headers=self.headers)
+            response = await self.http.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except httpx.HTTPError as e:
@@ -56,8 +98,7 @@ class VRMClient:
         url = f"{VRM_API_BASE}/installations/{self.installation_id}/diagnostics"
 
         try:
-            client = await self._get_client()
-            response = await client.get(url, headers=self.headers)
+            response = await self.http.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except httpx.HTTPError as e:
@@ -69,68 +110,81 @@ class VRMClient:
         url = f"{VRM_API_BASE}/installations/{self.installation_id}/widgets/summary"
 
         try:
-            client = await self._get_client()
-            response = await client.get(url, headers=self.headers)
+            response = await self.http.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except httpx.HTTPError as e:
             logger.error(f"Failed to fetch VRM widgets: {e}")
             return None
 
+    async def get_stats(
+        self, start: datetime, end: datetime, codes: list[str], interval: str = "15mins"
+    ) -> Optional[dict]:
+        """Get historical stats (mean/min/max per interval) for the given attribute codes."""
+        url = f"{VRM_API_BASE}/installations/{self.installation_id}/stats"
+        params = [
+            ("type", "custom"),
+            ("interval", interval),
+            ("start", int(start.replace(tzinfo=timezone.utc).timestamp())),
+            ("end", int(end.replace(tzinfo=timezone.utc).timestamp())),
+        ] + [("attributeCodes[]", code) for code in codes]
+
+        try:
+            response = await self.http.get(url, headers=self.headers, params=params)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to fetch VRM stats: {e}")
+            return None
+
+    def parse_stats_data(self, data: dict) -> list[tuple[datetime, dict]]:
+        """Parse historical stats into (UTC timestamp, parsed reading) pairs, oldest first.
+
+        Each record is [timestamp_ms, mean, min, max]; the mean is used.
+        """
+        readings: dict[int, dict] = {}
+        if not data or not isinstance(data.get("records"), dict):
+            return []
+
+        for code, points in data["records"].items():
+            field = CODE_MAPPING.get(code)
+            if field is None or field == "battery_state" or not isinstance(points, list):
+                continue
+            for point in points:
+                try:
+                    ts_ms, value = int(point[0]), float(point[1])
+                except (ValueError, TypeError, IndexError):
+                    continue
+                readings.setdefault(ts_ms, dict.fromkeys(READING_FIELDS))[field] = value
+
+        result = []
+        for ts_ms in sorted(readings):
+            parsed = readings[ts_ms]
+            if parsed["battery_soc"] is None and parsed["battery_voltage"] is not None:
+                parsed["battery_soc"] = self._estimate_soc_from_voltage(parsed["battery_voltage"])
+            ts = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+            result.append((ts, parsed))
+        return result
+
     def parse_diagnostic_data(self, data: dict) -> dict:
         """Parse diagnostic data into a structured format."""
-        parsed = {
-            "battery_soc": None,
-            "battery_voltage": None,
-            "battery_current": None,
-            "battery_power": None,
-            "battery_temperature": None,
-            "solar_power": None,
-            "solar_voltage": None,
-            "solar_current": None,
-            "solar_yield_today": None,
-            "consumption_power": None,
-            "temperature": None,
-            "humidity": None,
-            "battery_state": None,
-        }
+        parsed = dict.fromkeys(READING_FIELDS)
 
         if not data or "records" not in data:
             return parsed
 
-        # VRM diagnostic codes mapping (based on actual GlobalLink 520 data)
-        code_mapping = {
-            # Battery/System
-            "bv": "battery_voltage",        # System voltage
-            "bc": "battery_current",        # Battery current
-            "bp": "battery_power",          # Battery power
-            "SOC": "battery_soc",           # State of charge (if BMV present)
-            "bst": "battery_state",         # Battery state (charging/idle/discharging)
-            # Solar Charger
-            "PVP": "solar_power",           # PV power
-            "ScV": "solar_voltage",         # Solar charger voltage
-            "ScI": "solar_current",         # Solar charger current
-            "ScW": "solar_power",           # Battery watts from solar (alt)
-            "YT": "solar_yield_today",      # Yield today
-            # Temperature sensor
-            "tsT": "temperature",           # Temperature
-            "tsH": "humidity",              # Humidity
-            # Load
-            "SLI": "consumption_power",     # Load current (will need conversion)
-        }
-
         # Records is a list of items
         for item in data.get("records", []):
             code = item.get("code")
-            if code in code_mapping:
+            if code in CODE_MAPPING:
                 try:
                     raw = item.get("rawValue")
                     if raw is not None:
                         if code == "bst":
                             # Battery state is a string
-                            parsed[code_mapping[code]] = str(raw)
+                            parsed[CODE_MAPPING[code]] = str(raw)
                         else:
-                            parsed[code_mapping[code]] = float(raw)
+                            parsed[CODE_MAPPING[code]] = float(raw)
                 except (ValueError, TypeError):
                     pass
 
@@ -140,23 +194,47 @@ class VRMClient:
 
         return parsed
 
+    def parse_attributes(self, data: dict) -> list[Attribute]:
+        """Every diagnostic record with a value, mapped to a reading field or not."""
+        attributes = {}
+        for item in (data or {}).get("records", []):
+            code, raw = item.get("code"), item.get("rawValue")
+            if not code or raw is None:
+                continue
+            try:
+                value = float(raw)
+            except (ValueError, TypeError):
+                if not isinstance(raw, str):
+                    continue
+                value = raw
+            try:
+                instance = int(item.get("instance") or 0)
+            except (ValueError, TypeError):
+                instance = 0
+            attributes[(code, instance)] = Attribute(code, instance, value, item.get("Device"), item.get("description"))
+        return list(attributes.values())
+
     def _estimate_soc_from_voltage(self, voltage: float) -> float:
-        """
-        Estimate SOC from voltage for 12V lead-acid battery.
-        This is approximate and works best for resting batteries (no load/charge).
-
-        Voltage table (resting, 25°C):
-        12.70V+ = 100%
-        12.50V  = 75%
-        12.30V  = 50%
-        12.10V  = 25%
-        11.90V  = 0%
-        """
-        if voltage >= 12.70:
-            return 100.0
-        elif voltage <= 11.90:
-            return 0.0
-        else:
-            # Linear interpolation between 11.9V (0%) and 12.7V (100%)
-            soc = (voltage - 11.90) / (12.70 - 11.90) * 100.0
-            return round(soc, 1)
+        return estimate_soc_from_voltage(voltage)
+
+
+def estimate_soc_from_voltage(voltage: float) -> float:
+    """
+    Estimate SOC from voltage for 12V lead-acid battery.
+    This is approximate and works best for resting batteries (no load/charge).
+
+    Voltage table (resting, 25°C):
+    12.70V+ = 100%
+    12.50V  = 75%
+    12.30V  = 50%
+    12.10V  = 25%
+    11.90V  = 0%
+    """
+    if voltage >= 12.70:
+        return 100.0
+    elif voltage <= 11.90:
+        return 0.0
+    else:
+        # Linear interpolation between 11.9V (0%) and 12.7V (100%)
+        soc = (voltage - 11.90) / (12.70 - 11.90) * 100.0
+        return round(soc, 1)